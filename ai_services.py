@@ -1,5 +1,14 @@
 import requests
 import os
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from database import get_db_conn
+from local_classifier import NgramClassifier
 
 # 1. 讀取我們存在環境變數中的 Token
 HF_API_TOKEN = os.getenv("HF_API_TOKEN")
@@ -13,28 +22,304 @@ headers = {
     "Authorization": f"Bearer {HF_API_TOKEN}"
 }
 
-def categorize_spending(notes_list, categories):
-    """
-    使用 Hugging Face API 將一組交易備註分類
-    :param notes_list: [ "7-11 購物", "計程車費", "看電影" ]
-    :param categories: [ "餐飲美食", "交通出行", "休閒娛樂", "其他" ]
-    :return: AI 的原始回覆，或在失敗時回傳 None
-    """
-    if not notes_list:
-        return None
-        
+# 4. 批次設定: 備註去重後切成固定大小的區塊，由有上限的執行緒池同時送出
+AI_BATCH_SIZE = int(os.getenv("AI_BATCH_SIZE", 32)) # 每次 API 呼叫的備註數
+AI_MAX_WORKERS = int(os.getenv("AI_MAX_WORKERS", 4)) # 整個程序同時進行的 API 呼叫上限
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", 15))
+
+_http = requests.Session() # 重複使用 HTTPS 連線
+_executor = ThreadPoolExecutor(max_workers=AI_MAX_WORKERS, thread_name_prefix="ai-model")
+
+
+def _post_chunk(notes, categories):
+    """送出一個區塊，回傳與 notes 等長的 AI 回覆列表，失敗時回傳 None"""
     payload = {
-        "inputs": notes_list,
+        "inputs": notes,
         "parameters": {
             "candidate_labels": categories
         }
     }
     
     try:
-        response = requests.post(MODEL_URL, headers=headers, json=payload, timeout=15)
+        response = _http.post(MODEL_URL, headers=headers, json=payload, timeout=AI_TIMEOUT)
         response.raise_for_status() # 如果 API 回傳 4xx or 5xx 錯誤，就拋出異常
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"AI API 呼叫失敗: {e}")
+        result = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"AI API 呼叫失敗 ({len(notes)} 則備註): {e}")
         # 在真實應用中，這裡可能需要處理速率限制 (rate limits) 的問題
-        return None
\ No newline at end of file
+        return None
+
+    if isinstance(result, dict): # 只有一則備註時，API 回傳單一物件
+        result = [result]
+    if not isinstance(result, list) or len(result) != len(notes):
+        print(f"AI API 回覆格式不符: 預期 {len(notes)} 筆")
+        return None
+    return result
+
+
+def categorize_spending(notes_list, categories):
+    """
+    使用 Hugging Face API 將一組交易備註分類
+    (重複的備註只送一次；超過 AI_BATCH_SIZE 時分批同時送出，某一批失敗不影響其他批)
+    :param notes_list: [ "7-11 購物", "計程車費", "看電影" ]
+    :param categories: [ "餐飲美食", "交通出行", "休閒娛樂", "其他" ]
+    :return: 與 notes_list 等長、依序對應的 AI 原始回覆 (所在批次失敗的項目為 None)；全部失敗時回傳 None
+    """
+    if not notes_list:
+        return None
+
+    unique_notes = list(dict.fromkeys(notes_list))
+    chunks = [unique_notes[i:i + AI_BATCH_SIZE] for i in range(0, len(unique_notes), AI_BATCH_SIZE)]
+    if len(chunks) == 1:
+        chunk_results = [_post_chunk(chunks[0], categories)]
+    else:
+        futures = [_executor.submit(_post_chunk, chunk, categories) for chunk in chunks]
+        chunk_results = [future.result() for future in futures]
+
+    by_note = {}
+    for chunk, result in zip(chunks, chunk_results):
+        if result is not None:
+            by_note.update(zip(chunk, result))
+    if not by_note:
+        return None
+    return [by_note.get(note) for note in notes_list]
+
+# --- 分類引擎 ---
+# 每個引擎提供 classify(notes, categories) -> [(分類或 None, 信心), ...]，notes 為正規化後的備註。
+# CLASSIFIER_MODE:
+#   remote      只使用 Hugging Face 模型 (失敗時回傳 None)
+#   local       只使用本機 n-gram 模型 (不需網路)
+#   local-first 先用本機模型，信心低於 LOCAL_CONFIDENCE 的備註才送給遠端模型；遠端失敗時沿用本機結果
+CLASSIFIER_MODE = os.getenv("CLASSIFIER_MODE") or ("local-first" if HF_API_TOKEN else "local")
+LOCAL_CONFIDENCE = float(os.getenv("LOCAL_CONFIDENCE", 0.6))
+
+
+class RemoteEngine:
+    """Hugging Face zero-shot 模型"""
+
+    def classify(self, notes, categories):
+        ai_results = categorize_spending(notes, categories)
+        results = []
+        for i in range(len(notes)):
+            try:
+                results.append((ai_results[i]['labels'][0], ai_results[i]['scores'][0]))
+            except (IndexError, KeyError, TypeError):
+                results.append((None, 0.0))
+        return results
+
+
+class LocalEngine:
+    """本機 n-gram 模型 (local_classifier)，每組候選分類一個模型，第一次使用時訓練"""
+
+    def __init__(self):
+        self._models = {} # category_set -> NgramClassifier
+        self._lock = threading.Lock()
+
+    def model_for(self, categories):
+        category_set = _category_set_key(categories)
+        with self._lock:
+            model = self._models.get(category_set)
+            if model is None:
+                model = self._models[category_set] = self._train(categories, category_set)
+        return model
+
+    def _train(self, categories, category_set):
+        """以種子關鍵字 + note_categories 中遠端模型已標記的備註訓練 (本機模型自己的結果不回存，避免自我強化)"""
+        model = NgramClassifier.with_seeds(categories)
+        conn = get_db_conn()
+        try:
+            rows = conn.execute(
+                "SELECT note_key, category FROM note_categories WHERE category_set = ?", (category_set,)
+            ).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            model.learn(row['note_key'], row['category'])
+        return model
+
+    def retrain(self):
+        """捨棄已訓練的模型，下次使用時重新訓練"""
+        with self._lock:
+            self._models.clear()
+
+    def learn(self, categories, note_key, category):
+        self.model_for(categories).learn(note_key, category)
+
+    def classify(self, notes, categories):
+        return self.model_for(categories).classify(notes)
+
+
+ENGINES = {"remote": RemoteEngine(), "local": LocalEngine()}
+
+
+def register_engine(name, engine):
+    """加入 (或取代) 一個分類引擎，例如 register_engine("remote", MyEngine())"""
+    ENGINES[name] = engine
+
+
+def train_local_model(categories):
+    """重新訓練本機模型，回傳訓練筆數 (不含種子關鍵字)"""
+    ENGINES["local"].retrain()
+    model = ENGINES["local"].model_for(categories)
+    return model.samples
+
+
+# --- 分類快取 ---
+# 相同的備註 (例如 "7-11 購物") 每天會被分類上千次，結果先查記憶體 LRU，再查 note_categories 資料表，
+# 都沒有才送給 AI 模型。
+
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", 10000))
+
+_lru = OrderedDict() # (note_key, category_set) -> category
+_lru_lock = threading.Lock()
+_stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "local": 0, "escalated": 0, "model_failures": 0}
+
+
+def _normalize_note(note):
+    """全形/半形統一、去除前後空白、合併連續空白、英文字母轉小寫"""
+    return " ".join(unicodedata.normalize("NFKC", note).split()).lower()
+
+
+def _category_set_key(categories):
+    return hashlib.sha1("|".join(sorted(categories)).encode("utf-8")).hexdigest()[:16]
+
+
+def _lru_get(key):
+    with _lru_lock:
+        category = _lru.get(key)
+        if category is not None:
+            _lru.move_to_end(key)
+        return category
+
+
+def _lru_put(key, category):
+    with _lru_lock:
+        _lru[key] = category
+        _lru.move_to_end(key)
+        while len(_lru) > AI_CACHE_SIZE:
+            _lru.popitem(last=False)
+
+
+def classify_notes(notes_list, categories):
+    """
+    取得每則備註最可能的分類 (有快取，未命中時依 CLASSIFIER_MODE 使用本機及/或遠端模型)。
+    :return: 與 notes_list 等長的列表，元素為分類名稱；遠端模型失敗而無法分類的項目為 None (僅 remote 模式)
+    """
+    return [category for category, _, _ in classify_notes_detailed(notes_list, categories)]
+
+
+def classify_notes_detailed(notes_list, categories):
+    """
+    同 classify_notes，另外回傳每個結果的來源與信心:
+    :return: [(分類或 None, 來源 "remote" / "local" / None, 本機模型的信心或 None), ...]
+             來源 "remote" 包含快取命中 (快取只存遠端模型的結果)
+    """
+    category_set = _category_set_key(categories)
+    keys = [_normalize_note(note) for note in notes_list]
+    resolved = {}
+    local_confidence = {} # 結果來自本機模型的備註 -> 信心
+
+    # 1. 記憶體 LRU
+    for key in set(keys):
+        category = _lru_get((key, category_set))
+        if category is not None:
+            resolved[key] = category
+    memory_hits = len(resolved)
+
+    # 2. 資料庫
+    pending = [key for key in set(keys) if key not in resolved]
+    if pending:
+        conn = get_db_conn()
+        try:
+            for i in range(0, len(pending), 500):
+                chunk = pending[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT note_key, category FROM note_categories WHERE category_set = ? "
+                    f"AND note_key IN ({','.join('?' * len(chunk))})",
+                    (category_set, *chunk)
+                ).fetchall()
+                for row in rows:
+                    resolved[row['note_key']] = row['category']
+                    _lru_put((row['note_key'], category_set), row['category'])
+        finally:
+            conn.close()
+    db_hits = len(resolved) - memory_hits
+
+    # 3. 快取未命中的備註 (去重後) 依 CLASSIFIER_MODE 交給本機及/或遠端模型
+    misses = [key for key in set(keys) if key not in resolved]
+    local_count = escalated = 0
+    new_rows = []
+    if misses:
+        originals = {}
+        for note, key in zip(notes_list, keys):
+            originals.setdefault(key, note)
+
+        remote_keys = misses
+        if CLASSIFIER_MODE in ("local", "local-first"):
+            local_results = ENGINES["local"].classify(misses, categories)
+            remote_keys = []
+            for key, (category, confidence) in zip(misses, local_results):
+                resolved[key] = category # 本機結果不寫入快取 (重新計算很便宜，且模型會持續學習)
+                local_confidence[key] = confidence
+                if CLASSIFIER_MODE == "local-first" and confidence < LOCAL_CONFIDENCE:
+                    remote_keys.append(key)
+            local_count = len(misses) - len(remote_keys)
+            escalated = len(remote_keys) if CLASSIFIER_MODE == "local-first" else 0
+
+        if remote_keys:
+            remote_results = ENGINES["remote"].classify([originals[key] for key in remote_keys], categories)
+            for key, (category, _) in zip(remote_keys, remote_results):
+                if category is None:
+                    continue # local-first 時保留本機結果；remote 模式則為 None (分類失敗)
+                resolved[key] = category
+                local_confidence.pop(key, None)
+                _lru_put((key, category_set), category)
+                new_rows.append((key, category_set, category, time.time()))
+                learn = getattr(ENGINES.get("local"), "learn", None)
+                if learn:
+                    learn(categories, key, category) # 本機模型從遠端結果學習
+
+        if new_rows:
+            conn = get_db_conn()
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO note_categories (note_key, category_set, category, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    new_rows
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"分類快取寫入失敗: {e}")
+            finally:
+                conn.close()
+
+    with _lru_lock:
+        _stats["memory_hits"] += memory_hits
+        _stats["db_hits"] += db_hits
+        _stats["misses"] += len(misses)
+        _stats["local"] += local_count
+        _stats["escalated"] += escalated
+        _stats["model_failures"] += sum(1 for key in misses if key not in resolved)
+
+    results = []
+    for key in keys:
+        category = resolved.get(key)
+        if category is None:
+            results.append((None, None, None))
+        elif key in local_confidence:
+            results.append((category, "local", local_confidence[key]))
+        else:
+            results.append((category, "remote", None))
+    return results
+
+
+def cache_stats():
+    """分類快取的命中 / 未命中次數 (以不重複備註計)"""
+    with _lru_lock:
+        stats = dict(_stats)
+        stats["memory_size"] = len(_lru)
+    stats["mode"] = CLASSIFIER_MODE
+    lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["memory_hits"] + stats["db_hits"]) / lookups if lookups else 0.0
+    return stats
@@ -1,22 +1,28 @@
 # (更新的 app.py)
-from flask import Flask, request, jsonify, render_template, session, make_response, redirect, url_for
-from flask_session import Session
+from flask import Flask, request, jsonify, render_template, session, redirect, url_for, Response, make_response, stream_with_context
 import click
 import database
 import logic
 import os
 from dotenv import load_dotenv
 import exchange_rate 
+import email_service
+import ai_services
+import money
+import rate_resolver
+import session_store
 from functools import wraps 
 import json 
+import zlib
+import hashlib
 
 load_dotenv()
 app = Flask(__name__)
 
-app.config["SECRET_KEY"] = os.urandom(24) 
-app.config["SESSION_TYPE"] = "filesystem"
-app.config["SESSION_PERMANENT"] = False
-Session(app)
+session_store.init_app(app) # SECRET_KEY (環境變數或 .secret_key) 與 SQLite session
+database.init_app(app)
+email_service.init_app(app)
+logic.init_app(app)
 
 # --- Admin Decorator ---
 def admin_required(f):
@@ -27,6 +33,39 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# --- Conditional GET (ETag) ---
+def conditional_get(f):
+    """
+    以客戶的 data_version (加上匯率狀態、今天日期與請求網址) 產生 ETag。
+    If-None-Match 相符時直接回 304，不執行查詢；版本號在執行前讀取，因此不會把舊版本標在新資料上。
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if "customer_id" not in session:
+            return f(*args, **kwargs)
+        version = logic.get_data_version(session["customer_id"])
+        if version is None:
+            return f(*args, **kwargs)
+        etag = hashlib.sha1(repr((
+            session["customer_id"], version, rate_resolver.rates_version(), logic.get_today_str(),
+            session.get("user_role"), request.full_path
+        )).encode("utf-8")).hexdigest()[:20]
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            # 只快取成功且完整的結果: 部分 API 以 200 回傳 {"success": False}，分析 API 在 AI 無法分類時
+            # 回傳 {"ai_failed": True}；這些都不能讓瀏覽器以 304 沿用到下一次資料變更
+            body = response.get_json(silent=True) if response.is_json else None
+            if response.status_code != 200 or (
+                isinstance(body, dict) and (body.get("success") is False or body.get("ai_failed"))
+            ):
+                return response
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+    return decorated_function
+
 # --- User API ---
 
 @app.route('/api/register', methods=['POST'])
@@ -35,7 +74,7 @@ def api_register():
     data = request.json
     result = logic.register_customer(
         data.get('name'), data.get('password'), 
-        float(data.get('amount', 0)), logic.get_today_str(), role='customer'
+        money.parse_amount(data.get('amount', 0)), logic.get_today_str(), role='customer'
     )
     return jsonify(result)
 
@@ -45,6 +84,7 @@ def api_login():
     data = request.json
     result = logic.check_login(data.get('name'), data.get('password'))
     if result["success"]:
+        session["customer_id"] = result["user"]["id"]
         session["user_name"] = result["user"]["name"]
         session["user_role"] = result["user"]["role"]
     return jsonify(result)
@@ -56,11 +96,12 @@ def api_logout():
     return jsonify({"success": True, "message": "已登出"})
 
 @app.route('/api/session', methods=['GET'])
+@conditional_get
 def api_check_session():
     # (邏輯不變)
-    if "user_name" in session:
+    if "customer_id" in session:
         name = session["user_name"]
-        result = logic.get_my_wallets(name) 
+        result = logic.get_my_wallets(session["customer_id"])
         
         if result["success"]:
             is_admin = session.get("user_role") == 'admin' 
@@ -80,11 +121,11 @@ def api_check_session():
 
 @app.route('/api/deposit', methods=['POST'])
 def api_deposit():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"] 
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     data = request.json
     result = logic.deposit_money(
-        name, float(data.get('amount', 0)),
+        customer_id, money.parse_amount(data.get('amount', 0)),
         data.get('date') or logic.get_today_str(),
         data.get('currency', 'TWD'),
         note=data.get('note')
@@ -93,11 +134,11 @@ def api_deposit():
 
 @app.route('/api/withdraw', methods=['POST'])
 def api_withdraw():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"] 
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     data = request.json
     result = logic.withdraw_money(
-        name, float(data.get('amount', 0)),
+        customer_id, money.parse_amount(data.get('amount', 0)),
         data.get('date') or logic.get_today_str(),
         data.get('currency', 'TWD'),
         note=data.get('note') or None
@@ -106,12 +147,11 @@ def api_withdraw():
 
 @app.route('/api/transfer', methods=['POST'])
 def api_transfer():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    from_name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
     data = request.json
     result = logic.transfer_money(
-        from_name, data.get('to_name'),
-        float(data.get('amount', 0)),
+        session["customer_id"], data.get('to_name'),
+        money.parse_amount(data.get('amount', 0)),
         data.get('date') or logic.get_today_str(),
         data.get('currency', 'TWD'),
         note=data.get('note') or None
@@ -120,54 +160,96 @@ def api_transfer():
 
 @app.route('/api/exchange-currency', methods=['POST'])
 def api_exchange_currency():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     data = request.json
     result = logic.exchange_currency(
-        name, data.get('from_currency'), data.get('to_currency'),
-        float(data.get('from_amount', 0)),
-        data.get('date') or logic.get_today_str()
+        customer_id, data.get('from_currency'), data.get('to_currency'),
+        money.parse_amount(data.get('from_amount', 0)),
+        data.get('date') or logic.get_today_str(),
+        quote_id=data.get('quote_id') or None
     )
     return jsonify(result)
 
 @app.route('/api/my-transactions', methods=['GET'])
+@conditional_get
 def api_get_my_transactions():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     month = request.args.get('month') or None
-    transactions = logic.get_my_transactions(name, month=month)
-    return jsonify(transactions)
+    result = logic.get_transactions_page(
+        customer_id, month=month,
+        start_date=request.args.get('start_date') or None,
+        end_date=request.args.get('end_date') or None,
+        cursor=request.args.get('cursor') or None,
+        limit=request.args.get('limit', logic.TRANSACTION_PAGE_SIZE)
+    )
+    return jsonify(result), (200 if result["success"] else 400)
+
+@app.route('/api/search-transactions', methods=['GET'])
+@conditional_get
+def api_search_transactions():
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    result = logic.search_transactions(
+        session["customer_id"], request.args.get('q', ''),
+        month=request.args.get('month') or None,
+        start_date=request.args.get('start_date') or None,
+        end_date=request.args.get('end_date') or None,
+        currency=request.args.get('currency') or None,
+        limit=request.args.get('limit', logic.SEARCH_LIMIT)
+    )
+    return jsonify(result), (200 if result["success"] else 400)
 
 @app.route('/api/export-transactions', methods=['GET'])
 def api_export_transactions():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
-    csv_data = logic.get_my_transactions_as_csv(name)
-    if csv_data is None: return jsonify({"error": "沒有交易紀錄可匯出"}), 404
-    response = make_response(csv_data.encode('utf-8-sig'))
-    response.headers['Content-Type'] = 'text/csv; charset=utf-8-sig'
-    response.headers['Content-Disposition'] = 'attachment; filename="transactions.csv"'
+    """ 串流匯出 CSV；可用 month / start_date / end_date / currency 篩選，gzip=1 時輸出 .csv.gz """
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
+    chunks = logic.stream_transactions_csv(
+        customer_id, month=request.args.get('month') or None,
+        start_date=request.args.get('start_date') or None,
+        end_date=request.args.get('end_date') or None,
+        currency=request.args.get('currency') or None
+    )
+    if chunks is None: return jsonify({"error": "沒有交易紀錄可匯出"}), 404
+
+    if request.args.get('gzip') == '1':
+        response = Response(stream_with_context(_gzip_stream(chunks)), mimetype='application/gzip')
+        response.headers['Content-Disposition'] = 'attachment; filename="transactions.csv.gz"'
+    else:
+        response = Response(stream_with_context(chunks))
+        response.headers['Content-Type'] = 'text/csv; charset=utf-8-sig'
+        response.headers['Content-Disposition'] = 'attachment; filename="transactions.csv"'
     return response
 
+def _gzip_stream(chunks):
+    """ 逐塊壓縮 (gzip 格式)，不需先把整個檔案放進記憶體 """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits=31: gzip 標頭
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
 @app.route('/api/my-profile', methods=['POST'])
 def api_update_my_profile():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     data = request.json
-    result = logic.update_my_email(name, data.get('email'))
+    result = logic.update_my_email(customer_id, data.get('email'))
     return jsonify(result)
 
 @app.route('/api/change-password', methods=['POST'])
 def api_change_password():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     data = request.json
-    result = logic.change_password(name, data.get('old_password'), data.get('new_password'))
+    result = logic.change_password(customer_id, data.get('old_password'), data.get('new_password'))
     return jsonify(result)
 
 @app.route('/api/exchange-rates', methods=['GET'])
 def api_get_exchange_rates():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
     # ... (此 API 邏輯不變) ...
     target_currencies = {
         "USD": {"name": "美國 (USD)", "flag": "us"}, "JPY": {"name": "日本 (JPY)", "flag": "jp"},
@@ -191,90 +273,181 @@ def api_get_exchange_rates():
 
 @app.route('/api/quote', methods=['GET'])
 def api_get_quote():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
     # ... (此 API 邏輯不變, 它會自動使用 logic 中的手動匯率邏輯) ...
     from_currency = request.args.get('from')
     to_currency = request.args.get('to')
-    from_amount = float(request.args.get('amount', 0))
+    from_amount = float(money.parse_amount(request.args.get('amount', 0)))
     if not all([from_currency, to_currency, from_amount > 0]):
         return jsonify({"success": False, "error": "參數不足"}), 400
     if from_currency == to_currency:
         return jsonify({"success": True, "to_amount": from_amount})
-    rate = None
-    manual_rates = logic.get_manual_rates()
-    rate_key_direct = f"{from_currency}_{to_currency}"
-    rate_key_reverse = f"{to_currency}_{from_currency}"
-    if rate_key_direct in manual_rates:
-        rate = manual_rates[rate_key_direct]
-    elif rate_key_reverse in manual_rates and manual_rates[rate_key_reverse] > 0:
-        rate = 1 / manual_rates[rate_key_reverse]
-    if rate is None:
-        rates = exchange_rate.get_rates(from_currency)
-        if not rates: return jsonify({"success": False, "error": "無法取得匯率"}), 503
-        rate = rates.get(to_currency)
-        if not rate: return jsonify({"success": False, "error": f"找不到 {to_currency} 的匯率"}), 404
+    rate_result = rate_resolver.resolve(from_currency, to_currency)
+    if not rate_result["success"]:
+        return jsonify(rate_result), (503 if exchange_rate.get_matrix() is None else 404)
+    rate = rate_result["rate"]
     to_amount = from_amount * rate
-    return jsonify({"success": True, "to_amount": to_amount, "rate": rate})
+    # 鎖定報價: 換匯時帶入 quote_id 即以此匯率成交
+    quote_id, expires_in = rate_resolver.lock_quote(
+        session["customer_id"], from_currency, to_currency,
+        money.to_minor(money.parse_amount(request.args.get('amount')), from_currency), rate_result
+    )
+    return jsonify({
+        "success": True, "to_amount": to_amount, "rate": rate, "source": rate_result["source"],
+        "quote_id": quote_id, "expires_in": expires_in
+    })
+
+MAX_BATCH_QUOTES = 200
+
+@app.route('/api/quotes', methods=['POST'])
+def api_get_quotes():
+    """
+    批次報價，所有報價使用同一個匯率快照 (語意同 /api/quote)。兩種用法:
+    1. {"quotes": [{"from": "USD", "to": "TWD", "amount": 100}, ...]}
+    2. {"from": "TWD", "amount": 1000} -> 換成每一個持有的其他幣別；
+       {"to": "USD"} -> 每個持有幣別的錢包餘額換成 USD
+    """
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    data = request.json or {}
+
+    def to_float(value):
+        # 無法解析、inf / nan 或超過上限的金額視為 0 (該筆回報參數不足)，回應中不會出現非法的 JSON 數值
+        return float(money.parse_amount(value))
+
+    if isinstance(data.get('quotes'), list):
+        if not all(isinstance(q, dict) for q in data['quotes']):
+            return jsonify({"success": False, "error": "quotes 必須是物件陣列"}), 400
+        items = [(q.get('from'), q.get('to'), to_float(q.get('amount', 0))) for q in data['quotes']]
+    elif data.get('from') or data.get('to'):
+        wallets = logic.get_my_wallets(session["customer_id"])['wallets']
+        if data.get('from'):
+            amount = to_float(data.get('amount', 0))
+            items = [(data['from'], w['currency'], amount) for w in wallets if w['currency'] != data['from']]
+        else:
+            items = [(w['currency'], data['to'], w['balance']) for w in wallets if w['currency'] != data['to'] and w['balance'] > 0]
+    else:
+        return jsonify({"success": False, "error": "參數不足"}), 400
+    if len(items) > MAX_BATCH_QUOTES:
+        return jsonify({"success": False, "error": f"單次最多 {MAX_BATCH_QUOTES} 筆報價"}), 400
+
+    pairs = [(f, t) for f, t, amount in items if f and t and f != t and amount > 0]
+    resolved = iter(rate_resolver.resolve_many(pairs))
+    quotes = []
+    for from_currency, to_currency, from_amount in items:
+        quote = {"from": from_currency, "to": to_currency, "amount": from_amount}
+        if not all([from_currency, to_currency, from_amount > 0]):
+            quote.update(success=False, error="參數不足")
+        elif from_currency == to_currency:
+            quote.update(success=True, to_amount=from_amount, rate=1.0)
+        else:
+            rate_result = next(resolved)
+            if rate_result["success"]:
+                quote.update(success=True, to_amount=from_amount * rate_result["rate"],
+                             rate=rate_result["rate"], source=rate_result["source"])
+            else:
+                quote.update(success=False, error=rate_result["error"])
+        quotes.append(quote)
+    return jsonify({"success": True, "quotes": quotes, "as_of": exchange_rate.get_table_time()})
 
 # --- Analysis API (User) ---
 
 @app.route('/api/analyze-spending', methods=['GET'])
+@conditional_get
 def api_analyze_spending():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     month = request.args.get('month') or None
     currency = request.args.get('currency', 'TWD') 
-    result = logic.analyze_spending(name, month=month, currency=currency) 
+    result = logic.analyze_spending(
+        customer_id, month=month, currency=currency,
+        start_date=request.args.get('start_date') or None,
+        end_date=request.args.get('end_date') or None
+    )
     return jsonify(result)
 
 @app.route('/api/analyze-income', methods=['GET'])
+@conditional_get
 def api_analyze_income():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     month = request.args.get('month') or None
     currency = request.args.get('currency', 'TWD') 
-    result = logic.analyze_income(name, month=month, currency=currency) 
+    result = logic.analyze_income(
+        customer_id, month=month, currency=currency,
+        start_date=request.args.get('start_date') or None,
+        end_date=request.args.get('end_date') or None
+    )
     return jsonify(result)
 
 @app.route('/api/cash-flow-analysis', methods=['GET'])
+@conditional_get
 def api_get_cash_flow_analysis():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     month = request.args.get('month') or None
     currency = request.args.get('currency', 'TWD') 
-    result = logic.analyze_cash_flow(name, month=month, currency=currency) 
+    result = logic.analyze_cash_flow(
+        customer_id, month=month, currency=currency,
+        start_date=request.args.get('start_date') or None,
+        end_date=request.args.get('end_date') or None
+    )
     return jsonify(result)
 
+@app.route('/api/monthly-statement', methods=['GET'])
+@conditional_get
+def api_get_monthly_statement():
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
+    month = request.args.get('month') or logic.get_this_month_str()
+    result = logic.get_monthly_statement(customer_id, month, currency=request.args.get('currency') or None)
+    return jsonify(result), (200 if result["success"] else 400)
+
+@app.route('/api/net-worth-series', methods=['GET'])
+@conditional_get
+def api_get_net_worth_series():
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
+    result = logic.get_net_worth_series(
+        customer_id,
+        start_date=request.args.get('start_date') or None,
+        end_date=request.args.get('end_date') or None,
+        interval=request.args.get('interval', 'day'),
+        currency=request.args.get('currency', 'TWD')
+    )
+    return jsonify(result), (200 if result["success"] else 400)
+
 # --- Budget API (User) ---
 
 @app.route('/api/budgets', methods=['GET'])
+@conditional_get
 def api_get_budgets():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     month = request.args.get('month') or logic.get_this_month_str()
     currency = request.args.get('currency', 'TWD')
-    result = logic.get_budgets(name, month, currency)
+    result = logic.get_budgets(customer_id, month, currency)
     return jsonify(result)
 
 @app.route('/api/budget', methods=['POST'])
 def api_set_budget():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     data = request.json
     result = logic.set_budget(
-        name, data.get('month') or logic.get_this_month_str(),
+        customer_id, data.get('month') or logic.get_this_month_str(),
         data.get('currency', 'TWD'),
         data.get('category'), float(data.get('amount', 0))
     )
     return jsonify(result)
 
 @app.route('/api/spending-vs-budget', methods=['GET'])
+@conditional_get
 def api_get_spending_vs_budget():
-    if "user_name" not in session: return jsonify({"error": "尚未登入"}), 401
-    name = session["user_name"]
+    if "customer_id" not in session: return jsonify({"error": "尚未登入"}), 401
+    customer_id = session["customer_id"]
     month = request.args.get('month') or logic.get_this_month_str()
     currency = request.args.get('currency', 'TWD')
-    result = logic.get_spending_vs_budget(name, month, currency)
+    result = logic.get_spending_vs_budget(customer_id, month, currency)
     return jsonify(result)
 
 # --- Web Pages ---
@@ -325,16 +498,18 @@ def api_admin_get_user_detail(user_id):
 @app.route('/api/admin/user/<int:user_id>/transactions')
 @admin_required
 def api_admin_get_user_transactions(user_id):
-    # 先取得 user_id 對應的 user_name
-    conn = database.get_db_conn()
-    user = conn.execute("SELECT name FROM customers WHERE id = ?", (user_id,)).fetchone()
-    conn.close()
-    if not user:
+    if not logic.get_customer_profile(user_id):
         return jsonify({"error": "查無此人"}), 404
         
     month = request.args.get('month') or None
-    transactions = logic.get_my_transactions(user['name'], month=month)
-    return jsonify(transactions)
+    result = logic.get_transactions_page(
+        user_id, month=month,
+        start_date=request.args.get('start_date') or None,
+        end_date=request.args.get('end_date') or None,
+        cursor=request.args.get('cursor') or None,
+        limit=request.args.get('limit', logic.TRANSACTION_PAGE_SIZE)
+    )
+    return jsonify(result), (200 if result["success"] else 400)
 
 
 @app.route('/api/admin/user/<int:user_id>/update', methods=['PUT'])
@@ -360,10 +535,28 @@ def api_admin_manual_adjustment():
     data = request.json
     result = logic.admin_manual_adjustment(
         admin_name, data.get('user_id'), data.get('currency'),
-        float(data.get('amount', 0)), data.get('note')
+        money.parse_amount(data.get('amount', 0)), data.get('note')
     )
     return jsonify(result)
 
+@app.route('/api/admin/ai-cache-stats')
+@admin_required
+def api_admin_ai_cache_stats():
+    return jsonify({"success": True, "stats": ai_services.cache_stats()})
+
+@app.route('/api/batch', methods=['POST'])
+@admin_required
+def api_post_batch():
+    data = request.json or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        return jsonify({"success": False, "error": "operations 必須是物件陣列"}), 400
+    if len(operations) > logic.MAX_BATCH_SIZE:
+        return jsonify({"success": False, "error": f"單次最多 {logic.MAX_BATCH_SIZE} 筆"}), 400
+    operations = [dict(op, amount=money.parse_amount(op.get('amount', 0))) for op in operations]
+    result = logic.post_batch(operations)
+    return jsonify(result)
+
 @app.route('/api/admin/manual-rates', methods=['GET'])
 @admin_required
 def api_admin_get_rates():
@@ -385,6 +578,68 @@ def init_db_command():
     database.init_db()
     print("資料庫初始化完成。")
 
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    applied = database.upgrade_db()
+    if applied: print(f"已套用遷移: {', '.join(str(v) for v in applied)}")
+    else: print("資料庫已是最新版本。")
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    result = logic.rebuild_rollups()
+    if result["success"]: print(f"收支彙總表重建完成，共 {result['transactions']} 筆交易。")
+    else: print(f"重建失敗: {result['error']}")
+
+@app.cli.command('drain-outbox')
+def drain_outbox_command():
+    if not email_service.is_configured():
+        print("Email 服務未設定 (SMTP_SERVER / SMTP_FROM)。")
+        return
+    session = email_service.SmtpSession()
+    total = 0
+    try:
+        while True:
+            processed = email_service.drain_outbox(session)
+            if not processed: break
+            total += processed
+    finally:
+        session.close()
+    purged = email_service.purge_outbox()
+    print(f"Outbox 處理完成，共 {total} 封；清除 {purged} 封過期紀錄。")
+
+@app.cli.command('sweep-sessions')
+def sweep_sessions_command():
+    print(f"已刪除 {session_store.sweep_expired_sessions()} 筆過期 session。")
+
+@app.cli.command('categorize-pending')
+def categorize_pending_command():
+    total = 0
+    while True:
+        categorized, failed = logic.categorize_pending()
+        total += categorized
+        if failed:
+            print(f"AI 服務無法分類 {failed} 筆交易，請稍後再試。")
+            break
+        if not categorized: break
+    print(f"交易分類完成，共 {total} 筆。")
+
+@app.cli.command('recategorize-guesses')
+def recategorize_guesses_command():
+    total = 0
+    while True:
+        recategorized, remaining = logic.recategorize_guesses()
+        total += recategorized
+        if remaining:
+            print(f"仍有 {remaining} 筆低信心分類無法由遠端模型分類，請稍後再試。")
+            break
+        if not recategorized: break
+    print(f"重新分類完成，共 {total} 筆。")
+
+@app.cli.command('train-classifier')
+def train_classifier_command():
+    samples = ai_services.train_local_model(logic.CATEGORIES)
+    print(f"本機分類模型訓練完成，使用 {samples} 筆已標記備註 (另含內建關鍵字)。")
+
 @app.cli.command('create-admin')
 @click.argument('name')
 @click.argument('password')
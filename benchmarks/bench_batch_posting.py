@@ -0,0 +1,79 @@
+# 批次過帳吞吐量比較: 逐筆呼叫 deposit_money / transfer_money vs. logic.post_batch
+#
+# 用法 (於專案根目錄):
+#   python benchmarks/bench_batch_posting.py [每輪筆數，預設 5000]
+#
+# 會在暫存目錄建立一個獨立的資料庫，不會動到 bank.db。
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import logic
+
+OPS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+CUSTOMERS = 1000
+
+
+def make_operations(rng):
+    operations = []
+    for _ in range(OPS):
+        name = f"user{rng.randrange(CUSTOMERS)}"
+        if rng.random() < 0.5:
+            operations.append({"op": "deposit", "name": name, "amount": rng.randint(1, 500), "date": "2025-01-31"})
+        else:
+            to_name = f"user{rng.randrange(CUSTOMERS)}"
+            while to_name == name:
+                to_name = f"user{rng.randrange(CUSTOMERS)}"
+            operations.append({"op": "transfer", "name": name, "to_name": to_name,
+                               "amount": rng.randint(1, 50), "date": "2025-01-31", "note": "薪資"})
+    return operations
+
+
+def post_one_by_one(operations, customer_ids):
+    for op in operations:
+        if op["op"] == "deposit":
+            logic.deposit_money(customer_ids[op["name"]], op["amount"], op["date"])
+        else:
+            logic.transfer_money(customer_ids[op["name"]], op["to_name"], op["amount"], op["date"], note=op["note"])
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    database.DATABASE_NAME = os.path.join(tmp_dir, "bench.db")
+    database.upgrade_db()
+    # 逐筆寄送 Email 不在量測範圍內
+    logic.email_service.queue_transfer_notification = lambda *args, **kwargs: None
+
+    # 直接寫入客戶與錢包 (register_customer 的密碼雜湊太慢，不是量測對象)
+    conn = database.get_db_conn()
+    conn.executemany("INSERT INTO customers (name, password) VALUES (?, 'x')", [(f"user{i}",) for i in range(CUSTOMERS)])
+    conn.execute("INSERT INTO wallets (customer_id, currency, balance) SELECT id, 'TWD', 1000000 FROM customers")
+    conn.commit()
+    customer_ids = {row['name']: row['id'] for row in conn.execute("SELECT id, name FROM customers")}
+    conn.close()
+
+    rng = random.Random(42)
+    single_ops = make_operations(rng)
+    batch_ops = make_operations(rng)
+
+    t0 = time.perf_counter()
+    post_one_by_one(single_ops, customer_ids)
+    single_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    result = logic.post_batch(batch_ops)
+    batch_time = time.perf_counter() - t0
+
+    print(f"逐筆過帳: {OPS:,} 筆 {single_time:.2f}s ({OPS / single_time:,.0f} 筆/秒)")
+    print(f"批次過帳: {OPS:,} 筆 {batch_time:.2f}s ({OPS / batch_time:,.0f} 筆/秒)，"
+          f"成功 {result['posted']:,} / 失敗 {result['failed']:,}")
+    database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
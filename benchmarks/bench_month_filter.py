@@ -0,0 +1,116 @@
+# 月份篩選效能比較: strftime('%Y-%m', date) = ? vs. 半開區間 date >= ? AND date < ?
+#
+# 用法 (於專案根目錄):
+#   python benchmarks/bench_month_filter.py [交易筆數，預設 2000000]
+#
+# 會在暫存目錄建立一個獨立的資料庫 (套用 migrations/ 的完整結構與索引)，
+# 不會動到 bank.db。
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import logic
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+CUSTOMERS = 200
+CURRENCIES = ["TWD", "USD", "JPY"]
+DAYS = 5 * 365
+REPEAT = 20
+
+
+def populate(conn):
+    conn.executemany(
+        "INSERT INTO customers (name, password) VALUES (?, 'x')",
+        [(f"user{i}",) for i in range(CUSTOMERS)]
+    )
+    conn.executemany(
+        "INSERT INTO wallets (customer_id, currency, balance) VALUES (?, ?, 0)",
+        [(c + 1, cur) for c in range(CUSTOMERS) for cur in CURRENCIES]
+    )
+    wallet_count = CUSTOMERS * len(CURRENCIES)
+    start = date(2020, 1, 1)
+    day_strs = [(start + timedelta(days=d)).strftime(logic.DATE_FMT) for d in range(DAYS)]
+    rng = random.Random(42)
+
+    batch = []
+    for _ in range(ROWS):
+        amount = rng.choice((1, -1)) * rng.randint(1, 5000)
+        batch.append((rng.randint(1, wallet_count), rng.choice(day_strs), '存款' if amount > 0 else '提款', amount, 0, 'bench'))
+        if len(batch) == 100_000:
+            conn.executemany(
+                "INSERT INTO transactions (wallet_id, date, type, amount, balance_after, note) VALUES (?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            batch.clear()
+    if batch:
+        conn.executemany(
+            "INSERT INTO transactions (wallet_id, date, type, amount, balance_after, note) VALUES (?, ?, ?, ?, ?, ?)",
+            batch
+        )
+    conn.commit()
+    conn.execute("ANALYZE")
+
+
+def timed(conn, sql, params):
+    best = float("inf")
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        best = min(best, time.perf_counter() - t0)
+    return best, len(rows)
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    database.DATABASE_NAME = os.path.join(tmp_dir, "bench.db")
+    database.upgrade_db()
+
+    conn = database.get_db_conn()
+    print(f"建立 {ROWS:,} 筆交易中...")
+    t0 = time.perf_counter()
+    populate(conn)
+    print(f"完成 ({time.perf_counter() - t0:.1f}s)\n")
+
+    month = "2023-06"
+    month_start, month_end = logic._month_bounds(month)
+    wallet_id = 7
+    customer_name = "user2"
+
+    cases = [
+        (
+            "analyze_cash_flow (單一錢包)",
+            ("SELECT date, type, amount, note FROM transactions WHERE wallet_id = ? "
+             "AND strftime('%Y-%m', date) = ? ORDER BY date ASC", (wallet_id, month)),
+            ("SELECT date, type, amount, note FROM transactions WHERE wallet_id = ? "
+             "AND date >= ? AND date < ? ORDER BY date ASC", (wallet_id, month_start, month_end)),
+        ),
+        (
+            "交易紀錄 (依客戶)",
+            ("SELECT t.date, t.amount FROM transactions t JOIN wallets w ON t.wallet_id = w.id "
+             "JOIN customers c ON w.customer_id = c.id WHERE c.name = ? "
+             "AND strftime('%Y-%m', t.date) = ? ORDER BY t.date DESC, t.id DESC", (customer_name, month)),
+            ("SELECT t.date, t.amount FROM transactions t JOIN wallets w ON t.wallet_id = w.id "
+             "JOIN customers c ON w.customer_id = c.id WHERE c.name = ? "
+             "AND t.date >= ? AND t.date < ? ORDER BY t.date DESC, t.id DESC", (customer_name, month_start, month_end)),
+        ),
+    ]
+
+    print(f"{'查詢':<32}{'strftime (ms)':>15}{'範圍 (ms)':>12}{'加速':>9}")
+    for label, (old_sql, old_params), (new_sql, new_params) in cases:
+        old_time, old_rows = timed(conn, old_sql, old_params)
+        new_time, new_rows = timed(conn, new_sql, new_params)
+        assert old_rows == new_rows, (old_rows, new_rows)
+        print(f"{label:<32}{old_time * 1000:>15.2f}{new_time * 1000:>12.2f}{old_time / new_time:>8.1f}x")
+
+    conn.close()
+    database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
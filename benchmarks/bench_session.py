@@ -0,0 +1,97 @@
+# 每個請求的 session 開銷: SQLite session (有 / 無程序內快取) vs. Flask-Session filesystem vs. Flask 內建 cookie session
+#
+# 用法 (於專案根目錄):
+#   python benchmarks/bench_session.py [每種請求次數，預設 5000]
+#
+# 先以 test client 登入取得 cookie，再直接量測 session_interface 讀取 (open + save，內容不變)
+# 與修改 session 的請求的成本 (不含路由與 WSGI 的固定開銷)。
+# 資料庫與 session 檔案都放在暫存目錄，不會動到 bank.db。
+# Flask-Session 已不是專案依賴，未安裝時略過該項。
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request, session
+import database
+import session_store
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+
+def make_app(setup):
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "bench"
+    setup(app)
+
+    @app.route("/login")
+    def login():
+        session["user_name"] = "user1"
+        session["user_role"] = "customer"
+        return "ok"
+
+    return app
+
+
+def session_overhead_us(app, cookie, n, modify):
+    """只量測 session_interface.open_session + save_session (不含路由與 test client 本身的成本)"""
+    interface = app.session_interface
+    with app.test_request_context("/read", headers={"Cookie": f"{app.config['SESSION_COOKIE_NAME']}={cookie}"}):
+        response = app.response_class("ok")
+        t0 = time.perf_counter()
+        for i in range(n):
+            sess = interface.open_session(app, request)
+            if modify:
+                sess["counter"] = i
+            interface.save_session(app, sess, response)
+        return (time.perf_counter() - t0) / n * 1e6
+
+
+def setup_sqlite(app):
+    app.session_interface = session_store.SqliteSessionInterface()
+
+
+def setup_filesystem(app):
+    from flask_session import Session
+    app.config["SESSION_TYPE"] = "filesystem"
+    app.config["SESSION_FILE_DIR"] = tempfile.mkdtemp()
+    app.config["SESSION_PERMANENT"] = False
+    Session(app)
+
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    database.DATABASE_NAME = os.path.join(tmp_dir, "bench.db")
+    database.upgrade_db()
+
+    cases = [("Flask cookie session (無伺服器狀態)", lambda app: None, None)]
+    cases.append(("SQLite session (程序內快取)", setup_sqlite, session_store.SESSION_CACHE_SECONDS))
+    cases.append(("SQLite session (每次讀資料庫)", setup_sqlite, 0))
+    try:
+        import flask_session # noqa: F401
+        cases.append(("Flask-Session filesystem", setup_filesystem, None))
+    except ImportError:
+        print("未安裝 Flask-Session，略過 filesystem 比較。\n")
+
+    print(f"{'session 後端':<36}{'讀取 (µs/req)':>16}{'修改 (µs/req)':>16}")
+    default_cache_seconds = session_store.SESSION_CACHE_SECONDS
+    for label, setup, cache_seconds in cases:
+        if cache_seconds is not None:
+            session_store.SESSION_CACHE_SECONDS = cache_seconds
+        app = make_app(setup)
+        client = app.test_client()
+        client.get("/login")
+        cookie = client.get_cookie(app.config["SESSION_COOKIE_NAME"]).value
+        session_overhead_us(app, cookie, min(REQUESTS, 200), False) # 暖身
+        read_us = session_overhead_us(app, cookie, REQUESTS, False)
+        touch_us = session_overhead_us(app, cookie, REQUESTS // 5, True)
+        print(f"{label:<36}{read_us:>16.1f}{touch_us:>16.1f}")
+        session_store.SESSION_CACHE_SECONDS = default_cache_seconds
+
+    database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
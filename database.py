@@ -1,24 +1,173 @@
 import sqlite3
 import os
+import re
+import queue
+import threading
 
 DATABASE_NAME = 'bank.db' # 資料庫將被存在這個檔案中
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
 
-def get_db_conn():
-    """獲取一個資料庫連線物件，並設定為字典模式"""
-    conn = sqlite3.connect(DATABASE_NAME)
+# --- 連線池設定 ---
+# 每條連線建立時只套用一次的 PRAGMA (WAL 讓讀寫不互相阻塞)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))}",
+    f"PRAGMA mmap_size = {int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))}",
+    f"PRAGMA cache_size = {int(os.getenv('DB_CACHE_SIZE', -16000))}", # 負數代表 KiB
+)
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE) # 閒置中的連線
+_local = threading.local() # 每個執行緒目前借用中的連線與借用深度
+
+
+def _connect():
+    """建立一條新的實體連線並套用 PRAGMA"""
+    # check_same_thread=False: 連線歸還後可能被其他執行緒借用 (同一時間只會有一個執行緒使用)
+    conn = sqlite3.connect(DATABASE_NAME, check_same_thread=False)
     # 讓查詢結果可以像字典一樣用欄位名稱取值
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+
+def _acquire():
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
+
+
+def _release(conn):
+    # 未提交的交易一律回滾，避免把半套狀態交給下一個使用者
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+class PooledConnection:
+    """
+    連線池借出的連線代理物件。
+    用法與 sqlite3.Connection 相同；close() 不會真的關閉連線，而是歸還給連線池。
+    同一執行緒內的巢狀呼叫 (例如 admin_get_user_details -> get_my_wallets) 會共用同一條連線，
+    直到最外層的 close() 才歸還。
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        _local.depth -= 1
+        if _local.depth == 0:
+            conn, _local.conn = _local.conn, None
+            _release(conn)
+
+
+def get_db_conn():
+    """獲取一個資料庫連線物件 (由連線池提供)，並設定為字典模式"""
+    if getattr(_local, "conn", None) is None:
+        _local.conn = _acquire()
+        _local.depth = 0
+    _local.depth += 1
+    return PooledConnection(_local.conn)
+
+
+def close_pool():
+    """關閉連線池中所有閒置的連線 (例如重建資料庫前)"""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+
+def init_app(app):
+    """
+    讓每個 Flask 請求在整個生命週期中固定使用同一條連線：
+    請求開始時借出，請求結束 (teardown) 時歸還。
+    """
+    from flask import g
+
+    @app.before_request
+    def _open_request_conn():
+        g.db_conn = get_db_conn()
+
+    @app.teardown_request
+    def _close_request_conn(exc):
+        conn = g.pop("db_conn", None)
+        if conn is not None:
+            conn.close()
+
+
+def _list_migrations():
+    """回傳 [(版本號, 檔案路徑), ...]，依版本號排序"""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = re.match(r'^(\d+)_.+\.sql$', filename)
+        if match:
+            migrations.append((int(match.group(1)), os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def upgrade_db():
+    """
+    依序套用 migrations/ 中尚未執行的遷移檔 (以 PRAGMA user_version 記錄目前版本)。
+    每個遷移檔在單一交易中執行，失敗時整個檔案回滾。
+    回傳本次套用的版本號列表。
+    """
+    conn = _connect()
+    applied = []
+    try:
+        current = get_schema_version(conn)
+        for version, path in _list_migrations():
+            if version <= current:
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                sql = f.read()
+            print(f"套用遷移 {os.path.basename(path)} ...")
+            try:
+                conn.executescript(f"BEGIN;\n{sql}\nPRAGMA user_version = {version};\nCOMMIT;")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            applied.append(version)
+
+        # 更新查詢規劃器的統計資訊，讓新索引能被正確選用
+        if applied:
+            conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+        return applied
+    finally:
+        conn.close()
+
+
 def init_db():
-    """讀取 schema.sql 檔案並執行它來建立資料表"""
+    """刪除既有資料庫，並從頭套用所有遷移 (僅供開發環境重置使用)"""
+    close_pool()
     if os.path.exists(DATABASE_NAME):
         print(f"資料庫 {DATABASE_NAME} 已存在，將會刪除重建。")
         os.remove(DATABASE_NAME)
-        
-    conn = get_db_conn()
-    with open('schema.sql', 'r', encoding='utf-8') as f:
-        conn.executescript(f.read())
-    conn.commit()
-    conn.close()
-    print("資料庫初始化完成。")
\ No newline at end of file
+    for suffix in ('-wal', '-shm'): # WAL 模式的附屬檔案
+        if os.path.exists(DATABASE_NAME + suffix):
+            os.remove(DATABASE_NAME + suffix)
+
+    upgrade_db()
+    print("資料庫初始化完成。")
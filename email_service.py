@@ -1,88 +1,354 @@
 # (新檔案: email_service.py)
+# 通知信採用 outbox 模式: 業務邏輯在同一個資料庫交易中寫入 email_outbox，
+# 由背景執行緒 (OutboxWorker) 批次取出，透過同一條 SMTP 連線寄送，失敗時以指數退避重試。
 import smtplib
 import os
+import re
+import threading
+import time
 from email.message import EmailMessage
+from database import get_db_conn
 
 # --- 從 .env 讀取 SMTP 設定 ---
 SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = os.getenv("SMTP_PORT", 587) # 587 (TLS) 或 465 (SSL)
 SMTP_USER = os.getenv("SMTP_USER") # 您的 Email
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD") # 您的 Email 密碼或應用程式密碼
+SMTP_FROM = os.getenv("SMTP_FROM") or SMTP_USER # 寄件人 (預設同 SMTP_USER)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0" # 本機測試用的 SMTP 替身可設為 0
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 10))
+
+# --- Outbox 設定 ---
+OUTBOX_ENABLED = os.getenv("OUTBOX_WORKER", "1") != "0" # 設為 0 可改由獨立程序執行 `flask drain-outbox`
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", 5))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 6))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", 30)) # 第 n 次失敗後等待 30 * 2^(n-1) 秒
+OUTBOX_RETENTION_SECONDS = float(os.getenv("OUTBOX_RETENTION_SECONDS", 7 * 86400)) # 已寄出 / 放棄的信件保留多久
+OUTBOX_PURGE_SECONDS = 3600 # 多久清理一次過期的信件
+OUTBOX_LEASE_SECONDS = 300 # 'sending' 的租約；程序中途結束時，租約到期後由其他 worker 重新寄送
+SMTP_IDLE_SECONDS = 60 # SMTP 連線閒置多久後關閉
+
+
+def is_configured():
+    return bool(SMTP_SERVER and SMTP_FROM)
+
+
+# 收件地址: 單一 local@domain，不含空白、換行或控制字元 (避免標頭注入與 EmailMessage 拋出例外)
+_ADDRESS_RE = re.compile(r"[^@\s\x00-\x1f\x7f]+@[^@\s\x00-\x1f\x7f.]+(\.[^@\s\x00-\x1f\x7f.]+)+")
+
+
+def is_valid_address(address):
+    return isinstance(address, str) and len(address) <= 254 and _ADDRESS_RE.fullmatch(address) is not None
+
+
+def _build_message(to_address, subject, body):
+    msg = EmailMessage()
+    msg.set_content(body)
+    msg['Subject'] = subject
+    msg['From'] = SMTP_FROM
+    msg['To'] = to_address
+    return msg
+
+
+class SmtpSession:
+    """
+    可重複使用的 SMTP 連線: 第一次寄信時才連線 (含 STARTTLS 與登入)，之後的信件共用同一條連線。
+    連線被伺服器中斷時自動重連一次。
+    """
+
+    def __init__(self):
+        self._server = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        port = int(SMTP_PORT)
+        if port == 465:
+            # 使用 SSL
+            server = smtplib.SMTP_SSL(SMTP_SERVER, port, timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(SMTP_SERVER, port, timeout=SMTP_TIMEOUT)
+            if SMTP_STARTTLS:
+                server.starttls() # 啟用 TLS
+        if SMTP_USER and SMTP_PASSWORD:
+            server.login(SMTP_USER, SMTP_PASSWORD)
+        return server
+
+    def send(self, msg):
+        if self._server is None:
+            self._server = self._connect()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._server = self._connect()
+            self._server.send_message(msg)
+        self.last_used = time.time()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._server = None
+
+    @property
+    def is_open(self):
+        return self._server is not None
+
 
 def send_email(to_address, subject, body):
     """
-    寄送一封純文字 Email。
-    
+    立即寄送一封純文字 Email (不經過 outbox)。
+
     警告: 您必須在 .env 檔案中設定 SMTP 相關變數!
     """
-    if not all([SMTP_SERVER, SMTP_USER, SMTP_PASSWORD]):
+    if not is_configured():
         print(f"Email 服務未設定: 無法寄送 Email 給 {to_address}")
         return False
-        
-    msg = EmailMessage()
-    msg.set_content(body)
-    msg['Subject'] = subject
-    msg['From'] = SMTP_USER
-    msg['To'] = to_address
-    
+    if not is_valid_address(to_address):
+        print(f"Email 地址格式錯誤: {to_address!r}")
+        return False
+
+    session = SmtpSession()
     try:
         print(f"正在嘗試寄送 Email 至 {to_address}...")
-        if int(SMTP_PORT) == 465:
-            # 使用 SSL
-            with smtplib.SMTP_SSL(SMTP_SERVER, int(SMTP_PORT)) as server:
-                server.login(SMTP_USER, SMTP_PASSWORD)
-                server.send_message(msg)
-        else:
-            # 使用 TLS
-            with smtplib.SMTP(SMTP_SERVER, int(SMTP_PORT)) as server:
-                server.starttls() # 啟用 TLS
-                server.login(SMTP_USER, SMTP_PASSWORD)
-                server.send_message(msg)
-        
+        session.send(_build_message(to_address, subject, body))
         print(f"Email 寄送成功: {subject}")
         return True
-    except Exception as e:
+    except (smtplib.SMTPException, OSError) as e:
         print(f"Email 寄送失敗: {e}")
         return False
+    finally:
+        session.close()
+
+
+# --- Outbox ---
+
+def enqueue_email(conn, to_address, subject, body):
+    """
+    在呼叫端目前的資料庫交易中寫入一封待寄信件 (由呼叫端 commit)。
+    收件地址格式錯誤時不寫入 (通知信失敗不影響呼叫端的交易)，回傳 False。
+    """
+    if not is_valid_address(to_address):
+        print(f"Email 地址格式錯誤，略過通知信: {to_address!r}")
+        return False
+    now = time.time()
+    conn.execute(
+        "INSERT INTO email_outbox (to_address, subject, body, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+        (to_address, subject, body, now, now)
+    )
+    return True
+
+
+def _claim_batch(conn, limit):
+    """取出一批到期的信件並標記為寄送中 (租約)，避免多個 worker 重複寄送"""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    rows = conn.execute(
+        "SELECT id, to_address, subject, body, attempts FROM email_outbox "
+        "WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? "
+        "ORDER BY id LIMIT ?",
+        (now, limit)
+    ).fetchall()
+    if rows:
+        conn.executemany(
+            "UPDATE email_outbox SET status = 'sending', next_attempt_at = ? WHERE id = ?",
+            [(now + OUTBOX_LEASE_SECONDS, row['id']) for row in rows]
+        )
+    conn.commit()
+    return rows
+
+
+def drain_outbox(session, batch_size=OUTBOX_BATCH_SIZE):
+    """
+    寄出一批到期的信件，回傳本批處理的封數 (0 表示目前沒有待寄信件)。
+    session: SmtpSession，整批 (以及後續批次) 共用同一條連線。
+    """
+    if not is_configured():
+        return 0
+
+    conn = get_db_conn()
+    try:
+        rows = _claim_batch(conn, batch_size)
+        if not rows:
+            return 0
+
+        sent, retries = [], []
+        try:
+            for i, row in enumerate(rows):
+                msg = None
+                try:
+                    msg = _build_message(row['to_address'], row['subject'], row['body'])
+                    session.send(msg)
+                    sent_at = time.time()
+                    sent.append((sent_at, sent_at, row['id']))
+                    continue
+                except Exception as e:
+                    # 任何例外 (包括無法建立的信件，例如收件人含換行) 都只算這一封失敗一次
+                    if msg is not None:
+                        session.close() # 連線狀態不明，下一封重新連線
+                    error = e
+
+                attempts = row['attempts'] + 1
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    status, next_attempt_at = 'failed', time.time()
+                else:
+                    status = 'pending'
+                    next_attempt_at = time.time() + OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1)
+                retries.append((status, attempts, next_attempt_at, str(error), row['id']))
+                print(f"Email 寄送失敗 (第 {attempts} 次): {error}")
+
+                if isinstance(error, (OSError, smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected)):
+                    # 連不上伺服器: 本批其餘信件不計入失敗次數，稍後再試
+                    retry_at = time.time() + OUTBOX_BACKOFF_SECONDS
+                    retries += [('pending', rest['attempts'], retry_at, str(error), rest['id']) for rest in rows[i + 1:]]
+                    break
+        finally:
+            # 即使迴圈中途中斷，已寄出 / 已失敗的信件也要記錄，避免租約到期後重寄
+            _record_results(conn, sent, retries)
+        return len(rows)
+    finally:
+        conn.close()
+
+
+def _record_results(conn, sent, retries):
+    conn.execute("BEGIN IMMEDIATE")
+    # 寄出後清空內文: outbox 只在寄送前保存信件內容
+    conn.executemany(
+        "UPDATE email_outbox SET status = 'sent', sent_at = ?, next_attempt_at = ?, body = '' WHERE id = ?",
+        sent
+    )
+    conn.executemany(
+        "UPDATE email_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+        retries
+    )
+    conn.commit()
+
+
+def purge_outbox(retention_seconds=OUTBOX_RETENTION_SECONDS):
+    """刪除超過保留期限的已寄出 / 放棄信件，回傳刪除筆數"""
+    # 寄出 / 放棄時 next_attempt_at 設為當下時間，可沿用 (status, next_attempt_at) 索引
+    conn = get_db_conn()
+    try:
+        cursor = conn.execute(
+            "DELETE FROM email_outbox WHERE status IN ('sent', 'failed') AND next_attempt_at <= ?",
+            (time.time() - retention_seconds,)
+        )
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+class OutboxWorker(threading.Thread):
+    """背景寄信執行緒: 持續清空 outbox，閒置時每 OUTBOX_POLL_SECONDS 秒檢查一次 (或被 wake() 喚醒)"""
+
+    def __init__(self):
+        super().__init__(name="email-outbox", daemon=True)
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self.session = SmtpSession()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self):
+        last_purge = 0.0
+        while not self._stopping.is_set():
+            try:
+                processed = drain_outbox(self.session)
+                if time.time() - last_purge > OUTBOX_PURGE_SECONDS:
+                    purge_outbox()
+                    last_purge = time.time()
+            except Exception as e:
+                print(f"Outbox 處理錯誤: {e}")
+                processed = 0
+            if processed:
+                continue
+            if self.session.is_open and time.time() - self.session.last_used > SMTP_IDLE_SECONDS:
+                self.session.close()
+            self._wake.wait(OUTBOX_POLL_SECONDS)
+            self._wake.clear()
+        self.session.close()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_outbox_worker():
+    """啟動 (每個程序一個) 背景寄信執行緒；重複呼叫不會重複啟動"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = OutboxWorker()
+            _worker.start()
+    return _worker
+
+
+def wake_outbox_worker():
+    """有新信件 commit 後呼叫，讓背景執行緒立即處理"""
+    if _worker is not None:
+        _worker.wake()
+
+
+def init_app(app):
+    """在第一個請求時啟動背景寄信執行緒 (避免 CLI 指令也啟動)"""
+    if not OUTBOX_ENABLED:
+        return
+
+    @app.before_request
+    def _ensure_outbox_worker():
+        if _worker is None:
+            start_outbox_worker()
+
 
 # --- 範本 ---
-def send_transfer_notification(to_address, from_name, amount, currency, to_name):
+def queue_transfer_notification(conn, to_address, from_name, amount, currency, to_name):
     subject = "[銀行系統] 轉帳通知"
     body = f"""
     您好,
-    
+
     {from_name} 剛剛轉出了一筆款項:
-    
+
     金額: {amount:,.2f} {currency}
     轉給: {to_name}
-    
+
     這是一封自動通知信。
     """
-    send_email(to_address, subject, body)
+    enqueue_email(conn, to_address, subject, body)
 
-def send_exchange_notification(to_address, from_amount, from_currency, to_amount, to_currency):
+def queue_exchange_notification(conn, to_address, from_amount, from_currency, to_amount, to_currency):
     subject = "[銀行系統] 換匯通知"
     body = f"""
     您好,
-    
+
     您剛剛完成了一筆換匯交易:
-    
+
     轉出: {from_amount:,.2f} {from_currency}
     換得: {to_amount:,.2f} {to_currency}
-    
+
     這是一封自動通知信。
     """
-    send_email(to_address, subject, body)
+    enqueue_email(conn, to_address, subject, body)
 
 def send_password_reset_notification(to_address, new_password):
+    """含新密碼的信件直接寄送，不寫入 outbox (避免明文密碼留在資料庫)"""
     subject = "[銀行系統] 密碼重設通知"
     body = f"""
     您好,
-    
+
     管理員已為您重設密碼。您的新密碼是:
-    
+
     {new_password}
-    
+
     請立即登入並變更您的密碼。
     """
-    send_email(to_address, subject, body)
\ No newline at end of file
+    return send_email(to_address, subject, body)
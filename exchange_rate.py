@@ -2,53 +2,287 @@
 #用來處理呼叫外部 API 的邏輯。我們還會加入「快取」(Cache) 機制，避免每次刷新都去呼叫 API（免費版有請求限制）
 import requests
 import os
+import json
+import sqlite3
 import time
+import threading
+from datetime import datetime
 from dotenv import load_dotenv
+from database import get_db_conn
 
 load_dotenv() # 確保環境變數被載入
 
 API_KEY = os.getenv("EXCHANGE_RATE_API_KEY")
 BASE_URL = f"https://v6.exchangerate-api.com/v6/{API_KEY}/latest/"
+# 只向 API 取一張基準貨幣的匯率表，其他幣別之間的匯率由交叉匯率推算
+BASE_CURRENCY = os.getenv("RATE_BASE_CURRENCY", "TWD")
 
-# 簡單的記憶體快取 (cache)，避免過度請求 API
+# 記憶體快取 (cache)，避免過度請求 API
 # 格式: { "貨幣": (時間戳, 匯率資料) }
+# - 未超過 CACHE_DURATION_SECONDS: 直接使用
+# - 超過但未超過 HARD_EXPIRY_SECONDS: 先回傳舊資料，同時在背景更新 (stale-while-revalidate)
+# - 沒有資料或已超過 HARD_EXPIRY_SECONDS: 等待更新完成
+# 同一個貨幣同時只會有一個更新請求 (single-flight)，其他執行緒等待或使用舊資料。
+# 每次取得的匯率表也寫入 rate_snapshots 資料表: 其他 worker 程序與重新啟動後直接使用最新快照，不必重新呼叫 API。
 _cache = {}
 CACHE_DURATION_SECONDS = 3600 # 快取 1 小時 (3600 秒)
+HARD_EXPIRY_SECONDS = int(os.getenv("RATE_HARD_EXPIRY_SECONDS", 6 * 3600)) # 舊資料最多可使用多久
+RETRY_SECONDS = 60 # 更新失敗後，多久內不再重試 (避免 API 故障時每個請求都重試)
+REQUEST_TIMEOUT = (float(os.getenv("RATE_CONNECT_TIMEOUT", 3)), float(os.getenv("RATE_READ_TIMEOUT", 5))) # (連線, 讀取) 秒
 
-def get_rates(base_currency="TWD"):
-    """
-    取得指定貨幣的匯率，並使用快取
-    """
-    global _cache
-    current_time = time.time()
-    
-    # 1. 檢查快取是否有效
-    if base_currency in _cache:
-        cache_time, cache_data = _cache[base_currency]
-        if current_time - cache_time < CACHE_DURATION_SECONDS:
-            print("[Cache] Using cached exchange rates.")
-            return cache_data
-
-    # 2. 快取失效或不存在，呼叫 API
+_lock = threading.Lock()
+_inflight = {} # { "貨幣": threading.Event }，更新中的貨幣
+_last_failure = {} # { "貨幣": 時間戳 }
+_warm_started = set() # 已嘗試從 rate_snapshots 載入的貨幣
+
+
+# --- 匯率快照 (rate_snapshots) ---
+
+def _load_latest_snapshot(base_currency):
+    """回傳資料庫中最新的 (時間戳, 匯率資料)，沒有快照時回傳 None"""
+    conn = get_db_conn()
+    try:
+        row = conn.execute(
+            "SELECT fetched_at, rates FROM rate_snapshots WHERE base = ? ORDER BY day DESC, fetched_at DESC LIMIT 1",
+            (base_currency,)
+        ).fetchone()
+        return (row['fetched_at'], json.loads(row['rates'])) if row else None
+    except sqlite3.Error as e:
+        print(f"讀取匯率快照失敗: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+def _save_snapshot(base_currency, fetched_at, rates):
+    conn = get_db_conn()
+    try:
+        conn.execute(
+            "INSERT INTO rate_snapshots (base, fetched_at, day, rates) VALUES (?, ?, ?, ?)",
+            (base_currency, fetched_at, datetime.fromtimestamp(fetched_at).strftime("%Y-%m-%d"), json.dumps(rates))
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"寫入匯率快照失敗: {e}")
+    finally:
+        conn.close()
+
+
+def _warm_start(base_currency):
+    """程序啟動後第一次使用時，以資料庫中的最新快照作為快取 (之後依一般的過期規則更新)"""
+    snapshot = _load_latest_snapshot(base_currency)
+    with _lock:
+        _warm_started.add(base_currency)
+        if snapshot and base_currency not in _cache:
+            _cache[base_currency] = snapshot
+
+
+def _fetch(base_currency):
+    """呼叫 API 取得匯率，成功時回傳匯率資料，失敗時回傳 None"""
     if not API_KEY:
         print("錯誤: 尚未設定 EXCHANGE_RATE_API_KEY")
         return None
 
     try:
-        print("[API] Fetching new exchange rates...")
-        response = requests.get(f"{BASE_URL}{base_currency}")
+        print(f"[API] Fetching new exchange rates ({base_currency})...")
+        response = requests.get(f"{BASE_URL}{base_currency}", timeout=REQUEST_TIMEOUT)
         response.raise_for_status() # 檢查 HTTP 錯誤
         data = response.json()
         
         if data.get("result") == "success":
-            rates = data.get("conversion_rates")
-            # 3. 更新快取
-            _cache[base_currency] = (current_time, rates)
-            return rates
+            return data.get("conversion_rates")
         else:
             print(f"匯率 API 錯誤: {data.get('error-type')}")
             return None
             
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"匯率 API 呼叫失敗: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def _refresh(base_currency, done):
+    """執行更新並通知等待中的執行緒 (由取得 _inflight 的執行緒呼叫)"""
+    try:
+        # 其他 worker 程序可能剛取得新的匯率表: 直接使用，不重複呼叫 API
+        snapshot = _load_latest_snapshot(base_currency)
+        if snapshot and time.time() - snapshot[0] < CACHE_DURATION_SECONDS:
+            with _lock:
+                _cache[base_currency] = snapshot
+            return
+
+        rates = _fetch(base_currency)
+        fetched_at = time.time()
+        if rates is not None:
+            _save_snapshot(base_currency, fetched_at, rates)
+        with _lock:
+            if rates is not None:
+                _cache[base_currency] = (fetched_at, rates)
+                _last_failure.pop(base_currency, None)
+            else:
+                _last_failure[base_currency] = fetched_at
+    finally:
+        with _lock:
+            _inflight.pop(base_currency, None)
+        done.set()
+
+
+def _start_refresh(base_currency):
+    """
+    若沒有更新正在進行，登記一個新的更新並回傳 (Event, True)；
+    否則回傳進行中的 (Event, False)。呼叫端須持有 _lock。
+    """
+    done = _inflight.get(base_currency)
+    if done is not None:
+        return done, False
+    done = _inflight[base_currency] = threading.Event()
+    return done, True
+
+
+def _get_table(base_currency):
+    """
+    取得以 base_currency 為基準的 API 匯率表，並使用快取
+    """
+    if base_currency not in _warm_started:
+        _warm_start(base_currency)
+
+    current_time = time.time()
+
+    with _lock:
+        entry = _cache.get(base_currency)
+        age = current_time - entry[0] if entry else None
+
+        # 1. 快取有效
+        if entry and age < CACHE_DURATION_SECONDS:
+            return entry[1]
+
+        recently_failed = current_time - _last_failure.get(base_currency, 0) < RETRY_SECONDS
+
+        # 2. 快取過期但仍可使用: 回傳舊資料，背景更新
+        if entry and age < HARD_EXPIRY_SECONDS:
+            if not recently_failed:
+                done, leader = _start_refresh(base_currency)
+                if leader:
+                    threading.Thread(
+                        target=_refresh, args=(base_currency, done), name=f"rates-{base_currency}", daemon=True
+                    ).start()
+            return entry[1]
+
+        # 3. 沒有可用的資料: 等待 (或執行) 更新
+        if recently_failed and base_currency not in _inflight:
+            return None
+        done, leader = _start_refresh(base_currency)
+
+    if leader:
+        _refresh(base_currency, done)
+    else:
+        done.wait(sum(REQUEST_TIMEOUT))
+
+    with _lock:
+        entry = _cache.get(base_currency)
+    if entry and time.time() - entry[0] < HARD_EXPIRY_SECONDS:
+        return entry[1]
+    return None
+
+
+# --- 交叉匯率 ---
+# 由基準匯率表 (1 BASE = table[X] X) 預先算出所有幣別組合: matrix[A][B] = table[B] / table[A]
+# 基準表更新時才重新計算，之後的報價都是純記憶體查表。
+_matrix = None
+_matrix_table = None # 產生 _matrix 所用的基準表 (用物件身分判斷是否需要重算)
+
+
+def _build_matrix(table):
+    valid = {currency: rate for currency, rate in table.items() if isinstance(rate, (int, float)) and rate > 0}
+    return {a: {b: rate_b / rate_a for b, rate_b in valid.items()} for a, rate_a in valid.items()}
+
+
+def get_matrix():
+    """回傳 { 來源貨幣: { 目標貨幣: 匯率 } }，無法取得匯率時回傳 None"""
+    global _matrix, _matrix_table
+    table = _get_table(BASE_CURRENCY)
+    if table is None:
+        return None
+    with _lock:
+        if _matrix_table is not table:
+            _matrix, _matrix_table = _build_matrix(table), table
+        return _matrix
+
+
+def get_table_time():
+    """目前使用中的基準匯率表的取得時間 (時間戳)，沒有匯率表時回傳 None"""
+    with _lock:
+        entry = _cache.get(BASE_CURRENCY)
+    return entry[0] if entry else None
+
+
+def get_rates(base_currency="TWD"):
+    """
+    取得指定貨幣的匯率 (1 base_currency = rates[X] X)，由基準匯率表推算，不會另外呼叫 API
+    """
+    matrix = get_matrix()
+    if matrix is None:
+        return None
+    return matrix.get(base_currency)
+
+
+def get_cross_rate(from_currency, to_currency):
+    """1 from_currency 可換得多少 to_currency；無法取得時回傳 None"""
+    rates = get_rates(from_currency)
+    return rates.get(to_currency) if rates else None
+
+
+# --- 歷史匯率 ---
+# 以 rate_snapshots 查詢某一天當時適用的匯率 (當天或之前最後一筆快照)，讓跨幣別分析以交易當時的匯率計價。
+HISTORY_CACHE_SIZE = 4000 # 最多快取幾天的歷史匯率表 (今天以前的快照不會再改變)
+_history = {} # { "YYYY-MM-DD": 匯率資料 }
+
+
+def _table_on(day):
+    """回傳 day 當時適用的基準匯率表；早於第一筆快照的日期使用第一筆快照，完全沒有快照時回傳 None"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    if day < today:
+        with _lock:
+            table = _history.get(day)
+        if table is not None:
+            return table
+
+    conn = get_db_conn()
+    try:
+        row = conn.execute(
+            "SELECT rates FROM rate_snapshots WHERE base = ? AND day <= ? ORDER BY day DESC, fetched_at DESC LIMIT 1",
+            (BASE_CURRENCY, day)
+        ).fetchone()
+        if row is None:
+            row = conn.execute(
+                "SELECT rates FROM rate_snapshots WHERE base = ? ORDER BY day ASC, fetched_at ASC LIMIT 1",
+                (BASE_CURRENCY,)
+            ).fetchone()
+    except sqlite3.Error as e:
+        print(f"讀取歷史匯率失敗: {e}")
+        return None
+    finally:
+        conn.close()
+    if row is None:
+        return None
+
+    table = json.loads(row['rates'])
+    if day < today:
+        with _lock:
+            if len(_history) >= HISTORY_CACHE_SIZE:
+                _history.clear()
+            _history[day] = table
+    return table
+
+
+def get_rate_on(from_currency, to_currency, day):
+    """
+    day ('YYYY-MM-DD') 當時 1 from_currency 可換得多少 to_currency。
+    沒有當時的快照 (或快照中沒有該幣別) 時，使用目前的匯率；都無法取得時回傳 None。
+    """
+    table = _table_on(day)
+    if table:
+        rate_from, rate_to = table.get(from_currency), table.get(to_currency)
+        if rate_from and rate_to:
+            return rate_to / rate_from
+    return get_cross_rate(from_currency, to_currency)
@@ -0,0 +1,137 @@
+# 本機的備註分類模型 (不需網路)
+# 以字元 n-gram 的 Naive Bayes 計分 (含分類的先驗機率): 先用內建的關鍵字當作種子訓練資料，
+# 再以已標記的備註 (note_categories 中遠端模型的分類結果) 持續學習。
+# 中文備註通常很短 (例如 "計程車"、"7-11 購物")，字元 n-gram 不需要斷詞。
+import math
+import threading
+
+NGRAM_SIZES = (1, 2, 3)
+SMOOTHING = 0.5 # Laplace 平滑
+SEED_WEIGHT = 3 # 每個種子關鍵字視為幾筆訓練資料
+
+# 種子關鍵字 (分類名稱需與 logic.CATEGORIES 一致)
+SEED_KEYWORDS = {
+    "餐飲美食": [
+        "早餐", "午餐", "晚餐", "宵夜", "早午餐", "便當", "飯", "麵", "餐廳", "小吃", "火鍋", "燒肉",
+        "咖啡", "星巴克", "麥當勞", "肯德基", "飲料", "手搖", "珍奶", "甜點", "蛋糕", "水果",
+        "外送", "ubereats", "foodpanda", "lunch", "dinner", "coffee", "restaurant",
+    ],
+    "交通出行": [
+        "計程車", "uber", "捷運", "公車", "客運", "高鐵", "台鐵", "火車", "機票", "加油", "油錢",
+        "停車", "停車費", "etag", "悠遊卡", "租車", "機車", "taxi", "mrt", "bus", "parking",
+    ],
+    "休閒娛樂": [
+        "電影", "遊戲", "ktv", "唱歌", "演唱會", "展覽", "門票", "旅遊", "旅行", "住宿", "飯店",
+        "健身", "運動", "漫畫", "netflix", "spotify", "steam", "movie", "game",
+    ],
+    "網路購物": [
+        "網購", "蝦皮", "momo", "pchome", "露天", "淘寶", "博客來", "amazon", "shopee", "線上購物", "訂單",
+    ],
+    "帳單繳費": [
+        "電費", "水費", "瓦斯", "電話費", "手機費", "網路費", "房租", "管理費", "保險", "保費",
+        "信用卡", "繳費", "學費", "貸款", "月租", "稅", "bill", "rent",
+    ],
+    "家居生活": [
+        "日用品", "生活用品", "衛生紙", "清潔", "洗衣", "家具", "家電", "寢具", "廚具", "五金",
+        "維修", "藥局", "超市", "全聯", "家樂福", "好市多", "costco", "ikea",
+    ],
+    "其他": [
+        "還錢", "借錢", "借款", "代墊", "分帳", "紅包", "禮金", "禮物", "捐款", "零用錢", "生活費",
+    ],
+}
+
+
+def _ngrams(text):
+    """
+    text 需先正規化 (ai_services._normalize_note)；n-gram 不跨越空白。
+    單一字元只取中文等非 ASCII 字元 (英數字母單獨出現沒有意義，例如 "z" 會對應到 "amazon")。
+    """
+    grams = [ch for ch in text if ord(ch) > 127 and not ch.isspace()] if 1 in NGRAM_SIZES else []
+    for token in text.split():
+        for n in NGRAM_SIZES:
+            if n > 1:
+                grams.extend(token[i:i + n] for i in range(len(token) - n + 1))
+    return grams
+
+
+class NgramClassifier:
+    """
+    字元 n-gram Naive Bayes 分類器，可增量學習 (learn) 並批次分類 (classify)。
+    classify 只使用訓練時看過的 n-gram；完全沒有看過的備註回傳預設分類、信心 0。
+    """
+
+    def __init__(self, categories):
+        self.categories = list(categories)
+        self.default_category = "其他" if "其他" in self.categories else self.categories[-1]
+        self._index = {category: i for i, category in enumerate(self.categories)}
+        self._counts = {} # ngram -> [各分類出現次數]
+        self._totals = [0] * len(self.categories)
+        self._docs = [0] * len(self.categories) # 各分類的訓練筆數 (先驗機率)
+        # ngram -> (各分類的 log(次數 + 平滑))；learn 只更新該筆備註的 n-gram，
+        # 分母 (各分類總數與字彙量) 與先驗機率在 classify 時以 _totals / _docs 計算
+        self._numerators = {}
+        self._lock = threading.Lock()
+        self.samples = 0
+
+    @classmethod
+    def with_seeds(cls, categories):
+        model = cls(categories)
+        for category, keywords in SEED_KEYWORDS.items():
+            if category in model._index:
+                for keyword in keywords:
+                    model.learn(keyword, category, SEED_WEIGHT)
+        model.samples = 0 # samples 只計算種子以外的訓練資料
+        return model
+
+    def learn(self, text, category, weight=1):
+        """加入一筆已標記的 (正規化後) 備註；不在分類清單中的標籤會被忽略"""
+        i = self._index.get(category)
+        if i is None or not text:
+            return
+        with self._lock:
+            for gram in _ngrams(text):
+                counts = self._counts.get(gram)
+                if counts is None:
+                    counts = self._counts[gram] = [0] * len(self.categories)
+                counts[i] += weight
+                self._totals[i] += weight
+                self._numerators[gram] = tuple(math.log(count + SMOOTHING) for count in counts)
+            self._docs[i] += weight
+            self.samples += 1
+
+    def _log_priors(self):
+        """log P(分類)，以訓練筆數加一平滑"""
+        total = sum(self._docs) + len(self.categories)
+        return [math.log((docs + 1) / total) for docs in self._docs]
+
+    def classify(self, texts):
+        """
+        :param texts: 正規化後的備註列表
+        :return: [(分類, 信心 0~1), ...]
+        """
+        with self._lock:
+            vocab = len(self._counts)
+            denominators = [math.log(total + SMOOTHING * vocab) for total in self._totals]
+            priors = self._log_priors()
+        numerators = self._numerators
+
+        results = []
+        for text in texts:
+            grams = _ngrams(text)
+            vectors = [vector for vector in map(numerators.get, grams) if vector is not None]
+            if not vectors:
+                results.append((self.default_category, 0.0))
+                continue
+            n = len(vectors)
+            scores = [
+                prior + sum(column) - n * denominator
+                for prior, column, denominator in zip(priors, zip(*vectors), denominators)
+            ]
+            best = max(scores)
+            top = scores.index(best)
+            # softmax 的最高機率 (先減去最大值避免溢位)，再乘上備註中看過的 n-gram 比例:
+            # 只有一小段字認得的備註 (例如 "7-11 購物") 信心較低，local-first 時會送給遠端模型
+            coverage = math.sqrt(len(vectors) / len(grams))
+            confidence = coverage / sum(math.exp(s - best) for s in scores)
+            results.append((self.categories[top], confidence))
+        return results
@@ -1,6 +1,6 @@
 # (更新的 logic.py)
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 from database import get_db_conn
 from werkzeug.security import generate_password_hash, check_password_hash
 import ai_services
@@ -8,9 +8,14 @@ import csv
 import io
 import exchange_rate 
 import email_service 
+import money
+import rate_resolver
 import json 
 import random 
 import string 
+import threading
+import os
+import time
 
 DATE_FMT = "%Y-%m-%d"
 MONTH_FMT = "%Y-%m"
@@ -21,32 +26,48 @@ def get_today_str():
 def get_this_month_str():
     return datetime.now().strftime(MONTH_FMT)
 
+def _month_bounds(month):
+    """ 'YYYY-MM' -> ('YYYY-MM-01', 下個月 1 號)，格式錯誤時回傳空區間 """
+    try:
+        first_day = datetime.strptime(month, MONTH_FMT)
+    except (TypeError, ValueError):
+        return month, month
+    next_month = (first_day + timedelta(days=32)).replace(day=1)
+    return first_day.strftime(DATE_FMT), next_month.strftime(DATE_FMT)
+
+def _date_filter(column, month=None, start_date=None, end_date=None):
+    """
+    產生日期篩選的 SQL 片段 (半開區間 [start, end))，讓查詢可以走 (wallet_id, date, id) 索引的範圍掃描，
+    而不是對每一列計算 strftime()。
+    start_date / end_date 皆為 'YYYY-MM-DD' 且包含當天。
+    回傳 (sql, params)，sql 以 "AND " 開頭。
+    """
+    sql = ""
+    params = []
+    if month:
+        month_start, month_end = _month_bounds(month)
+        sql += f"AND {column} >= ? AND {column} < ? "
+        params += [month_start, month_end]
+    if start_date:
+        sql += f"AND {column} >= ? "
+        params.append(start_date)
+    if end_date:
+        try:
+            end_exclusive = (datetime.strptime(end_date, DATE_FMT) + timedelta(days=1)).strftime(DATE_FMT)
+        except ValueError:
+            end_exclusive = end_date
+        sql += f"AND {column} < ? "
+        params.append(end_exclusive)
+    return sql, params
+
 # --- Config (手動匯率) ---
+# 手動匯率的讀寫與快取集中在 rate_resolver
 
 def get_manual_rates():
-    conn = get_db_conn()
-    try:
-        row = conn.execute("SELECT value FROM system_config WHERE key = 'manual_rates'").fetchone()
-        if row:
-            return json.loads(row['value'])
-        return {}
-    except Exception:
-        return {}
-    finally:
-        conn.close()
+    return rate_resolver.get_manual_rates()
 
 def set_manual_rates(rates_dict):
-    conn = get_db_conn()
-    try:
-        rates_json = json.dumps(rates_dict)
-        conn.execute("INSERT OR REPLACE INTO system_config (key, value) VALUES ('manual_rates', ?)", (rates_json,))
-        conn.commit()
-        return {"success": True}
-    except Exception as e:
-        conn.rollback()
-        return {"success": False, "error": str(e)}
-    finally:
-        conn.close()
+    return rate_resolver.set_manual_rates(rates_dict)
 
 
 # --- User & Auth ---
@@ -65,6 +86,7 @@ def register_customer(name, password, amount, date_str, role='customer'):
     if not date_str: date_str = get_today_str()
 
     hashed_password = generate_password_hash(password)
+    amount_minor = money.to_minor(amount, 'TWD')
     conn = get_db_conn()
     try:
         cursor = conn.execute("SELECT id FROM customers WHERE name = ?", (name,))
@@ -81,19 +103,17 @@ def register_customer(name, password, amount, date_str, role='customer'):
         
         cursor = conn.execute(
             "INSERT INTO wallets (customer_id, currency, balance) VALUES (?, ?, ?)",
-            (new_customer_id, 'TWD', amount)
+            (new_customer_id, 'TWD', amount_minor)
         )
         new_wallet_id = cursor.lastrowid
 
-        if amount > 0:
-            conn.execute(
-                "INSERT INTO transactions (wallet_id, date, type, amount, balance_after, note) "
-                "VALUES (?, ?, ?, ?, ?, ?)",
-                (new_wallet_id, date_str, '開戶', amount, amount, 'TWD 錢包開戶')
-            )
+        if amount_minor > 0:
+            _post_transactions(conn, [
+                (new_wallet_id, date_str, '開戶', amount_minor, amount_minor, 'TWD 錢包開戶', None)
+            ])
         
         conn.commit()
-        return {"success": True, "name": name, "twd_balance": amount}
+        return {"success": True, "name": name, "twd_balance": money.from_minor(amount_minor, 'TWD')}
     except sqlite3.Error as e:
         conn.rollback()
         return {"success": False, "error": f"資料庫錯誤: {e}"}
@@ -110,17 +130,18 @@ def check_login(name, password):
         return {"success": False, "error": "此帳號已被停權，請聯繫管理員"}
 
     if check_password_hash(row['password'], password):
-        return {"success": True, "user": {"name": row['name'], "role": row['role']}}
+        _cache_profile(row)
+        return {"success": True, "user": {"id": row['id'], "name": row['name'], "role": row['role']}}
     else:
         return {"success": False, "error": "密碼錯誤"}
 
-def change_password(customer_name, old_password, new_password):
+def change_password(customer_id, old_password, new_password):
     if not old_password or not new_password:
         return {"success": False, "error": "新舊密碼不可為空"}
     
     conn = get_db_conn()
     try:
-        row = conn.execute("SELECT password FROM customers WHERE name = ?", (customer_name,)).fetchone()
+        row = conn.execute("SELECT password FROM customers WHERE id = ?", (customer_id,)).fetchone()
         if not row:
             return {"success": False, "error": "查無此帳號"}
         
@@ -128,7 +149,7 @@ def change_password(customer_name, old_password, new_password):
             return {"success": False, "error": "舊密碼錯誤"}
             
         new_hashed_password = generate_password_hash(new_password)
-        conn.execute("UPDATE customers SET password = ? WHERE name = ?", (new_hashed_password, customer_name))
+        conn.execute("UPDATE customers SET password = ? WHERE id = ?", (new_hashed_password, customer_id))
         conn.commit()
         return {"success": True, "message": "密碼更新成功"}
     except sqlite3.Error as e:
@@ -138,18 +159,17 @@ def change_password(customer_name, old_password, new_password):
         conn.close()
 
 
-def get_my_wallets(customer_name):
-    # (邏輯不變)
+def get_my_wallets(customer_id):
     conn = get_db_conn()
     try:
         rows = conn.execute(
-            "SELECT w.currency, w.balance FROM wallets w "
-            "JOIN customers c ON w.customer_id = c.id "
-            "WHERE c.name = ?", 
-            (customer_name,)
+            "SELECT currency, balance FROM wallets WHERE customer_id = ?", (customer_id,)
         ).fetchall()
         
-        wallets = [dict(row) for row in rows]
+        wallets = [
+            {"currency": row['currency'], "balance": money.from_minor(row['balance'], row['currency'])}
+            for row in rows
+        ]
         
         total_twd_value = 0.0
         twd_rates = exchange_rate.get_rates("TWD") 
@@ -165,24 +185,68 @@ def get_my_wallets(customer_name):
                     twd_equivalent = balance / twd_rates[currency]
                     total_twd_value += twd_equivalent
         
-        customer_row = conn.execute("SELECT email FROM customers WHERE name = ?", (customer_name,)).fetchone()
-        email = customer_row['email'] if customer_row else None
+        profile = get_customer_profile(customer_id)
+        email = profile['email'] if profile else None
         
         return {"success": True, "wallets": wallets, "email": email, "total_twd_value": total_twd_value}
     finally:
         conn.close()
 
 
-def update_my_email(customer_name, email):
-    # (邏輯不變)
+def _normalize_email(email):
+    """ 空字串視為清除 email (None)；格式錯誤時拋出 ValueError """
+    email = (email or "").strip() or None
+    if email is not None and not email_service.is_valid_address(email):
+        raise ValueError("Email 格式錯誤")
+    return email
+
+def update_my_email(customer_id, email):
+    try:
+        email = _normalize_email(email)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
     conn = get_db_conn()
     try:
-        conn.execute("UPDATE customers SET email = ? WHERE name = ?", (email, customer_name))
+        conn.execute("UPDATE customers SET email = ?, data_version = data_version + 1 WHERE id = ?", (email, customer_id))
         conn.commit()
+        _invalidate_profile(customer_id)
         return {"success": True, "email": email}
     except sqlite3.Error as e: conn.rollback(); return {"success": False, "error": f"資料庫錯誤: {e}"}
     finally: conn.close()
 
+# --- Customer Profile Cache ---
+# 登入時把 customer_id 存進 session，logic 層以 id 操作 (不再每次以姓名查 id 或 JOIN customers)。
+# 姓名 / email / 角色快取在程序內: 本程序的 update_my_email / admin_update_user 會立即失效，
+# 其他 worker 程序最多 PROFILE_CACHE_SECONDS 秒後重新讀取。
+PROFILE_CACHE_SECONDS = float(os.getenv("PROFILE_CACHE_SECONDS", 30))
+_profiles = {} # customer_id -> (profile, 讀取時間)
+_profiles_lock = threading.Lock()
+
+def _cache_profile(row):
+    profile = {key: row[key] for key in ('id', 'name', 'email', 'role', 'is_active')}
+    with _profiles_lock:
+        _profiles[profile['id']] = (profile, time.time())
+    return profile
+
+def _invalidate_profile(customer_id):
+    with _profiles_lock:
+        _profiles.pop(customer_id, None)
+
+def get_customer_profile(customer_id):
+    """ 回傳 {"id", "name", "email", "role", "is_active"} (快取；請勿修改)，查無此人時回傳 None """
+    with _profiles_lock:
+        entry = _profiles.get(customer_id)
+    if entry and time.time() - entry[1] < PROFILE_CACHE_SECONDS:
+        return entry[0]
+    conn = get_db_conn()
+    try:
+        row = conn.execute(
+            "SELECT id, name, email, role, is_active FROM customers WHERE id = ?", (customer_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return _cache_profile(row) if row else None
+
 # --- Wallet & Transaction ---
 
 def _get_or_create_wallet(conn, customer_id, currency):
@@ -198,54 +262,339 @@ def _get_or_create_wallet(conn, customer_id, currency):
     else:
         cursor = conn.execute(
             "INSERT INTO wallets (customer_id, currency, balance) VALUES (?, ?, ?)",
-            (customer_id, currency, 0.0)
+            (customer_id, currency, 0)
         )
         new_wallet_id = cursor.lastrowid
-        return new_wallet_id, 0.0 
+        return new_wallet_id, 0 
+
+def _post_transactions(conn, rows):
+    """
+    寫入交易紀錄，並在同一個交易中更新收支彙總表 (呼叫端須已開啟交易並自行更新錢包餘額)。
+    rows: [(wallet_id, date, type, amount, balance_after, note, exchange_rate), ...]，金額為最小單位
+    有備註的一般支出 category 先留空，commit 後由背景分類執行緒補上 (呼叫 _wake_categorizer)。
+    """
+    conn.executemany(
+        "INSERT INTO transactions (wallet_id, date, type, amount, balance_after, note, exchange_rate, category) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(*row, _initial_category(row[2], row[3], row[5])) for row in rows]
+    )
+    _update_rollups(conn, [(row[0], row[1], row[2], row[3], row[5]) for row in rows])
+    _bump_wallet_owners(conn, {row[0] for row in rows})
 
-def deposit_money(customer_name, amount, date_str, currency='TWD', note=None):
-    # (邏輯不變)
+# --- Data Version ---
+# customers.data_version 在每次寫入客戶可見資料的同一個交易中遞增，
+# app.py 以它產生 ETag (資料沒變時 GET API 回 304)。
+
+def _bump_data_version(conn, customer_ids):
+    conn.executemany(
+        "UPDATE customers SET data_version = data_version + 1 WHERE id = ?", [(i,) for i in set(customer_ids)]
+    )
+
+def _bump_wallet_owners(conn, wallet_ids):
+    for chunk in _chunks(wallet_ids):
+        conn.execute(
+            "UPDATE customers SET data_version = data_version + 1 "
+            f"WHERE id IN (SELECT customer_id FROM wallets WHERE id IN ({','.join('?' * len(chunk))}))",
+            chunk
+        )
+
+def get_data_version(customer_id):
+    """回傳客戶的 data_version，查無此人時回傳 None (只查 customers 主鍵，不碰交易表)"""
+    conn = get_db_conn()
+    try:
+        row = conn.execute("SELECT data_version FROM customers WHERE id = ?", (customer_id,)).fetchone()
+        return row['data_version'] if row else None
+    finally:
+        conn.close()
+
+def _initial_category(ttype, amount, note):
+    """ 寫入時即可決定的分類；需要 AI 的回傳 None (待分類) """
+    source = _flow_source(ttype, amount, note)
+    return None if source == NOTED_SPEND_SOURCE else source
+
+# --- Cash Flow Rollups ---
+
+# 有備註的一般支出：彙總表只記總額，分類留到分析時交給 AI
+NOTED_SPEND_SOURCE = '_備註支出'
+
+def _flow_source(ttype, amount, note):
+    """ 交易的收支來源分類 (analyze_cash_flow 的 income_sources / spend_sources 鍵值)；migrations/0014 以 SQL 重現相同規則 """
+    if amount > 0:
+        if note and note.startswith("管理員"):
+            return '管理員調整'
+        elif ttype in ['存款', '開戶']:
+            return ttype
+        elif ttype == '轉入':
+            return '轉帳收入'
+        elif ttype == '換匯轉入':
+            return '換匯收入'
+        return '其他收入'
+
+    if note and note.startswith("管理員"):
+        return '管理員調整'
+    elif ttype == '換匯轉出':
+        return '換匯支出'
+    elif note:
+        # 只要有備註 (無論是提款或轉出)，都交給 AI
+        return NOTED_SPEND_SOURCE
+    elif ttype == '轉出':
+        return '轉帳支出'
+    elif ttype == '提款':
+        return '提款 (無備註)'
+    return '其他支出 (無備註)'
+
+def _update_rollups(conn, rows):
+    """
+    將交易累加進每日 / 每月收支彙總表。
+    rows: [(wallet_id, date, type, amount, note), ...]，金額為最小單位
+    """
+    daily = {}
+    for wallet_id, date_str, ttype, amount, note in rows:
+        if not amount:
+            continue
+        key = (wallet_id, date_str, _flow_source(ttype, amount, note))
+        totals = daily.setdefault(key, [0, 0, 0, 0]) # income, spend, income_count, spend_count
+        if amount > 0:
+            totals[0] += amount
+            totals[2] += 1
+        else:
+            totals[1] += -amount
+            totals[3] += 1
+
+    monthly = {}
+    for (wallet_id, date_str, source), totals in daily.items():
+        month_totals = monthly.setdefault((wallet_id, date_str[:7], source), [0, 0, 0, 0])
+        for i, value in enumerate(totals):
+            month_totals[i] += value
+
+    conn.executemany(
+        "INSERT INTO daily_flow_rollups (wallet_id, day, source, income, spend, income_count, spend_count) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (wallet_id, day, source) DO UPDATE SET "
+        "income = income + excluded.income, spend = spend + excluded.spend, "
+        "income_count = income_count + excluded.income_count, spend_count = spend_count + excluded.spend_count",
+        [(*key, *totals) for key, totals in daily.items()]
+    )
+    conn.executemany(
+        "INSERT INTO monthly_flow_rollups (wallet_id, month, source, income, spend, income_count, spend_count) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (wallet_id, month, source) DO UPDATE SET "
+        "income = income + excluded.income, spend = spend + excluded.spend, "
+        "income_count = income_count + excluded.income_count, spend_count = spend_count + excluded.spend_count",
+        [(*key, *totals) for key, totals in monthly.items()]
+    )
+
+def rebuild_rollups():
+    """ 從交易表重建收支彙總表 (用於遷移後回填或修復) """
+    conn = get_db_conn()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM daily_flow_rollups")
+        conn.execute("DELETE FROM monthly_flow_rollups")
+        cursor = conn.execute("SELECT wallet_id, date, type, amount, note FROM transactions ORDER BY wallet_id, date")
+        count = 0
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            _update_rollups(conn, [tuple(row) for row in rows])
+            count += len(rows)
+        conn.commit()
+        return {"success": True, "transactions": count}
+    except sqlite3.Error as e:
+        conn.rollback()
+        return {"success": False, "error": f"資料庫錯誤: {e}"}
+    finally:
+        conn.close()
+
+# --- Write-time Categorization ---
+# 待分類的交易 (category IS NULL，有部分索引) 本身就是持久化的佇列；
+# 寫入後喚醒背景執行緒，由它呼叫 AI (經過 ai_services 的快取) 並回寫 category。
+# 同時記錄分類來源 (category_source) 與本機模型的信心；信心低於 LOCAL_CONFIDENCE 的本機結果記為 'guess'，
+# 遠端模型可用時 (CLASSIFIER_MODE 不是 local) 背景執行緒在沒有待分類交易時會重新分類這些猜測。
+
+CATEGORIZE_BATCH_SIZE = 500
+CATEGORIZE_RETRY_SECONDS = 60 # AI 服務失敗時，多久後再試
+_recategorize_after = 0 # recategorize_guesses 的進度 (上一批最後的交易 id)
+_categorizer_wake = threading.Event()
+_categorizer_thread = None
+_categorizer_lock = threading.Lock()
+
+def _category_update(category, source, confidence):
+    """ classify_notes_detailed 的結果 -> (category, category_source, category_confidence) """
+    if source == "local" and confidence < ai_services.LOCAL_CONFIDENCE:
+        source = "guess"
+    return category, source, confidence
+
+def categorize_pending(batch_size=CATEGORIZE_BATCH_SIZE):
+    """
+    分類一批待分類的交易。
+    回傳 (已分類筆數, 仍無法分類筆數)。
+    """
+    conn = get_db_conn()
+    try:
+        rows = conn.execute(
+            "SELECT id, wallet_id, type, amount, note FROM transactions WHERE category IS NULL ORDER BY id LIMIT ?",
+            (batch_size,)
+        ).fetchall()
+        if not rows:
+            return 0, 0
+
+        updates = []
+        noted = []
+        for row in rows:
+            category = _initial_category(row['type'], row['amount'], row['note'])
+            if category is None:
+                noted.append(row)
+            else:
+                updates.append((category, None, None, row['id'])) # 遷移前的舊資料
+        
+        failed = 0
+        if noted:
+            ai_results = ai_services.classify_notes_detailed([row['note'] for row in noted], CATEGORIES)
+            for row, (category, source, confidence) in zip(noted, ai_results):
+                if category is None:
+                    failed += 1
+                else:
+                    updates.append((*_category_update(category, source, confidence), row['id']))
+        updated_ids = {update[-1] for update in updates}
+
+        if updates:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "UPDATE transactions SET category = ?, category_source = ?, category_confidence = ? "
+                "WHERE id = ? AND category IS NULL",
+                updates
+            )
+            _bump_wallet_owners(conn, {row['wallet_id'] for row in rows if row['id'] in updated_ids})
+            conn.commit()
+        return len(updates), failed
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"交易分類寫入失敗: {e}")
+        return 0, 0
+    finally:
+        conn.close()
+
+def recategorize_guesses(batch_size=CATEGORIZE_BATCH_SIZE):
+    """
+    重新分類一批本機模型的低信心猜測 (category_source = 'guess')，依 id 輪流處理。
+    local-first 時這些備註會送給遠端模型；遠端仍無法分類的保留原本的猜測，之後再試。
+    回傳 (已重新分類筆數, 仍為猜測的筆數)；只用本機模型時不處理。
+    """
+    global _recategorize_after
+    if ai_services.CLASSIFIER_MODE == "local":
+        return 0, 0
+    conn = get_db_conn()
+    try:
+        query = ("SELECT id, wallet_id, note FROM transactions WHERE category_source = 'guess' AND id > ? "
+                 "ORDER BY id LIMIT ?")
+        rows = conn.execute(query, (_recategorize_after, batch_size)).fetchall()
+        if not rows and _recategorize_after:
+            _recategorize_after = 0
+            rows = conn.execute(query, (0, batch_size)).fetchall()
+        if not rows:
+            return 0, 0
+        _recategorize_after = rows[-1]['id'] if len(rows) == batch_size else 0
+
+        updates = []
+        ai_results = ai_services.classify_notes_detailed([row['note'] for row in rows], CATEGORIES)
+        for row, result in zip(rows, ai_results):
+            category, source, confidence = _category_update(*result)
+            if category is not None and source != "guess":
+                updates.append((category, source, confidence, row['id']))
+        updated_ids = {update[-1] for update in updates}
+
+        if updates:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "UPDATE transactions SET category = ?, category_source = ?, category_confidence = ? "
+                "WHERE id = ? AND category_source = 'guess'",
+                updates
+            )
+            _bump_wallet_owners(conn, {row['wallet_id'] for row in rows if row['id'] in updated_ids})
+            conn.commit()
+        return len(updates), len(rows) - len(updates)
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"交易重新分類寫入失敗: {e}")
+        return 0, 0
+    finally:
+        conn.close()
+
+def _categorizer_loop():
+    while True:
+        try:
+            categorized, failed = categorize_pending()
+            if not categorized and not failed:
+                # 沒有待分類交易時，才把低信心的猜測交給遠端模型重新分類
+                categorized, failed = recategorize_guesses()
+        except Exception as e:
+            print(f"背景分類錯誤: {e}")
+            categorized, failed = 0, 1
+        if failed:
+            # AI 服務暫時失敗: 等待一段時間 (或下一次寫入) 再試
+            _categorizer_wake.wait(CATEGORIZE_RETRY_SECONDS)
+        elif not categorized:
+            _categorizer_wake.wait()
+        _categorizer_wake.clear()
+
+def start_categorization_worker():
+    """ 啟動 (每個程序一個) 背景分類執行緒；重複呼叫不會重複啟動 """
+    global _categorizer_thread
+    with _categorizer_lock:
+        if _categorizer_thread is None or not _categorizer_thread.is_alive():
+            _categorizer_thread = threading.Thread(target=_categorizer_loop, name="categorizer", daemon=True)
+            _categorizer_thread.start()
+            _categorizer_wake.set() # 啟動時先掃一次既有的待分類交易
+
+def _wake_categorizer():
+    """ 有新的待分類交易 commit 後呼叫 """
+    _categorizer_wake.set()
+
+def init_app(app):
+    """ 在第一個請求時啟動背景分類執行緒 (避免 CLI 指令也啟動)；設定 CATEGORIZE_WORKER=0 可停用 """
+    if os.getenv("CATEGORIZE_WORKER", "1") == "0":
+        return
+
+    @app.before_request
+    def _ensure_categorization_worker():
+        if _categorizer_thread is None:
+            start_categorization_worker()
+
+def deposit_money(customer_id, amount, date_str, currency='TWD', note=None):
+    # amount 為主幣金額，寫入資料庫前轉為最小單位
+    amount = money.to_minor(amount, currency)
     if amount <= 0: return {"success": False, "error": "金額必須 > 0"}
     if not date_str: date_str = get_today_str()
 
     conn = get_db_conn()
     try:
         conn.execute("BEGIN IMMEDIATE")
-        customer_row = conn.execute("SELECT id FROM customers WHERE name = ?", (customer_name,)).fetchone()
-        if not customer_row:
-            conn.rollback(); return {"success": False, "error": f"查無客戶 {customer_name}"}
-        
-        customer_id = customer_row['id']
         wallet_id, old_balance = _get_or_create_wallet(conn, customer_id, currency)
         new_balance = old_balance + amount
         
         final_note = note if note else f'{currency} 存款' 
 
         conn.execute("UPDATE wallets SET balance = ? WHERE id = ?", (new_balance, wallet_id))
-        conn.execute(
-            "INSERT INTO transactions (wallet_id, date, type, amount, balance_after, note) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (wallet_id, date_str, '存款', amount, new_balance, final_note)
-        )
+        _post_transactions(conn, [
+            (wallet_id, date_str, '存款', amount, new_balance, final_note, None)
+        ])
         
         conn.commit()
-        return {"success": True, "name": customer_name, "new_balance": new_balance, "currency": currency}
+        return {"success": True, "new_balance": money.from_minor(new_balance, currency), "currency": currency}
     except sqlite3.Error as e: conn.rollback(); return {"success": False, "error": f"資料庫錯誤: {e}"}
     finally: conn.close()
 
-def withdraw_money(customer_name, amount, date_str, currency='TWD', note=None):
-    # (邏輯不變)
+def withdraw_money(customer_id, amount, date_str, currency='TWD', note=None):
+    # amount 為主幣金額，寫入資料庫前轉為最小單位
+    amount = money.to_minor(amount, currency)
     if amount <= 0: return {"success": False, "error": "金額必須 > 0"}
     if not date_str: date_str = get_today_str()
 
     conn = get_db_conn()
     try:
         conn.execute("BEGIN IMMEDIATE")
-        customer_row = conn.execute("SELECT id FROM customers WHERE name = ?", (customer_name,)).fetchone()
-        if not customer_row:
-            conn.rollback(); return {"success": False, "error": f"查無客戶 {customer_name}"}
-        
-        customer_id = customer_row['id']
         wallet_row = conn.execute("SELECT id, balance FROM wallets WHERE customer_id = ? AND currency = ?", (customer_id, currency)).fetchone()
         
         if not wallet_row:
@@ -259,20 +608,23 @@ def withdraw_money(customer_name, amount, date_str, currency='TWD', note=None):
         final_note = note if note else f'{currency} 提款' 
 
         conn.execute("UPDATE wallets SET balance = ? WHERE id = ?", (new_balance, wallet_id))
-        conn.execute(
-            "INSERT INTO transactions (wallet_id, date, type, amount, balance_after, note) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (wallet_id, date_str, '提款', -amount, new_balance, final_note)
-        )
+        _post_transactions(conn, [
+            (wallet_id, date_str, '提款', -amount, new_balance, final_note, None)
+        ])
         
         conn.commit()
-        return {"success": True, "name": customer_name, "new_balance": new_balance, "currency": currency}
+        _wake_categorizer()
+        return {"success": True, "new_balance": money.from_minor(new_balance, currency), "currency": currency}
     except sqlite3.Error as e: conn.rollback(); return {"success": False, "error": f"資料庫錯誤: {e}"}
     finally: conn.close()
 
-def transfer_money(from_customer_name, to_customer_name, amount, date_str, currency='TWD', note=None):
-    """ (*** (新) 修正備註邏輯 ***) """
+def transfer_money(from_customer_id, to_customer_name, amount, date_str, currency='TWD', note=None):
+    """ (*** (新) 修正備註邏輯 ***) 轉出方以 id 指定，轉入方以姓名指定 """
+    from_customer = get_customer_profile(from_customer_id)
+    if not from_customer: return {"success": False, "error": "查無轉出帳號"}
+    from_customer_name = from_customer['name']
     if from_customer_name == to_customer_name: return {"success": False, "error": "不能轉帳給自己"}
+    amount = money.to_minor(amount, currency)
     if amount <= 0: return {"success": False, "error": "金額必須 > 0"}
     if not date_str: date_str = get_today_str()
 
@@ -280,8 +632,7 @@ def transfer_money(from_customer_name, to_customer_name, amount, date_str, curre
     try:
         conn.execute("BEGIN IMMEDIATE")
         
-        from_customer = conn.execute("SELECT id, email FROM customers WHERE name = ?", (from_customer_name,)).fetchone()
-        from_wallet = conn.execute("SELECT id, balance FROM wallets WHERE customer_id = ? AND currency = ?", (from_customer['id'], currency)).fetchone()
+        from_wallet = conn.execute("SELECT id, balance FROM wallets WHERE customer_id = ? AND currency = ?", (from_customer_id, currency)).fetchone()
         if not from_wallet: conn.rollback(); return {"success": False, "error": f"轉出方沒有 {currency} 錢包"}
         if from_wallet['balance'] < amount: conn.rollback(); return {"success": False, "error": "餘額不足"}
             
@@ -302,63 +653,48 @@ def transfer_money(from_customer_name, to_customer_name, amount, date_str, curre
         # (*** 修正結束 ***)
 
         conn.execute("UPDATE wallets SET balance = ? WHERE id = ?", (from_new_balance, from_wallet_id))
-        conn.execute(
-            "INSERT INTO transactions (wallet_id, date, type, amount, balance_after, note) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (from_wallet_id, date_str, '轉出', -amount, from_new_balance, from_note)
-        )
-
         conn.execute("UPDATE wallets SET balance = ? WHERE id = ?", (to_new_balance, to_wallet_id))
-        conn.execute(
-            "INSERT INTO transactions (wallet_id, date, type, amount, balance_after, note) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (to_wallet_id, date_str, '轉入', amount, to_new_balance, to_note)
-        )
+        _post_transactions(conn, [
+            (from_wallet_id, date_str, '轉出', -amount, from_new_balance, from_note, None),
+            (to_wallet_id, date_str, '轉入', amount, to_new_balance, to_note, None)
+        ])
 
-        conn.commit()
-        
         if from_customer['email']:
-            email_service.send_transfer_notification(
-                from_customer['email'], from_customer_name, amount, currency, to_customer_name
+            email_service.queue_transfer_notification(
+                conn, from_customer['email'], from_customer_name, money.from_minor(amount, currency), currency, to_customer_name
             )
 
-        return {"success": True, "new_balance": from_new_balance, "currency": currency}
+        conn.commit()
+        email_service.wake_outbox_worker()
+        _wake_categorizer()
+
+        return {"success": True, "new_balance": money.from_minor(from_new_balance, currency), "currency": currency}
     except sqlite3.Error as e: conn.rollback(); return {"success": False, "error": f"資料庫錯誤: {e}"}
     finally: conn.close()
 
-def exchange_currency(customer_name, from_currency, to_currency, from_amount, date_str):
-    # (邏輯不變)
+def exchange_currency(customer_id, from_currency, to_currency, from_amount, date_str, quote_id=None):
+    """ quote_id: /api/quote 鎖定的報價，有提供時直接以報價的匯率成交 """
     if from_currency == to_currency: return {"success": False, "error": "幣別相同，無需換匯"}
+    from_amount = money.to_minor(from_amount, from_currency)
     if from_amount <= 0: return {"success": False, "error": "金額必須 > 0"}
     if not date_str: date_str = get_today_str()
 
-    rate = None
-    manual_rates = get_manual_rates()
-    rate_key_direct = f"{from_currency}_{to_currency}"
-    rate_key_reverse = f"{to_currency}_{from_currency}"
-
-    if rate_key_direct in manual_rates:
-        rate = manual_rates[rate_key_direct]
-        print(f"[匯率] 使用手動匯率: {rate_key_direct}")
-    elif rate_key_reverse in manual_rates and manual_rates[rate_key_reverse] > 0:
-        rate = 1 / manual_rates[rate_key_reverse]
-        print(f"[匯率] 使用反轉手動匯率: {rate_key_reverse}")
-
-    if rate is None:
-        print("[匯率] 使用 API 匯率")
-        rates = exchange_rate.get_rates(from_currency)
-        if not rates: return {"success": False, "error": "無法取得即時匯率"}
-        rate = rates.get(to_currency)
-        if not rate: return {"success": False, "error": f"無法取得 {from_currency} 到 {to_currency} 的匯率"}
-    
-    to_amount = from_amount * rate
+    if not quote_id:
+        rate_result = rate_resolver.resolve(from_currency, to_currency)
+        if not rate_result["success"]: return rate_result
     
     conn = get_db_conn()
     try:
         conn.execute("BEGIN IMMEDIATE")
-        
-        customer = conn.execute("SELECT id, email FROM customers WHERE name = ?", (customer_name,)).fetchone()
-        customer_id = customer['id']
+        if quote_id:
+            # 報價在同一個交易中標記為已使用 (後續檢查失敗 rollback 時報價不會被消耗)
+            rate_result = rate_resolver.consume_quote(conn, quote_id, customer_id, from_currency, to_currency, from_amount)
+            if not rate_result["success"]: conn.rollback(); return rate_result
+        rate = rate_result["rate"]
+        to_amount = money.convert_minor(from_amount, from_currency, to_currency, rate)
+
+        customer = get_customer_profile(customer_id)
+        if not customer: conn.rollback(); return {"success": False, "error": "查無此人"}
         
         from_wallet = conn.execute("SELECT id, balance FROM wallets WHERE customer_id = ? AND currency = ?", (customer_id, from_currency)).fetchone()
         if not from_wallet: conn.rollback(); return {"success": False, "error": f"您沒有 {from_currency} 錢包"}
@@ -370,139 +706,607 @@ def exchange_currency(customer_name, from_currency, to_currency, from_amount, da
         to_new_balance = to_old_balance + to_amount
         
         conn.execute("UPDATE wallets SET balance = ? WHERE id = ?", (from_new_balance, from_wallet_id))
-        conn.execute(
-            "INSERT INTO transactions (wallet_id, date, type, amount, balance_after, note, exchange_rate) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (from_wallet_id, date_str, '換匯轉出', -from_amount, from_new_balance, f'換成 {to_currency}', rate)
-        )
-        
         conn.execute("UPDATE wallets SET balance = ? WHERE id = ?", (to_new_balance, to_wallet_id))
-        conn.execute(
-            "INSERT INTO transactions (wallet_id, date, type, amount, balance_after, note, exchange_rate) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        _post_transactions(conn, [
+            (from_wallet_id, date_str, '換匯轉出', -from_amount, from_new_balance, f'換成 {to_currency}', rate),
             (to_wallet_id, date_str, '換匯轉入', to_amount, to_new_balance, f'來自 {from_currency}', rate)
-        )
-        
-        conn.commit()
+        ])
         
+        from_amount_major = money.from_minor(from_amount, from_currency)
+        to_amount_major = money.from_minor(to_amount, to_currency)
         if customer['email']:
-            email_service.send_exchange_notification(
-                customer['email'], from_amount, from_currency, to_amount, to_currency
+            email_service.queue_exchange_notification(
+                conn, customer['email'], from_amount_major, from_currency, to_amount_major, to_currency
             )
+        
+        conn.commit()
+        email_service.wake_outbox_worker()
             
         return {
             "success": True, 
-            "message": f"成功將 {from_amount} {from_currency} 兌換為 {to_amount:.2f} {to_currency}",
-            "from_wallet_balance": from_new_balance,
-            "to_wallet_balance": to_new_balance
+            "message": f"成功將 {from_amount_major} {from_currency} 兌換為 {to_amount_major:.2f} {to_currency}",
+            "from_wallet_balance": money.from_minor(from_new_balance, from_currency),
+            "to_wallet_balance": money.from_minor(to_new_balance, to_currency)
         }
     except sqlite3.Error as e: conn.rollback(); return {"success": False, "error": f"資料庫錯誤: {e}"}
     finally: conn.close()
 
 
-def get_my_transactions(customer_name, month=None):
-    # (*** (新) 依使用者名稱查詢，而非 ID ***)
+# --- Batch Posting ---
+
+BATCH_OPS = ('deposit', 'withdraw', 'transfer')
+MAX_BATCH_SIZE = 10000
+_SQL_IN_CHUNK = 500 # 單一 IN (...) 的參數上限，避免超過 SQLite 的變數數量限制
+
+def _chunks(items, size=_SQL_IN_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def post_batch(operations):
+    """
+    在單一寫入交易中批次過帳多筆存款 / 提款 / 轉帳。
+    operations: [{"op": "deposit"|"withdraw"|"transfer", "name": 帳戶 (轉帳時為轉出方),
+                  "to_name": 轉入方 (僅轉帳), "amount": 主幣金額, "currency": 'TWD',
+                  "date": 'YYYY-MM-DD', "note": 備註}, ...]
+    每筆各自驗證，失敗的項目不影響其他項目；回傳逐筆結果。
+    轉帳通知信與交易一起寫入 outbox，由背景執行緒寄出。
+    """
+    results = [None] * len(operations)
+    pending = [] # (index, op, currency, amount_minor, date_str)
+    names = set()
+
+    # 1. 先做不需要資料庫的驗證
+    for i, op in enumerate(operations):
+        kind = op.get('op')
+        currency = op.get('currency') or 'TWD'
+        if kind not in BATCH_OPS:
+            results[i] = {"index": i, "success": False, "error": f"不支援的操作 {kind}"}
+            continue
+        if not op.get('name'):
+            results[i] = {"index": i, "success": False, "error": "缺少帳戶名稱"}
+            continue
+        if kind == 'transfer':
+            if not op.get('to_name'):
+                results[i] = {"index": i, "success": False, "error": "缺少轉入帳號"}
+                continue
+            if op['to_name'] == op['name']:
+                results[i] = {"index": i, "success": False, "error": "不能轉帳給自己"}
+                continue
+            names.add(op['to_name'])
+        amount = money.to_minor(op.get('amount') or 0, currency)
+        if amount <= 0:
+            results[i] = {"index": i, "success": False, "error": "金額必須 > 0"}
+            continue
+        names.add(op['name'])
+        pending.append((i, op, currency, amount, op.get('date') or get_today_str()))
+
     conn = get_db_conn()
-    base_sql = (
+    try:
+        # 2. 一次解析所有客戶 id
+        customer_ids = {}
+        emails = {}
+        for chunk in _chunks(names):
+            rows = conn.execute(
+                f"SELECT id, name, email FROM customers WHERE name IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            customer_ids.update({row['name']: row['id'] for row in rows})
+            emails.update({row['name']: row['email'] for row in rows if row['email']})
+
+        conn.execute("BEGIN IMMEDIATE")
+
+        # 3. 一次載入相關錢包: (customer_id, currency) -> [wallet_id, balance]
+        wallets = {}
+        for chunk in _chunks(set(customer_ids.values())):
+            rows = conn.execute(
+                f"SELECT id, customer_id, currency, balance FROM wallets WHERE customer_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            for row in rows:
+                wallets[(row['customer_id'], row['currency'])] = [row['id'], row['balance']]
+
+        def wallet_for(customer_id, currency, create):
+            key = (customer_id, currency)
+            if key not in wallets and create:
+                wallet_id, balance = _get_or_create_wallet(conn, customer_id, currency)
+                wallets[key] = [wallet_id, balance]
+            return wallets.get(key)
+
+        tx_rows = []
+        touched = set()
+
+        # 4. 依序在記憶體中套用，餘額檢查以目前批次內的最新餘額為準
+        for i, op, currency, amount, date_str in pending:
+            kind, name, note = op['op'], op['name'], op.get('note') or None
+            customer_id = customer_ids.get(name)
+            if customer_id is None:
+                results[i] = {"index": i, "success": False, "error": f"查無客戶 {name}"}
+                continue
+
+            if kind == 'deposit':
+                wallet = wallet_for(customer_id, currency, create=True)
+                wallet[1] += amount
+                tx_rows.append((wallet[0], date_str, '存款', amount, wallet[1], note or f'{currency} 存款', None))
+                touched.add((customer_id, currency))
+
+            elif kind == 'withdraw':
+                wallet = wallet_for(customer_id, currency, create=False)
+                if not wallet:
+                    results[i] = {"index": i, "success": False, "error": f"{name} 沒有 {currency} 錢包"}
+                    continue
+                if wallet[1] < amount:
+                    results[i] = {"index": i, "success": False, "error": f"{name} {currency} 餘額不足"}
+                    continue
+                wallet[1] -= amount
+                tx_rows.append((wallet[0], date_str, '提款', -amount, wallet[1], note or f'{currency} 提款', None))
+                touched.add((customer_id, currency))
+
+            else: # transfer
+                to_name = op['to_name']
+                to_customer_id = customer_ids.get(to_name)
+                if to_customer_id is None:
+                    results[i] = {"index": i, "success": False, "error": f"查無轉入帳號 {to_name}"}
+                    continue
+                from_wallet = wallet_for(customer_id, currency, create=False)
+                if not from_wallet:
+                    results[i] = {"index": i, "success": False, "error": f"轉出方沒有 {currency} 錢包"}
+                    continue
+                if from_wallet[1] < amount:
+                    results[i] = {"index": i, "success": False, "error": "餘額不足"}
+                    continue
+                to_wallet = wallet_for(to_customer_id, currency, create=True)
+                from_wallet[1] -= amount
+                to_wallet[1] += amount
+                if note:
+                    from_note, to_note = f"{note} (轉給: {to_name})", f"{note} (來自: {name})"
+                else:
+                    from_note, to_note = f'{currency} 轉給 {to_name}', f'{currency} 來自 {name}'
+                tx_rows.append((from_wallet[0], date_str, '轉出', -amount, from_wallet[1], from_note, None))
+                tx_rows.append((to_wallet[0], date_str, '轉入', amount, to_wallet[1], to_note, None))
+                touched.add((customer_id, currency))
+                touched.add((to_customer_id, currency))
+                if name in emails:
+                    email_service.queue_transfer_notification(
+                        conn, emails[name], name, money.from_minor(amount, currency), currency, to_name
+                    )
+
+            results[i] = {
+                "index": i, "success": True, "currency": currency,
+                "new_balance": money.from_minor(wallet_for(customer_id, currency, create=False)[1], currency)
+            }
+
+        # 5. 批次寫入
+        conn.executemany(
+            "UPDATE wallets SET balance = ? WHERE id = ?",
+            [(wallets[key][1], wallets[key][0]) for key in touched]
+        )
+        _post_transactions(conn, tx_rows)
+        conn.commit()
+        email_service.wake_outbox_worker()
+        _wake_categorizer()
+
+        posted = sum(1 for r in results if r["success"])
+        return {"success": True, "posted": posted, "failed": len(results) - posted, "results": results}
+    except sqlite3.Error as e: conn.rollback(); return {"success": False, "error": f"資料庫錯誤: {e}"}
+    finally: conn.close()
+
+
+# --- Transaction History (keyset 分頁) ---
+# 以 (date, id) 作為游標，由新到舊分頁: 每個錢包各自沿著 (wallet_id, date, id) 索引往回讀取最多 limit 筆，
+# 再合併排序取前 limit 筆；不論歷史多長，每頁都只讀取 O(錢包數 x limit) 列。
+
+TRANSACTION_PAGE_SIZE = 50
+MAX_TRANSACTION_PAGE_SIZE = 200
+
+def _encode_cursor(row):
+    return f"{row['date']}|{row['id']}"
+
+def _decode_cursor(cursor):
+    """ 'YYYY-MM-DD|id' -> (date, id)，格式錯誤時回傳 None """
+    try:
+        date_str, tx_id = cursor.rsplit("|", 1)
+        return date_str, int(tx_id)
+    except (AttributeError, ValueError):
+        return None
+
+def get_transactions_page(customer_id, month=None, start_date=None, end_date=None, cursor=None,
+                          limit=TRANSACTION_PAGE_SIZE):
+    """
+    分頁取得交易紀錄 (由新到舊)。
+    cursor: 上一頁回傳的 next_cursor (None 表示第一頁)
+    回傳 {"success": True, "transactions": [...], "next_cursor": 下一頁游標或 None}
+    """
+    try:
+        limit = max(1, min(int(limit), MAX_TRANSACTION_PAGE_SIZE))
+    except (TypeError, ValueError):
+        limit = TRANSACTION_PAGE_SIZE
+    position = None
+    if cursor:
+        position = _decode_cursor(cursor)
+        if position is None:
+            return {"success": False, "error": "無效的分頁游標"}
+
+    date_sql, date_params = _date_filter("date", month, start_date, end_date)
+    page_sql = (
+        "SELECT id, date, type, amount, balance_after, note, exchange_rate FROM transactions "
+        "WHERE wallet_id = ? " + date_sql
+    )
+    if position:
+        page_sql += "AND (date, id) < (?, ?) "
+    page_sql += "ORDER BY date DESC, id DESC LIMIT ?"
+
+    conn = get_db_conn()
+    try:
+        wallets = conn.execute("SELECT id, currency FROM wallets WHERE customer_id = ?", (customer_id,)).fetchall()
+        rows = []
+        for wallet in wallets:
+            params = [wallet['id'], *date_params]
+            if position:
+                params += list(position)
+            params.append(limit + 1)
+            for row in conn.execute(page_sql, params).fetchall():
+                tx = dict(row)
+                tx['currency'] = wallet['currency']
+                rows.append(tx)
+    finally:
+        conn.close()
+
+    rows.sort(key=lambda tx: (tx['date'], tx['id']), reverse=True)
+    page = rows[:limit]
+    next_cursor = _encode_cursor(page[-1]) if len(rows) > limit else None
+    return {"success": True, "transactions": [_transaction_to_dict(tx) for tx in page], "next_cursor": next_cursor}
+
+def _transaction_to_dict(row):
+    """ 交易列 -> API 格式 (金額由最小單位轉回主幣) """
+    tx = dict(row)
+    tx['amount'] = money.from_minor(tx['amount'], tx['currency'])
+    tx['balance_after'] = money.from_minor(tx['balance_after'], tx['currency'])
+    return tx
+
+# --- Transaction Search (FTS5) ---
+
+SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 200
+FTS_MIN_TERM_LENGTH = 3 # trigram 分詞的最短查詢長度
+
+def search_transactions(customer_id, query, month=None, start_date=None, end_date=None, currency=None,
+                        limit=SEARCH_LIMIT):
+    """
+    搜尋交易備註 (空白分隔的多個關鍵字需同時符合)。
+    3 個字以上的關鍵字使用 transactions_fts 全文索引並依 bm25 排序；較短的關鍵字以 LIKE 比對。
+    回傳 {"success": True, "transactions": [...], "mode": "fts" / "like"}
+    """
+    terms = (query or "").split()
+    if not terms:
+        return {"success": False, "error": "請輸入搜尋關鍵字"}
+    try:
+        limit = max(1, min(int(limit), MAX_SEARCH_LIMIT))
+    except (TypeError, ValueError):
+        limit = SEARCH_LIMIT
+
+    fts_terms = [term for term in terms if len(term) >= FTS_MIN_TERM_LENGTH]
+    like_terms = [term for term in terms if len(term) < FTS_MIN_TERM_LENGTH]
+
+    select_sql = "SELECT t.id, t.date, t.type, w.currency, t.amount, t.balance_after, t.note, t.exchange_rate "
+    if fts_terms:
+        sql = (
+            select_sql + "FROM transactions_fts f "
+            "JOIN transactions t ON t.id = f.rowid "
+            "JOIN wallets w ON t.wallet_id = w.id "
+            "WHERE transactions_fts MATCH ? AND w.customer_id = ? "
+        )
+        # 每個關鍵字都當作片語 (雙引號跳脫)，避免被解讀為 FTS 查詢語法
+        params = [" AND ".join('"' + term.replace('"', '""') + '"' for term in fts_terms)]
+    else:
+        sql = select_sql + "FROM transactions t JOIN wallets w ON t.wallet_id = w.id WHERE w.customer_id = ? "
+        params = []
+
+    conn = get_db_conn()
+    try:
+        params.append(customer_id)
+
+        for term in like_terms:
+            sql += "AND t.note LIKE ? ESCAPE '\\' "
+            params.append("%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if currency:
+            sql += "AND w.currency = ? "
+            params.append(currency)
+        date_sql, date_params = _date_filter("t.date", month, start_date, end_date)
+        sql += date_sql
+        params += date_params
+
+        sql += ("ORDER BY bm25(transactions_fts), t.date DESC, t.id DESC " if fts_terms
+                else "ORDER BY t.date DESC, t.id DESC ")
+        sql += "LIMIT ?"
+        params.append(limit)
+
+        rows = conn.execute(sql, params).fetchall()
+        return {
+            "success": True,
+            "transactions": [_transaction_to_dict(row) for row in rows],
+            "mode": "fts" if fts_terms else "like"
+        }
+    except sqlite3.Error as e:
+        return {"success": False, "error": f"資料庫錯誤: {e}"}
+    finally:
+        conn.close()
+
+CSV_FIELDNAMES = ['date', 'type', 'currency', 'amount', 'balance_after', 'note', 'exchange_rate']
+CSV_CHUNK_SIZE = 1000 # 每次從資料庫讀取 / 輸出的列數
+
+def stream_transactions_csv(customer_id, month=None, start_date=None, end_date=None, currency=None,
+                            chunk_size=CSV_CHUNK_SIZE):
+    """
+    以串流方式匯出交易紀錄 CSV (由新到舊)，記憶體用量與紀錄筆數無關。
+    回傳產生 UTF-8 (含 BOM，Excel 可正確開啟) bytes 區塊的 generator；沒有符合的交易時回傳 None。
+    """
+    sql = (
         "SELECT t.date, t.type, w.currency, t.amount, t.balance_after, t.note, t.exchange_rate "
         "FROM transactions t "
         "JOIN wallets w ON t.wallet_id = w.id "
-        "JOIN customers c ON w.customer_id = c.id "
-        "WHERE c.name = ? "
+        "WHERE w.customer_id = ? "
     )
-    params = (customer_name,)
-    
-    if month:
-        base_sql += "AND strftime('%Y-%m', t.date) = ? "
-        params += (month,)
-    
-    base_sql += "ORDER BY t.date DESC, t.id DESC"
-    
-    rows = conn.execute(base_sql, params).fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    params = [customer_id]
+    if currency:
+        sql += "AND w.currency = ? "
+        params.append(currency)
+    date_sql, date_params = _date_filter("t.date", month, start_date, end_date)
+    sql += date_sql + "ORDER BY t.date DESC, t.id DESC"
+    params += date_params
 
-def get_my_transactions_as_csv(customer_name):
-    # (邏輯不變)
-    transactions = get_my_transactions(customer_name)
-    if not transactions: return None
-    
-    output = io.StringIO()
-    fieldnames = ['date', 'type', 'currency', 'amount', 'balance_after', 'note', 'exchange_rate']
-    writer = csv.DictWriter(output, fieldnames=fieldnames, extrasaction='ignore') 
-    
-    writer.writeheader()
-    writer.writerows(transactions)
-    return output.getvalue()
+    conn = get_db_conn()
+    try:
+        cursor = conn.execute(sql, params)
+        first_chunk = cursor.fetchmany(chunk_size)
+    except sqlite3.Error:
+        conn.close()
+        raise
+    if not first_chunk:
+        conn.close()
+        return None
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDNAMES, extrasaction='ignore')
+        try:
+            writer.writeheader()
+            chunk = first_chunk
+            while chunk:
+                writer.writerows(_transaction_to_dict(row) for row in chunk)
+                data = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                yield data
+                chunk = cursor.fetchmany(chunk_size)
+        finally:
+            conn.close()
+
+    def encode(chunks):
+        yield '\ufeff'.encode('utf-8')
+        for data in chunks:
+            yield data.encode('utf-8')
+
+    return encode(generate())
+
+# --- Monthly Statement ---
+
+def _balance_before(conn, wallet_id, date_str):
+    """ 錢包在 date_str 之前最後一筆交易的 balance_after (走 (wallet_id, date, id) 索引，只讀一列)；沒有交易時為 0 """
+    row = conn.execute(
+        "SELECT balance_after FROM transactions WHERE wallet_id = ? AND date < ? "
+        "ORDER BY date DESC, id DESC LIMIT 1",
+        (wallet_id, date_str)
+    ).fetchone()
+    return row['balance_after'] if row else 0
+
+def get_monthly_statement(customer_id, month, currency=None):
+    """
+    月結單: 每個錢包的期初 / 期末結餘 (月初前、下月初前最後一筆交易的 balance_after)
+    與當月存入 / 支出合計 (monthly_flow_rollups，不掃描交易表)，執行時間與歷史筆數無關。
+    balance_after 是過帳當下的餘額: 若有補登過去日期的交易，期初 / 期末以過帳順序的餘額為準，
+    可能不等於 期初 + 淨變動。
+    回傳 {"success": True, "month": 'YYYY-MM', "statements": [{"currency", "opening_balance", "credit",
+          "debit", "net_change", "closing_balance", "credit_count", "debit_count"}, ...]}
+    """
+    month_start, month_end = _month_bounds(month)
+    if month_start == month_end:
+        return {"success": False, "error": "月份格式錯誤 (YYYY-MM)"}
+
+    conn = get_db_conn()
+    try:
+        sql = "SELECT id, currency FROM wallets WHERE customer_id = ? "
+        params = [customer_id]
+        if currency:
+            sql += "AND currency = ? "
+            params.append(currency)
+        wallets = conn.execute(sql + "ORDER BY currency", params).fetchall()
+        if not wallets:
+            return {"success": True, "month": month, "statements": []}
+
+        totals = {
+            row['wallet_id']: row
+            for row in conn.execute(
+                "SELECT wallet_id, SUM(income) AS credit, SUM(spend) AS debit, "
+                "SUM(income_count) AS credit_count, SUM(spend_count) AS debit_count "
+                f"FROM monthly_flow_rollups WHERE month = ? AND wallet_id IN ({','.join('?' * len(wallets))}) "
+                "GROUP BY wallet_id",
+                (month_start[:7], *[wallet['id'] for wallet in wallets])
+            ).fetchall()
+        }
+
+        statements = []
+        for wallet in wallets:
+            curr = wallet['currency']
+            opening = _balance_before(conn, wallet['id'], month_start)
+            closing = _balance_before(conn, wallet['id'], month_end)
+            row = totals.get(wallet['id'])
+            credit = row['credit'] if row else 0
+            debit = row['debit'] if row else 0
+            statements.append({
+                "currency": curr,
+                "opening_balance": money.from_minor(opening, curr),
+                "credit": money.from_minor(credit, curr),
+                "debit": money.from_minor(debit, curr),
+                "net_change": money.from_minor(credit - debit, curr),
+                "closing_balance": money.from_minor(closing, curr),
+                "credit_count": row['credit_count'] if row else 0,
+                "debit_count": row['debit_count'] if row else 0,
+            })
+        return {"success": True, "month": month_start[:7], "statements": statements}
+    finally:
+        conn.close()
+
+# --- Net Worth Series ---
+
+NET_WORTH_INTERVALS = {"day": 1, "week": 7} # 取樣間隔 (天)
+NET_WORTH_DEFAULT_POINTS = 30 # 未指定 start_date 時的取樣點數
+MAX_NET_WORTH_POINTS = 400
+
+def get_net_worth_series(customer_id, start_date=None, end_date=None, interval='day', currency='TWD'):
+    """
+    淨值走勢: 每個取樣日結束時各錢包的餘額 (當天或之前最後一筆交易的 balance_after)，
+    以當天適用的匯率換算成 currency 後加總: 與換匯相同，管理員設定的手動匯率優先
+    (手動匯率沒有歷史，過去的日期也使用目前的手動匯率)，否則使用當天的匯率快照 (exchange_rate.get_rate_on)。
+    interval: 'day' 或 'week' (每 7 天一點)；最後一點固定為 end_date (預設今天)。
+    錢包 × 取樣日的餘額由單一查詢取得，每一格是一次 (wallet_id, date, id) 索引探查，執行時間與交易筆數無關。
+    回傳 {"success": True, "currency", "interval", "series": [{"date", "total", "balances": {幣別: 餘額}}, ...],
+          "missing_rates": [無法換算的幣別 (不計入 total)]}
+    """
+    step = NET_WORTH_INTERVALS.get(interval)
+    if step is None:
+        return {"success": False, "error": f"interval 必須是 {' / '.join(NET_WORTH_INTERVALS)}"}
+    try:
+        end = datetime.strptime(end_date or get_today_str(), DATE_FMT)
+        start = (datetime.strptime(start_date, DATE_FMT) if start_date
+                 else end - timedelta(days=step * (NET_WORTH_DEFAULT_POINTS - 1)))
+    except ValueError:
+        return {"success": False, "error": "日期格式錯誤 (YYYY-MM-DD)"}
+    if start > end:
+        return {"success": False, "error": "開始日期不可晚於結束日期"}
+    points = (end - start).days // step + 1
+    if points > MAX_NET_WORTH_POINTS:
+        return {"success": False, "error": f"取樣點過多 (上限 {MAX_NET_WORTH_POINTS})，請縮小區間或改用 week"}
+    first_day = (end - timedelta(days=step * (points - 1))).strftime(DATE_FMT)
+
+    conn = get_db_conn()
+    try:
+        rows = conn.execute(
+            "WITH RECURSIVE days(day) AS ("
+            "  SELECT ? UNION ALL SELECT date(day, ?) FROM days WHERE day < ?"
+            ") "
+            "SELECT days.day, w.currency, ("
+            "  SELECT t.balance_after FROM transactions t WHERE t.wallet_id = w.id AND t.date <= days.day "
+            "  ORDER BY t.date DESC, t.id DESC LIMIT 1"
+            ") AS balance "
+            "FROM wallets w CROSS JOIN days "
+            "WHERE w.customer_id = ? ORDER BY days.day, w.currency",
+            (first_day, f"+{step} days", end.strftime(DATE_FMT), customer_id)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    series = {}
+    for row in rows:
+        if row['balance']:
+            series.setdefault(row['day'], {})[row['currency']] = money.from_minor(row['balance'], row['currency'])
+        else:
+            series.setdefault(row['day'], {})
+
+    manual_rates = {}
+    for balances in series.values():
+        for curr in balances:
+            if curr != currency and curr not in manual_rates:
+                manual_rates[curr] = rate_resolver.get_manual_rate(curr, currency)
+
+    missing_rates = set()
+    points_out = []
+    for day, balances in series.items():
+        total = 0.0
+        for curr, balance in balances.items():
+            if curr == currency:
+                rate = 1.0
+            else:
+                rate = manual_rates[curr] or exchange_rate.get_rate_on(curr, currency, day)
+            if rate is None:
+                missing_rates.add(curr)
+                continue
+            total += balance * rate
+        points_out.append({"date": day, "total": total, "balances": balances})
+
+    return {
+        "success": True, "currency": currency, "interval": interval,
+        "series": points_out, "missing_rates": sorted(missing_rates)
+    }
 
 # --- Analysis (Spending, Income) ---
 
-def analyze_spending(customer_name, month=None, currency='TWD'):
-    """ (*** (新) 修正 'ALL' 邏輯 (Req 4) 並修正 AI 分類邏輯 (Req 1, 2) ***) """
+def analyze_spending(customer_id, month=None, currency='TWD', start_date=None, end_date=None):
+    """ (*** (新) 修正 'ALL' 邏輯 (Req 4) 並修正 AI 分類邏輯 (Req 1, 2) ***) 讀取寫入時已存好的分類 """
     conn = get_db_conn()
     
-    sql = (
-        "SELECT t.type, t.note FROM transactions t "
+    base_sql = (
+        "FROM transactions t "
         "JOIN wallets w ON t.wallet_id = w.id "
-        "JOIN customers c ON w.customer_id = c.id "
-        "WHERE c.name = ? AND t.amount < 0 "
+        "WHERE w.customer_id = ? AND t.amount < 0 "
     )
-    params = [customer_name]
+    params = [customer_id]
     
     # (*** (新) 修正 'ALL' 邏輯 ***)
     if currency != 'ALL':
-        sql += "AND w.currency = ? "
+        base_sql += "AND w.currency = ? "
         params.append(currency)
     
-    if month:
-        sql += "AND strftime('%Y-%m', t.date) = ? "
-        params.append(month)
+    date_sql, date_params = _date_filter("t.date", month, start_date, end_date)
+    base_sql += date_sql
+    params += date_params
     
-    rows = conn.execute(sql, tuple(params)).fetchall()
+    category_rows = conn.execute(
+        "SELECT t.category, COUNT(*) AS count " + base_sql + "AND t.category IS NOT NULL GROUP BY t.category",
+        tuple(params)
+    ).fetchall()
+    # 尚未被背景分類的交易 (剛寫入或舊資料)
+    pending_rows = conn.execute(
+        "SELECT t.type, t.amount, t.note " + base_sql + "AND t.category IS NULL", tuple(params)
+    ).fetchall()
     conn.close()
     
     analysis_unit = "TWD (總資產)" if currency == 'ALL' else currency
     
-    if not rows:
+    if not category_rows and not pending_rows:
         message = f"在 {month} 沒有可分析的 {analysis_unit} 支出紀錄" if month else f"沒有可分析的 {analysis_unit} 支出紀錄"
         return {"success": True, "summary": {}, "message": message, "suggestion": ""}
 
+    # 支出次數分析沿用的名稱 (其他支出 (無備註) 不列入)
+    spending_labels = {'提款 (無備註)': '提款', '其他支出 (無備註)': None}
     summary = {}
-    notes_for_ai = []
-
-    # (*** (新) 修正分類邏輯 (Req 1, 2) ***)
-    for row in rows:
-        ttype = row['type']
-        note = row['note']
-
-        if note and note.startswith("管理員"):
-            summary['管理員調整'] = summary.get('管理員調整', 0) + 1
-        elif ttype == '換匯轉出':
-            summary['換匯支出'] = summary.get('換匯支出', 0) + 1
-        elif note:
-            # 只要有備註 (無論是提款或轉出)，都交給 AI
-            notes_for_ai.append(note)
-        elif ttype == '轉出' and not note:
-            summary['轉帳支出'] = summary.get('轉帳支出', 0) + 1
-        elif ttype == '提款' and not note:
-            summary['提款'] = summary.get('提款', 0) + 1
-    # (*** 修正結束 ***)
+    for row in category_rows:
+        label = spending_labels.get(row['category'], row['category'])
+        if label:
+            summary[label] = summary.get(label, 0) + row['count']
 
+    notes_for_ai = []
+    for row in pending_rows:
+        source = _flow_source(row['type'], row['amount'], row['note'])
+        if source == NOTED_SPEND_SOURCE:
+            notes_for_ai.append(row['note'])
+        else:
+            label = spending_labels.get(source, source)
+            if label:
+                summary[label] = summary.get(label, 0) + 1
 
+    ai_failed = False
     if notes_for_ai:
-        categories = ["餐飲美食", "交通出行", "休閒娛樂", "網路購物", "帳單繳費", "家居生活", "其他"]
-        ai_results = ai_services.categorize_spending(notes_for_ai, categories)
+        ai_categories = ai_services.classify_notes(notes_for_ai, CATEGORIES)
+        ai_failed = any(category is None for category in ai_categories)
         
-        if not ai_results:
+        if all(category is None for category in ai_categories):
             return {"success": False, "error": "AI 分析服務暫時無法連線"}
 
-        temp_ai_summary = {category: 0 for category in categories}
-        for i, note in enumerate(notes_for_ai):
-            try:
-                ai_result_for_tx = ai_results[i]
-                top_category = ai_result_for_tx['labels'][0]
+        temp_ai_summary = {category: 0 for category in CATEGORIES}
+        for top_category in ai_categories:
+            if top_category in temp_ai_summary:
                 temp_ai_summary[top_category] += 1
-            except (IndexError, KeyError):
+            else:
                 temp_ai_summary["其他"] += 1
         
         for category, count in temp_ai_summary.items():
@@ -523,28 +1327,40 @@ def analyze_spending(customer_name, month=None, currency='TWD'):
         except Exception as e:
             suggestion = "無法產生建議。"
             
-    return {"success": True, "summary": summary_filtered, "message": f"(僅分析 {analysis_unit} 支出次數)", "suggestion": suggestion}
+    return {
+        "success": True, "summary": summary_filtered, "message": f"(僅分析 {analysis_unit} 支出次數)",
+        "suggestion": suggestion, "ai_failed": ai_failed
+    }
 
 
-def analyze_income(customer_name, month=None, currency='TWD'):
-    """ (*** (新) 修正 'ALL' 邏輯 (Req 4) ***) """
+def analyze_income(customer_id, month=None, currency='TWD', start_date=None, end_date=None):
+    """ (*** (新) 修正 'ALL' 邏輯 (Req 4) ***) 次數取自收支彙總表 """
     conn = get_db_conn()
-    sql = (
-        "SELECT t.type, t.note, t.amount FROM transactions t "
-        "JOIN wallets w ON t.wallet_id = w.id "
-        "JOIN customers c ON w.customer_id = c.id "
-        "WHERE c.name = ? AND t.amount > 0 "
-    )
-    params = [customer_name]
+    # 有指定日期區間時需要日彙總；否則月彙總即可
+    if start_date or end_date:
+        sql = (
+            "SELECT r.source, SUM(r.income_count) AS count FROM daily_flow_rollups r "
+            "JOIN wallets w ON r.wallet_id = w.id "
+            "WHERE w.customer_id = ? AND r.income_count > 0 "
+        )
+        date_sql, date_params = _date_filter("r.day", month, start_date, end_date)
+    else:
+        sql = (
+            "SELECT r.source, SUM(r.income_count) AS count FROM monthly_flow_rollups r "
+            "JOIN wallets w ON r.wallet_id = w.id "
+            "WHERE w.customer_id = ? AND r.income_count > 0 "
+        )
+        date_sql, date_params = ("AND r.month = ? ", [month]) if month else ("", [])
+    params = [customer_id]
 
     # (*** (新) 修正 'ALL' 邏輯 ***)
     if currency != 'ALL':
         sql += "AND w.currency = ? "
         params.append(currency)
 
-    if month:
-        sql += "AND strftime('%Y-%m', t.date) = ? "
-        params.append(month)
+    sql += date_sql
+    params += date_params
+    sql += "GROUP BY r.source"
     
     rows = conn.execute(sql, tuple(params)).fetchall()
     conn.close()
@@ -555,117 +1371,102 @@ def analyze_income(customer_name, month=None, currency='TWD'):
         message = f"在 {month} 沒有可分析的 {analysis_unit} 收入紀錄" if month else f"沒有可分析的 {analysis_unit} 收入紀錄"
         return {"success": True, "summary": {}, "message": message}
 
+    income_labels = {'存款': '存款收入', '開戶': '開戶金'}
     summary = {}
     for row in rows:
-        category = row['type']
-        if row['note'] and row['note'].startswith("管理員"):
-            category = '管理員調整'
-        elif category == '存款':
-            category = '存款收入'
-        elif category == '轉入':
-            category = '轉帳收入'
-        elif category == '換匯轉入':
-            category = '換匯收入'
-        elif category == '開戶':
-            category = '開戶金'
-        else:
-            category = '其他收入'
-        
-        summary[category] = summary.get(category, 0) + 1
+        category = income_labels.get(row['source'], row['source'])
+        summary[category] = summary.get(category, 0) + row['count']
 
     return {"success": True, "summary": summary, "message": f"(僅分析 {analysis_unit} 收入次數)"}
 
 # --- Analysis (Cash Flow) ---
 
-def _process_transactions_for_summary(rows, rate_to_twd=1.0, currency_prefix=""):
-    """ (*** (新) 修正 AI 分類邏輯 (Req 1, 2) ***) """
-    summary = {
-        "total_income": 0.0, "total_spend": 0.0,
-        "income_sources": {}, "spend_sources": {},
-        "daily_flow": {}
-    }
-    notes_for_ai = [] 
-    ai_spend_map = [] 
-    
-    for row in rows:
-        date = row['date']
-        ttype = row['type']
-        amount = row['amount']
-        note = row['note']
-        
-        amount_twd = amount * rate_to_twd
-        
-        if date not in summary["daily_flow"]:
-            summary["daily_flow"][date] = {"income": 0, "spend": 0}
+def _summarize_wallet_flow(conn, wallet_id, currency, summary, noted_spends, rate_on=None,
+                           month=None, start_date=None, end_date=None):
+    """
+    從每日收支彙總表累加單一錢包的收支 (讀取 O(天數) 列，而非 O(交易筆數))。
+    rate_on: 函式 (日期 -> 換算匯率)，用於以交易當天的匯率換算成 TWD；None 表示不換算。
+    有備註的支出使用寫入時存好的分類；尚未分類的依備註加總後放入 noted_spends，稍後統一交給 AI 分類。
+    """
+    rates_by_day = {}
+    def to_unit(units, day):
+        if rate_on is None:
+            return money.from_minor(units, currency)
+        if day not in rates_by_day:
+            rates_by_day[day] = rate_on(day)
+        return money.from_minor(units, currency) * rates_by_day[day]
+
+    date_sql, date_params = _date_filter("day", month, start_date, end_date)
+    rows = conn.execute(
+        "SELECT day, source, income, spend FROM daily_flow_rollups WHERE wallet_id = ? " + date_sql,
+        (wallet_id, *date_params)
+    ).fetchall()
 
-        if amount > 0:
-            amount_abs_twd = abs(amount_twd)
-            summary["total_income"] += amount_abs_twd
-            summary["daily_flow"][date]["income"] += amount_abs_twd
-            
-            if note and note.startswith("管理員"):
-                source_name = '管理員調整'
-            elif ttype in ['存款', '開戶']:
-                source_name = ttype
-            elif ttype == '轉入':
-                source_name = '轉帳收入'
-            elif ttype == '換匯轉入':
-                source_name = '換匯收入'
-            else:
-                source_name = '其他收入'
-            summary["income_sources"][source_name] = summary["income_sources"].get(source_name, 0) + amount_abs_twd
-        
-        elif amount < 0:
-            amount_abs_twd = abs(amount_twd)
-            summary["total_spend"] += amount_abs_twd
-            summary["daily_flow"][date]["spend"] += amount_abs_twd
-
-            # (*** (新) 修正分類邏輯 (Req 1, 2) ***)
-            source_name = None
-            if note and note.startswith("管理員"):
-                source_name = '管理員調整'
-            elif ttype == '換匯轉出':
-                source_name = '換匯支出'
-            elif note:
-                # 只要有備註 (無論是提款或轉出)，都交給 AI
-                notes_for_ai.append(note)
-                ai_spend_map.append({"note": note, "amount": amount_abs_twd})
-            elif ttype == '轉出' and not note:
-                source_name = '轉帳支出'
-            elif ttype == '提款' and not note:
-                source_name = '提款 (無備註)'
+    has_noted_spend = False
+    for row in rows:
+        day, source = row['day'], row['source']
+        income = to_unit(row['income'], day)
+        spend = to_unit(row['spend'], day)
+
+        daily = summary["daily_flow"].setdefault(day, {"income": 0, "spend": 0})
+        if income:
+            summary["total_income"] += income
+            daily["income"] += income
+            summary["income_sources"][source] = summary["income_sources"].get(source, 0) + income
+        if spend:
+            summary["total_spend"] += spend
+            daily["spend"] += spend
+            if source == NOTED_SPEND_SOURCE:
+                has_noted_spend = True
             else:
-                source_name = '其他支出 (無備註)'
-            # (*** 修正結束 ***)
-            
-            if source_name:
-                summary["spend_sources"][source_name] = summary["spend_sources"].get(source_name, 0) + amount_abs_twd
-
-    # 4. 呼叫 AI 服務
-    if notes_for_ai:
-        categories = ["餐飲美食", "交通出行", "休閒娛樂", "網路購物", "帳單繳費", "家居生活", "其他"]
-        ai_results = ai_services.categorize_spending(notes_for_ai, categories)
-        
-        if ai_results:
-            for i, spend_item in enumerate(ai_spend_map):
-                try:
-                    top_category = ai_results[i]['labels'][0]
-                    summary["spend_sources"][top_category] = summary["spend_sources"].get(top_category, 0) + spend_item['amount']
-                except (IndexError, KeyError):
-                    summary["spend_sources"]["其他"] = summary["spend_sources"].get("其他", 0) + spend_item['amount']
-        else:
-            for spend_item in ai_spend_map:
-                 summary["spend_sources"]["其他 (AI分析失敗)"] = summary["spend_sources"].get("其他 (AI分析失敗)", 0) + spend_item['amount']
+                summary["spend_sources"][source] = summary["spend_sources"].get(source, 0) + spend
 
-    return summary
+    if has_noted_spend:
+        # 與 _flow_source 的 NOTED_SPEND_SOURCE 條件相同 (依日期分組，才能套用當天的匯率)
+        noted_sql = (
+            "FROM transactions WHERE wallet_id = ? AND amount < 0 AND note IS NOT NULL AND note != '' "
+            "AND note NOT LIKE '管理員%' AND type != '換匯轉出' "
+        )
+        date_sql, date_params = _date_filter("date", month, start_date, end_date)
+        noted_sql += date_sql
+        # 已在寫入時分類的支出直接依分類加總
+        category_rows = conn.execute(
+            "SELECT date, category, -SUM(amount) AS total " + noted_sql +
+            "AND category IS NOT NULL GROUP BY category, date",
+            (wallet_id, *date_params)
+        ).fetchall()
+        for row in category_rows:
+            amount = to_unit(row['total'], row['date'])
+            summary["spend_sources"][row['category']] = summary["spend_sources"].get(row['category'], 0) + amount
+        # 尚未分類的依備註加總，稍後交給 AI
+        pending_rows = conn.execute(
+            "SELECT date, note, -SUM(amount) AS total " + noted_sql + "AND category IS NULL GROUP BY note, date",
+            (wallet_id, *date_params)
+        ).fetchall()
+        for row in pending_rows:
+            amount = to_unit(row['total'], row['date'])
+            noted_spends[row['note']] = noted_spends.get(row['note'], 0) + amount
+
+def _categorize_noted_spends(summary, noted_spends):
+    """ 將有備註的支出交給 AI 分類，並依分類累加到 spend_sources；有任何一筆 AI 無法分類時回傳 True """
+    if not noted_spends:
+        return False
+    notes_for_ai = list(noted_spends)
+    ai_categories = ai_services.classify_notes(notes_for_ai, CATEGORIES)
+    
+    ai_failed = False
+    for note, top_category in zip(notes_for_ai, ai_categories):
+        if top_category is None:
+            top_category = "其他 (AI分析失敗)"
+            ai_failed = True
+        summary["spend_sources"][top_category] = summary["spend_sources"].get(top_category, 0) + noted_spends[note]
+    return ai_failed
 
 
-def analyze_cash_flow(customer_name, month=None, currency='TWD'):
+def analyze_cash_flow(customer_id, month=None, currency='TWD', start_date=None, end_date=None):
     # (邏輯不變)
     conn = get_db_conn()
     try:
-        customer_id = conn.execute("SELECT id FROM customers WHERE name = ?", (customer_name,)).fetchone()['id']
-        
         final_summary = {
             "total_income": 0.0, "total_spend": 0.0,
             "income_sources": {}, "spend_sources": {},
@@ -691,41 +1492,22 @@ def analyze_cash_flow(customer_name, month=None, currency='TWD'):
             if not twd_rates:
                 return {"success": False, "error": "無法取得 'ALL' 分析所需的 TWD 匯率"}
 
+        noted_spends = {} # 備註 -> 金額 (TWD 或單一幣別)
         for wallet in wallets_to_analyze:
             wallet_id = wallet['id']
             curr = wallet['currency']
             
-            rate_to_twd = 1.0
+            rate_on = None
             if currency == 'ALL' and curr != 'TWD':
                 if curr not in twd_rates or twd_rates[curr] <= 0:
                     continue 
-                rate_to_twd = 1.0 / twd_rates[curr]
-            
-            sql = "SELECT date, type, amount, note FROM transactions WHERE wallet_id = ? "
-            params = (wallet_id,)
-            if month:
-                sql += "AND strftime('%Y-%m', date) = ? "
-                params += (month,)
-            sql += "ORDER BY date ASC"
-            
-            rows = conn.execute(sql, params).fetchall()
-            if not rows:
-                continue
-            
-            summary_part = _process_transactions_for_summary(rows, rate_to_twd, currency_prefix=f"({curr}) ")
+                # 以交易當天的匯率換算 (rate_snapshots)，沒有歷史匯率時使用目前匯率
+                rate_on = lambda day, curr=curr: exchange_rate.get_rate_on(curr, 'TWD', day) or 1.0 / twd_rates[curr]
             
-            final_summary["total_income"] += summary_part["total_income"]
-            final_summary["total_spend"] += summary_part["total_spend"]
-            
-            for k, v in summary_part["income_sources"].items():
-                final_summary["income_sources"][k] = final_summary["income_sources"].get(k, 0) + v
-            for k, v in summary_part["spend_sources"].items():
-                final_summary["spend_sources"][k] = final_summary["spend_sources"].get(k, 0) + v
-            for k, v in summary_part["daily_flow"].items():
-                if k not in final_summary["daily_flow"]:
-                    final_summary["daily_flow"][k] = {"income": 0, "spend": 0}
-                final_summary["daily_flow"][k]["income"] += v["income"]
-                final_summary["daily_flow"][k]["spend"] += v["spend"]
+            _summarize_wallet_flow(conn, wallet_id, curr, final_summary, noted_spends, rate_on,
+                                   month, start_date, end_date)
+
+        ai_failed = _categorize_noted_spends(final_summary, noted_spends)
 
         if not final_summary["daily_flow"]:
              return {"success": True, "summary": {}, "suggestion": f"沒有 {currency} 交易紀錄"}
@@ -763,7 +1545,8 @@ def analyze_cash_flow(customer_name, month=None, currency='TWD'):
         except Exception as e:
             suggestion = "無法產生建議。"
 
-        return {"success": True, "summary": final_summary, "suggestion": suggestion}
+        # ai_failed: 部分支出 AI 無法分類 (暫時的結果，app.conditional_get 不會快取)
+        return {"success": True, "summary": final_summary, "suggestion": suggestion, "ai_failed": ai_failed}
         
     except Exception as e:
         print(f"analyze_cash_flow 錯誤: {e}")
@@ -775,11 +1558,9 @@ def analyze_cash_flow(customer_name, month=None, currency='TWD'):
 
 CATEGORIES = ["餐飲美食", "交通出行", "休閒娛樂", "網路購物", "帳單繳費", "家居生活", "其他"]
 
-def get_budgets(customer_name, month, currency):
+def get_budgets(customer_id, month, currency):
     # (邏輯不變)
     conn = get_db_conn()
-    customer_id = conn.execute("SELECT id FROM customers WHERE name = ?", (customer_name,)).fetchone()['id']
-    
     rows = conn.execute(
         "SELECT category, amount FROM budgets WHERE customer_id = ? AND month = ? AND currency = ?",
         (customer_id, month, currency)
@@ -792,16 +1573,16 @@ def get_budgets(customer_name, month, currency):
     conn.close()
     return {"success": True, "budgets": budgets, "categories": CATEGORIES}
 
-def set_budget(customer_name, month, currency, category, amount):
+def set_budget(customer_id, month, currency, category, amount):
     # (邏輯不變)
     conn = get_db_conn()
     try:
-        customer_id = conn.execute("SELECT id FROM customers WHERE name = ?", (customer_name,)).fetchone()['id']
         conn.execute(
             "INSERT OR REPLACE INTO budgets (customer_id, month, currency, category, amount) "
             "VALUES (?, ?, ?, ?, ?)",
             (customer_id, month, currency, category, amount)
         )
+        _bump_data_version(conn, [customer_id])
         conn.commit()
         return {"success": True}
     except sqlite3.Error as e:
@@ -810,10 +1591,10 @@ def set_budget(customer_name, month, currency, category, amount):
     finally:
         conn.close()
 
-def get_spending_vs_budget(customer_name, month, currency):
+def get_spending_vs_budget(customer_id, month, currency):
     # (邏輯不變)
-    budget_data = get_budgets(customer_name, month, currency)['budgets']
-    spend_data = analyze_cash_flow(customer_name, month, currency)
+    budget_data = get_budgets(customer_id, month, currency)['budgets']
+    spend_data = analyze_cash_flow(customer_id, month, currency)
     
     if not spend_data['success']:
         return spend_data 
@@ -835,7 +1616,10 @@ def get_spending_vs_budget(customer_name, month, currency):
         total_budget += budget
         total_spent += spent
         
-    return {"success": True, "comparison": comparison, "total_budget": total_budget, "total_spent": total_spent}
+    return {
+        "success": True, "comparison": comparison, "total_budget": total_budget, "total_spent": total_spent,
+        "ai_failed": spend_data.get("ai_failed", False)
+    }
 
 
 # --- Admin Functions ---
@@ -847,15 +1631,12 @@ def get_system_stats():
         total_users = conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
         active_users = conn.execute("SELECT COUNT(*) FROM customers WHERE is_active = 1").fetchone()[0]
         
-        wallets = conn.execute("SELECT currency, balance FROM wallets").fetchall()
+        totals = conn.execute("SELECT currency, SUM(balance) AS total FROM wallets GROUP BY currency").fetchall()
         twd_rates = exchange_rate.get_rates("TWD")
         
-        # (*** (新) 各幣別統計 ***)
-        assets_by_currency = {}
+        # (*** (新) 各幣別統計 (整數加總，無需再做四捨五入) ***)
+        assets_by_currency = {row['currency']: money.from_minor(row['total'], row['currency']) for row in totals}
         total_assets_twd = 0.0
-        
-        for w in wallets:
-            assets_by_currency[w['currency']] = assets_by_currency.get(w['currency'], 0) + w['balance']
 
         if twd_rates:
             for currency, balance in assets_by_currency.items():
@@ -892,7 +1673,7 @@ def admin_get_user_details(user_id):
         
         user_data = dict(user)
         # 借用現有函式
-        wallets_data = get_my_wallets(user_data['name'])
+        wallets_data = get_my_wallets(user_data['id'])
         
         user_data['wallets'] = wallets_data.get('wallets', [])
         # (*** 移除 transactions_data 的載入 ***)
@@ -902,14 +1683,18 @@ def admin_get_user_details(user_id):
         conn.close()
 
 def admin_update_user(user_id, email, role, is_active):
-    # (邏輯不變)
+    try:
+        email = _normalize_email(email)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
     conn = get_db_conn()
     try:
         conn.execute(
-            "UPDATE customers SET email = ?, role = ?, is_active = ? WHERE id = ?",
+            "UPDATE customers SET email = ?, role = ?, is_active = ?, data_version = data_version + 1 WHERE id = ?",
             (email, role, is_active, user_id)
         )
         conn.commit()
+        _invalidate_profile(user_id)
         return {"success": True}
     except sqlite3.Error as e:
         conn.rollback()
@@ -930,7 +1715,7 @@ def admin_reset_password(user_id):
         
         conn.execute("UPDATE customers SET password = ? WHERE id = ?", (new_hashed_password, user_id))
         conn.commit()
-        
+
         if user['email']:
             email_service.send_password_reset_notification(user['email'], new_password)
             
@@ -945,17 +1730,16 @@ def admin_manual_adjustment(admin_name, user_id, currency, amount, note):
     # (邏輯不變)
     conn = get_db_conn()
     try:
-        user = conn.execute("SELECT name FROM customers WHERE id = ?", (user_id,)).fetchone()
+        user = conn.execute("SELECT id FROM customers WHERE id = ?", (user_id,)).fetchone()
         if not user:
             return {"success": False, "error": "查無此人"}
         
-        user_name = user['name']
         date_str = get_today_str()
         
         if amount > 0:
-            result = deposit_money(user_name, amount, date_str, currency, note=note)
+            result = deposit_money(user['id'], amount, date_str, currency, note=note)
         elif amount < 0:
-            result = withdraw_money(user_name, abs(amount), date_str, currency, note=note)
+            result = withdraw_money(user['id'], abs(amount), date_str, currency, note=note)
         else:
             return {"success": False, "error": "金額不可為 0"}
             
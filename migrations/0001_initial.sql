@@ -1,23 +1,18 @@
--- (新的 schema.sql)
--- 刪除舊資料表 (如果存在)
-DROP TABLE IF EXISTS transactions;
-DROP TABLE IF EXISTS wallets;
-DROP TABLE IF EXISTS customers;
-DROP TABLE IF EXISTS budgets;
-DROP TABLE IF EXISTS system_config;
+-- 0001: 初始資料表 (原 schema.sql)
+-- 使用 IF NOT EXISTS，讓舊版以 schema.sql 建立的資料庫也能直接納入版本管理
 
--- 客戶表 (*** 新增 is_active ***)
-CREATE TABLE customers (
+-- 客戶表
+CREATE TABLE IF NOT EXISTS customers (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   name TEXT UNIQUE NOT NULL,
   password TEXT NOT NULL,
   role TEXT NOT NULL DEFAULT 'customer', -- 'customer' 或 'admin'
   email TEXT,
-  is_active BOOLEAN NOT NULL DEFAULT 1 -- (*** 新增 ***) 1=啟用, 0=停權
+  is_active BOOLEAN NOT NULL DEFAULT 1 -- 1=啟用, 0=停權
 );
 
--- 錢包表 (與之前相同)
-CREATE TABLE wallets (
+-- 錢包表
+CREATE TABLE IF NOT EXISTS wallets (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   customer_id INTEGER NOT NULL,
   currency TEXT NOT NULL, -- 'TWD', 'USD' 等
@@ -25,8 +20,8 @@ CREATE TABLE wallets (
   FOREIGN KEY (customer_id) REFERENCES customers (id)
 );
 
--- 交易表 (與之前相同)
-CREATE TABLE transactions (
+-- 交易表
+CREATE TABLE IF NOT EXISTS transactions (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   wallet_id INTEGER NOT NULL,
   date TEXT NOT NULL,
@@ -38,8 +33,8 @@ CREATE TABLE transactions (
   FOREIGN KEY (wallet_id) REFERENCES wallets (id)
 );
 
--- (*** (新) 預算表 ***)
-CREATE TABLE budgets (
+-- 預算表
+CREATE TABLE IF NOT EXISTS budgets (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   customer_id INTEGER NOT NULL,
   month TEXT NOT NULL, -- 格式 'YYYY-MM'
@@ -50,11 +45,11 @@ CREATE TABLE budgets (
   UNIQUE(customer_id, month, currency, category)
 );
 
--- (*** (新) 系統設定表 ***)
-CREATE TABLE system_config (
+-- 系統設定表
+CREATE TABLE IF NOT EXISTS system_config (
   key TEXT PRIMARY KEY,
   value TEXT NOT NULL
 );
 
 -- 插入一筆預設資料 (例如手動匯率)
-INSERT INTO system_config (key, value) VALUES ('manual_rates', '{}');
\ No newline at end of file
+INSERT OR IGNORE INTO system_config (key, value) VALUES ('manual_rates', '{}');
@@ -0,0 +1,11 @@
+-- 0002: 熱路徑索引
+-- logic.py 幾乎每個查詢都以 (customer_id, currency) 找錢包、以 wallet_id + date 找交易
+
+-- 每位客戶每個幣別只會有一個錢包 (_get_or_create_wallet 的前提)
+-- 若既有資料有重複錢包，此步驟會失敗，需先人工合併
+CREATE UNIQUE INDEX IF NOT EXISTS idx_wallets_customer_currency
+  ON wallets (customer_id, currency);
+
+-- 交易紀錄依 (日期, id) 排序、依月份範圍篩選
+CREATE INDEX IF NOT EXISTS idx_transactions_wallet_date
+  ON transactions (wallet_id, date, id);
@@ -0,0 +1,61 @@
+-- 0003: 金額改以整數「最小單位」儲存 (定點數)
+-- wallets.balance、transactions.amount / balance_after 由 REAL 改為 INTEGER，
+-- 每個幣別的換算倍率記錄在 currency_scales (未列出的幣別預設為 100)
+
+CREATE TABLE currency_scales (
+  currency TEXT PRIMARY KEY,
+  scale INTEGER NOT NULL -- 1 單位主幣 = scale 個最小單位 (例如 TWD 100 = 分, JPY 1 = 円)
+);
+
+INSERT INTO currency_scales (currency, scale) VALUES
+  ('TWD', 100), ('USD', 100), ('EUR', 100), ('CNY', 100), ('HKD', 100),
+  ('GBP', 100), ('AUD', 100), ('CAD', 100), ('SGD', 100),
+  ('JPY', 1), ('KRW', 1);
+
+-- 錢包表 (重建，balance 改為 INTEGER)
+CREATE TABLE wallets_new (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  customer_id INTEGER NOT NULL,
+  currency TEXT NOT NULL,
+  balance INTEGER NOT NULL DEFAULT 0, -- 最小單位
+  FOREIGN KEY (customer_id) REFERENCES customers (id)
+);
+
+INSERT INTO wallets_new (id, customer_id, currency, balance)
+  SELECT w.id, w.customer_id, w.currency,
+         CAST(ROUND(w.balance * COALESCE(s.scale, 100)) AS INTEGER)
+  FROM wallets w
+  LEFT JOIN currency_scales s ON s.currency = w.currency;
+
+-- 交易表 (重建，amount / balance_after 改為 INTEGER)
+CREATE TABLE transactions_new (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  wallet_id INTEGER NOT NULL,
+  date TEXT NOT NULL,
+  type TEXT NOT NULL,
+  amount INTEGER NOT NULL, -- 最小單位，正數為入帳, 負數為出帳
+  balance_after INTEGER NOT NULL, -- 最小單位，交易後餘額
+  note TEXT,
+  exchange_rate REAL, -- 匯率 (僅換匯時，主幣對主幣)
+  FOREIGN KEY (wallet_id) REFERENCES wallets (id)
+);
+
+INSERT INTO transactions_new (id, wallet_id, date, type, amount, balance_after, note, exchange_rate)
+  SELECT t.id, t.wallet_id, t.date, t.type,
+         CAST(ROUND(t.amount * COALESCE(s.scale, 100)) AS INTEGER),
+         CAST(ROUND(t.balance_after * COALESCE(s.scale, 100)) AS INTEGER),
+         t.note, t.exchange_rate
+  FROM transactions t
+  JOIN wallets w ON w.id = t.wallet_id
+  LEFT JOIN currency_scales s ON s.currency = w.currency;
+
+DROP TABLE transactions;
+DROP TABLE wallets;
+ALTER TABLE wallets_new RENAME TO wallets;
+ALTER TABLE transactions_new RENAME TO transactions;
+
+-- 重建 0002 的索引 (隨舊表一併刪除)
+CREATE UNIQUE INDEX idx_wallets_customer_currency
+  ON wallets (customer_id, currency);
+CREATE INDEX idx_transactions_wallet_date
+  ON transactions (wallet_id, date, id);
@@ -0,0 +1,26 @@
+-- 0004: 每日 / 每月收支彙總表
+-- 由 logic._post_transactions 在寫入交易的同一個交易中累加；
+-- 既有交易請在遷移後執行 `flask rebuild-rollups` 回填
+-- 金額為錢包幣別的最小單位；source 為收支來源分類 (見 logic._flow_source)
+
+CREATE TABLE daily_flow_rollups (
+  wallet_id INTEGER NOT NULL,
+  day TEXT NOT NULL, -- 'YYYY-MM-DD'
+  source TEXT NOT NULL,
+  income INTEGER NOT NULL DEFAULT 0,
+  spend INTEGER NOT NULL DEFAULT 0, -- 正數
+  income_count INTEGER NOT NULL DEFAULT 0,
+  spend_count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (wallet_id, day, source)
+) WITHOUT ROWID;
+
+CREATE TABLE monthly_flow_rollups (
+  wallet_id INTEGER NOT NULL,
+  month TEXT NOT NULL, -- 'YYYY-MM'
+  source TEXT NOT NULL,
+  income INTEGER NOT NULL DEFAULT 0,
+  spend INTEGER NOT NULL DEFAULT 0,
+  income_count INTEGER NOT NULL DEFAULT 0,
+  spend_count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (wallet_id, month, source)
+) WITHOUT ROWID;
@@ -0,0 +1,17 @@
+-- 0005: Email 寄件匣 (outbox)
+-- 通知信在業務交易的同一個資料庫交易中寫入，由背景執行緒 (email_service.OutboxWorker) 批次寄出
+
+CREATE TABLE email_outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  to_address TEXT NOT NULL,
+  subject TEXT NOT NULL,
+  body TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending', -- 'pending' 待寄 / 'sending' 寄送中 / 'sent' 已寄出 / 'failed' 放棄
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at REAL NOT NULL, -- Unix 時間；'sending' 時為租約到期時間
+  last_error TEXT,
+  created_at REAL NOT NULL,
+  sent_at REAL
+);
+
+CREATE INDEX idx_email_outbox_due ON email_outbox (status, next_attempt_at);
@@ -0,0 +1,10 @@
+-- 0006: 備註分類快取 (ai_services.classify_notes)
+-- note_key: 正規化後的備註文字；category_set: 候選分類集合的雜湊
+
+CREATE TABLE note_categories (
+  note_key TEXT NOT NULL,
+  category_set TEXT NOT NULL,
+  category TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  PRIMARY KEY (note_key, category_set)
+) WITHOUT ROWID;
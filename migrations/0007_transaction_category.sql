@@ -0,0 +1,8 @@
+-- 0007: 交易在寫入時即記錄分類 (category)
+-- 有備註的一般支出先寫入 NULL (待分類)，由背景執行緒呼叫 AI 後回寫；
+-- 其他交易直接寫入收支來源 (與 _flow_source 相同)。
+-- 既有交易全部為 NULL，會在背景分類執行緒啟動後 (或 `flask categorize-pending`) 補齊。
+ALTER TABLE transactions ADD COLUMN category TEXT;
+
+-- 待分類交易的佇列索引 (只包含 category IS NULL 的列)
+CREATE INDEX IF NOT EXISTS idx_transactions_uncategorized ON transactions (id) WHERE category IS NULL;
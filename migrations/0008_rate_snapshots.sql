@@ -0,0 +1,14 @@
+-- 0008: 匯率快照 (exchange_rate)
+-- 每次成功向 API 取得基準匯率表時寫入一筆；其他 worker 程序與重新啟動後直接讀取最新快照，
+-- 並可查詢任一天當時適用的匯率 (get_rate_on)。
+-- day: 取得時的本地日期 'YYYY-MM-DD'；rates: JSON (1 base = rates[X] X)
+
+CREATE TABLE IF NOT EXISTS rate_snapshots (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  base TEXT NOT NULL,
+  fetched_at REAL NOT NULL,
+  day TEXT NOT NULL,
+  rates TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_snapshots_base_day ON rate_snapshots (base, day, fetched_at);
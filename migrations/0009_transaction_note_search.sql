@@ -0,0 +1,28 @@
+-- 0009: 交易備註全文檢索 (FTS5)
+-- trigram 分詞: 以連續 3 個字元為單位建立索引，中文備註不需斷詞即可做子字串搜尋
+-- (少於 3 個字的查詢由 logic.search_transactions 改用 LIKE)。
+-- external content 表: 只存索引，備註內容仍從 transactions 讀取；由觸發器保持同步。
+
+CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+  note,
+  content = 'transactions',
+  content_rowid = 'id',
+  tokenize = 'trigram'
+);
+
+-- 為既有交易建立索引
+INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild');
+
+CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN
+  INSERT INTO transactions_fts (rowid, note) VALUES (new.id, new.note);
+END;
+
+CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN
+  INSERT INTO transactions_fts (transactions_fts, rowid, note) VALUES ('delete', old.id, old.note);
+END;
+
+-- 只在備註變更時更新 (背景分類回寫 category 不會觸發)
+CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF note ON transactions BEGIN
+  INSERT INTO transactions_fts (transactions_fts, rowid, note) VALUES ('delete', old.id, old.note);
+  INSERT INTO transactions_fts (rowid, note) VALUES (new.id, new.note);
+END;
@@ -0,0 +1,4 @@
+-- 0010: 每位客戶的資料版本號 (data_version)
+-- 任何會改變客戶可見資料的寫入 (交易、分類回寫、預算、email 等) 都在同一個交易中遞增此欄位；
+-- app.py 以它產生 ETag，資料沒變時 GET API 直接回 304，不需查詢 transactions。
+ALTER TABLE customers ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,10 @@
+-- 0011: 伺服器端 session (session_store.SqliteSessionInterface)，取代 Flask-Session 的 filesystem 儲存
+-- data: Flask 的 TaggedJSON 序列化結果；expires_at: Unix 時間，過期的列由定期清理刪除
+
+CREATE TABLE sessions (
+  sid TEXT PRIMARY KEY,
+  data TEXT NOT NULL,
+  expires_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX idx_sessions_expires ON sessions (expires_at);
@@ -0,0 +1,18 @@
+-- 0012: 換匯報價 (rate_resolver.lock_quote)，取代程序內記憶體的報價表，所有 worker 共用
+-- max_amount: 報價時的轉出金額 (from_currency 最小單位)，成交金額不可超過
+-- used_at: 成交時間；報價在換匯交易中原子性地標記為已使用，只能成交一次
+-- 過期的列由定期清理刪除
+
+CREATE TABLE fx_quotes (
+  quote_id TEXT PRIMARY KEY,
+  customer_id INTEGER NOT NULL,
+  from_currency TEXT NOT NULL,
+  to_currency TEXT NOT NULL,
+  rate REAL NOT NULL,
+  source TEXT NOT NULL,
+  max_amount INTEGER NOT NULL,
+  expires_at REAL NOT NULL,
+  used_at REAL
+) WITHOUT ROWID;
+
+CREATE INDEX idx_fx_quotes_expires ON fx_quotes (expires_at);
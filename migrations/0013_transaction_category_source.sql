@@ -0,0 +1,10 @@
+-- 0013: 記錄 AI 分類的來源與信心，讓信心不足的本機猜測之後可以重新分類
+-- category_source: 'remote' (遠端模型或其快取)、'local' (本機模型，信心足夠)、
+--                  'guess' (本機模型信心低於 LOCAL_CONFIDENCE，遠端模型可用時重新分類)；
+--                  NULL 為寫入時依規則決定的分類 (或遷移前的舊資料)
+-- category_confidence: 本機模型的信心 (0~1)，其他來源為 NULL
+ALTER TABLE transactions ADD COLUMN category_source TEXT;
+ALTER TABLE transactions ADD COLUMN category_confidence REAL;
+
+-- 待重新分類的佇列索引 (只包含本機猜測)
+CREATE INDEX idx_transactions_category_guess ON transactions (id) WHERE category_source = 'guess';
@@ -0,0 +1,37 @@
+-- 0014: 以既有交易回填每日 / 每月收支彙總表 (0004 只建立資料表)
+-- 先清空再整批重算，結果與 `flask rebuild-rollups` 相同；新資料庫沒有交易，不做任何事。
+-- source 的 CASE 與 logic._flow_source 的規則一致 (修改其中一邊時請同步)
+
+DELETE FROM daily_flow_rollups;
+DELETE FROM monthly_flow_rollups;
+
+INSERT INTO daily_flow_rollups (wallet_id, day, source, income, spend, income_count, spend_count)
+SELECT wallet_id, date,
+       CASE
+         WHEN amount > 0 THEN
+           CASE
+             WHEN substr(note, 1, 3) = '管理員' THEN '管理員調整'
+             WHEN type IN ('存款', '開戶') THEN type
+             WHEN type = '轉入' THEN '轉帳收入'
+             WHEN type = '換匯轉入' THEN '換匯收入'
+             ELSE '其他收入'
+           END
+         WHEN substr(note, 1, 3) = '管理員' THEN '管理員調整'
+         WHEN type = '換匯轉出' THEN '換匯支出'
+         WHEN note <> '' THEN '_備註支出'
+         WHEN type = '轉出' THEN '轉帳支出'
+         WHEN type = '提款' THEN '提款 (無備註)'
+         ELSE '其他支出 (無備註)'
+       END AS source,
+       SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END),
+       SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END),
+       SUM(amount > 0),
+       SUM(amount < 0)
+FROM transactions
+WHERE amount <> 0
+GROUP BY wallet_id, date, source;
+
+INSERT INTO monthly_flow_rollups (wallet_id, month, source, income, spend, income_count, spend_count)
+SELECT wallet_id, substr(day, 1, 7), source, SUM(income), SUM(spend), SUM(income_count), SUM(spend_count)
+FROM daily_flow_rollups
+GROUP BY wallet_id, substr(day, 1, 7), source;
@@ -0,0 +1,65 @@
+# 金額的定點數轉換
+# 資料庫中的金額一律以整數「最小單位」儲存 (見 migrations/0003_fixed_point_money.sql)，
+# 對外 (API / 畫面) 則使用一般的主幣金額。
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from database import get_db_conn
+
+DEFAULT_SCALE = 100 # currency_scales 未列出的幣別
+MAX_MINOR_UNITS = 10 ** 15 # 單筆金額上限 (最小單位)；餘額與加總仍遠小於 SQLite INTEGER 的 2^63
+MAX_AMOUNT = Decimal(MAX_MINOR_UNITS) / DEFAULT_SCALE # 主幣金額上限 (以 DEFAULT_SCALE 計，scale 較小的幣別更寬鬆)
+
+_scales = None # { "幣別": scale }，第一次使用時從資料庫載入
+
+
+def _load_scales():
+    global _scales
+    conn = get_db_conn()
+    try:
+        rows = conn.execute("SELECT currency, scale FROM currency_scales").fetchall()
+        _scales = {row['currency']: row['scale'] for row in rows}
+    finally:
+        conn.close()
+    return _scales
+
+
+def get_scale(currency):
+    """1 單位主幣等於多少最小單位"""
+    scales = _scales if _scales is not None else _load_scales()
+    return scales.get(currency, DEFAULT_SCALE)
+
+
+def parse_amount(value):
+    """
+    將 API 收到的金額 (字串或數字) 轉成 Decimal，不經過 float。
+    無法解析、非有限數值 (inf / nan) 或超過 MAX_AMOUNT 時回傳 0，交由 logic 的金額檢查回報錯誤。
+    """
+    try:
+        amount = Decimal(str(value if value is not None else 0).strip() or 0)
+    except InvalidOperation:
+        return Decimal(0)
+    if not amount.is_finite() or abs(amount) > MAX_AMOUNT:
+        return Decimal(0)
+    return amount
+
+
+def to_minor(amount, currency):
+    """主幣金額 -> 整數最小單位 (四捨五入)；無法換算或超過 MAX_MINOR_UNITS 時回傳 0 (同 parse_amount)"""
+    try:
+        units = int((Decimal(str(amount)) * get_scale(currency)).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError, OverflowError):
+        return 0
+    return units if abs(units) <= MAX_MINOR_UNITS else 0
+
+
+def from_minor(units, currency):
+    """整數最小單位 -> 主幣金額 (float，供 JSON 回傳與圖表計算)"""
+    if units is None:
+        return None
+    return units / get_scale(currency)
+
+
+def convert_minor(units, from_currency, to_currency, rate):
+    """以主幣匯率 rate 將 from_currency 的最小單位換算成 to_currency 的最小單位 (四捨五入)"""
+    major = Decimal(units) / get_scale(from_currency)
+    converted = major * Decimal(str(rate)) * get_scale(to_currency)
+    return int(converted.quantize(Decimal(1), rounding=ROUND_HALF_UP))
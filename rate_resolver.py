@@ -0,0 +1,188 @@
+# 匯率解析: 手動匯率 (system_config) 優先，否則使用 API 的交叉匯率 (exchange_rate)
+# 手動匯率快取在記憶體中，並以 system_config 的 manual_rates_version 版本號判斷是否過期:
+# 本程序的 set_manual_rates 會立即更新快取；其他 worker 程序最多 MANUAL_RATES_RECHECK_SECONDS 秒後發現版本變更。
+# 穩定狀態下 resolve() 不需要任何資料庫或網路 I/O。
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from database import get_db_conn
+import exchange_rate
+
+MANUAL_RATES_RECHECK_SECONDS = float(os.getenv("MANUAL_RATES_RECHECK_SECONDS", 5))
+
+_lock = threading.Lock()
+_manual = {"version": None, "rates": {}, "checked_at": 0.0}
+
+
+def _read_version(conn):
+    row = conn.execute("SELECT value FROM system_config WHERE key = 'manual_rates_version'").fetchone()
+    return int(row['value']) if row else 0
+
+
+def _load(conn, version):
+    row = conn.execute("SELECT value FROM system_config WHERE key = 'manual_rates'").fetchone()
+    try:
+        rates = json.loads(row['value']) if row else {}
+    except ValueError:
+        rates = {}
+    with _lock:
+        _manual.update(version=version, rates=rates, checked_at=time.time())
+    return rates
+
+
+def get_manual_rates():
+    """回傳手動匯率 { "USD_TWD": 31.5, ... } (快取；請勿修改回傳的字典)"""
+    with _lock:
+        if time.time() - _manual["checked_at"] < MANUAL_RATES_RECHECK_SECONDS:
+            return _manual["rates"]
+        cached_version = _manual["version"]
+
+    conn = get_db_conn()
+    try:
+        version = _read_version(conn)
+        if version == cached_version:
+            with _lock:
+                _manual["checked_at"] = time.time()
+                return _manual["rates"]
+        return _load(conn, version)
+    except sqlite3.Error:
+        return {}
+    finally:
+        conn.close()
+
+
+def set_manual_rates(rates_dict):
+    """寫入手動匯率並遞增版本號 (同一個交易)，同時更新本程序的快取"""
+    conn = get_db_conn()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT OR REPLACE INTO system_config (key, value) VALUES ('manual_rates', ?)", (json.dumps(rates_dict),)
+        )
+        version = _read_version(conn) + 1
+        conn.execute(
+            "INSERT OR REPLACE INTO system_config (key, value) VALUES ('manual_rates_version', ?)", (str(version),)
+        )
+        conn.commit()
+        _load(conn, version)
+        return {"success": True}
+    except Exception as e:
+        conn.rollback()
+        return {"success": False, "error": str(e)}
+    finally:
+        conn.close()
+
+
+def rates_version():
+    """目前的匯率狀態 (手動匯率版本, 匯率表取得時間)；任一改變時，以匯率換算的結果可能不同"""
+    get_manual_rates()
+    return _manual["version"], exchange_rate.get_table_time()
+
+
+def get_manual_rate(from_currency, to_currency):
+    """
+    目前的手動匯率 (直接或反向)，沒有設定時回傳 None。
+    手動匯率只保存目前的值 (沒有歷史)，以歷史日期換算時也使用這個值。
+    """
+    manual_rates = get_manual_rates()
+    rate = manual_rates.get(f"{from_currency}_{to_currency}")
+    if rate is not None:
+        return rate
+    reverse = manual_rates.get(f"{to_currency}_{from_currency}", 0)
+    return 1 / reverse if reverse > 0 else None
+
+
+def _resolve_with(manual_rates, version, rates_by_base, as_of, from_currency, to_currency):
+    rate_key_direct = f"{from_currency}_{to_currency}"
+    rate_key_reverse = f"{to_currency}_{from_currency}"
+
+    if rate_key_direct in manual_rates:
+        return {"success": True, "rate": manual_rates[rate_key_direct], "source": "manual", "as_of": None, "version": version}
+    elif rate_key_reverse in manual_rates and manual_rates[rate_key_reverse] > 0:
+        return {"success": True, "rate": 1 / manual_rates[rate_key_reverse], "source": "manual_inverse", "as_of": None, "version": version}
+
+    if not rates_by_base: return {"success": False, "error": "無法取得即時匯率"}
+    rate = rates_by_base.get(from_currency, {}).get(to_currency)
+    if not rate: return {"success": False, "error": f"無法取得 {from_currency} 到 {to_currency} 的匯率"}
+    return {"success": True, "rate": rate, "source": "api", "as_of": as_of, "version": version}
+
+
+def resolve(from_currency, to_currency):
+    """
+    取得 1 from_currency 可換得多少 to_currency，並附上來源:
+    {"success": True, "rate": 匯率, "source": "manual" / "manual_inverse" / "api", "as_of": 時間戳或 None, "version": 手動匯率版本}
+    source 為 api 時 as_of 是匯率表的取得時間。
+    """
+    return resolve_many([(from_currency, to_currency)])[0]
+
+
+def resolve_many(pairs):
+    """
+    一次解析多組 [(from, to), ...]，全部使用同一份手動匯率與同一張匯率表 (同一個快照)。
+    回傳與 pairs 等長的列表，元素格式同 resolve()。
+    """
+    manual_rates = get_manual_rates()
+    version = _manual["version"]
+    # 只有需要 API 匯率時才取得匯率表
+    needs_api = any(
+        f"{f}_{t}" not in manual_rates and not manual_rates.get(f"{t}_{f}", 0) > 0 for f, t in pairs
+    )
+    rates_by_base = exchange_rate.get_matrix() if needs_api else None
+    as_of = exchange_rate.get_table_time() if rates_by_base is not None else None
+    return [_resolve_with(manual_rates, version, rates_by_base, as_of, f, t) for f, t in pairs]
+
+
+# --- 報價鎖定 (quote tokens) ---
+# /api/quote 將解析出的匯率存成短期有效的報價 (quote_id)，換匯時帶入 quote_id 即以同一個匯率成交，
+# 不再重新解析匯率。報價存在 fx_quotes 資料表 (所有 worker 共用)，綁定使用者、幣別與報價金額，
+# 並在換匯交易中原子性地標記為已使用: 每筆報價只能成交一次，金額不可超過報價金額。
+QUOTE_TTL_SECONDS = float(os.getenv("QUOTE_TTL_SECONDS", 30))
+QUOTE_SWEEP_SECONDS = float(os.getenv("QUOTE_SWEEP_SECONDS", 600))
+
+_last_quote_sweep = 0.0
+
+
+def lock_quote(customer_id, from_currency, to_currency, max_amount, rate_result):
+    """
+    存入一筆報價，回傳 (quote_id, 有效秒數)。
+    max_amount: 報價的轉出金額 (from_currency 最小單位)
+    """
+    global _last_quote_sweep
+    quote_id = secrets.token_urlsafe(12)
+    now = time.time()
+    conn = get_db_conn()
+    try:
+        conn.execute(
+            "INSERT INTO fx_quotes (quote_id, customer_id, from_currency, to_currency, rate, source, max_amount, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (quote_id, customer_id, from_currency, to_currency, rate_result["rate"], rate_result["source"],
+             max_amount, now + QUOTE_TTL_SECONDS)
+        )
+        if now - _last_quote_sweep >= QUOTE_SWEEP_SECONDS:
+            _last_quote_sweep = now
+            conn.execute("DELETE FROM fx_quotes WHERE expires_at <= ?", (now,))
+        conn.commit()
+    finally:
+        conn.close()
+    return quote_id, QUOTE_TTL_SECONDS
+
+
+def consume_quote(conn, quote_id, customer_id, from_currency, to_currency, amount):
+    """
+    在呼叫端已開始的寫入交易 (BEGIN IMMEDIATE) 中取得並標記報價為已使用；交易 rollback 時報價仍可使用。
+    需為同一位使用者、同一組幣別、未過期未使用，且 amount (最小單位) 不超過報價金額。
+    回傳 {"success": True, "rate", "source"}，不符時回傳錯誤。
+    """
+    now = time.time()
+    quote = conn.execute(
+        "SELECT rate, source FROM fx_quotes WHERE quote_id = ? AND customer_id = ? AND from_currency = ? "
+        "AND to_currency = ? AND used_at IS NULL AND expires_at > ? AND max_amount >= ?",
+        (quote_id, customer_id, from_currency, to_currency, now, amount)
+    ).fetchone()
+    if quote is None:
+        return {"success": False, "error": "報價已失效，請重新報價"}
+    conn.execute("UPDATE fx_quotes SET used_at = ? WHERE quote_id = ?", (now, quote_id))
+    return {"success": True, "rate": quote['rate'], "source": quote['source']}
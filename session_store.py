@@ -0,0 +1,212 @@
+# 伺服器端 session: 存在 SQLite 的 sessions 資料表 (所有 worker 共用)，取代 Flask-Session 的 filesystem 儲存
+# - Cookie 只放簽章過的 session id (以 SECRET_KEY 簽章，偽造的 id 不會查資料庫)
+# - 閒置 SESSION_TTL_SECONDS 秒後過期；每次請求只在剩餘時間不到一半時才延長 (避免每個請求都寫入)
+# - 讀取有程序內快取 (SESSION_CACHE_SECONDS 秒)，內容沒變的請求不需任何資料庫 I/O；
+#   其他 worker 登出 / 修改同一個 session 時，本程序最多 SESSION_CACHE_SECONDS 秒後看到變更
+# - 過期的列每 SESSION_SWEEP_SECONDS 秒清理一次 (或 `flask sweep-sessions`)
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+from database import get_db_conn
+
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 12 * 3600))
+SESSION_CACHE_SECONDS = float(os.getenv("SESSION_CACHE_SECONDS", 5))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 10000))
+SESSION_SWEEP_SECONDS = float(os.getenv("SESSION_SWEEP_SECONDS", 600))
+
+
+class SqliteSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires_at=0.0, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = new
+        self.modified = False
+
+
+class SqliteSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS):
+        self.ttl = ttl
+        self._cache = OrderedDict() # sid -> (data 字串, expires_at, 讀取時間)
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt="session-id")
+
+    # --- 讀取快取 ---
+    def _cache_get(self, sid):
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is None or time.time() - entry[2] >= SESSION_CACHE_SECONDS:
+                return None
+            self._cache.move_to_end(sid)
+            return entry
+
+    def _cache_put(self, sid, data, expires_at):
+        with self._lock:
+            self._cache[sid] = (data, expires_at, time.time())
+            self._cache.move_to_end(sid)
+            while len(self._cache) > SESSION_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    # --- SessionInterface ---
+    def open_session(self, app, request):
+        signed_sid = request.cookies.get(self.get_cookie_name(app))
+        if not signed_sid:
+            return SqliteSession(new=True)
+        try:
+            sid = self._signer(app).unsign(signed_sid).decode("ascii")
+        except (BadSignature, UnicodeDecodeError):
+            return SqliteSession(new=True)
+
+        entry = self._cache_get(sid)
+        if entry is None or entry[1] <= time.time(): # 快取中看似過期時，可能已被其他 worker 延長
+            conn = get_db_conn()
+            try:
+                row = conn.execute("SELECT data, expires_at FROM sessions WHERE sid = ?", (sid,)).fetchone()
+            finally:
+                conn.close()
+            if row is None or row['expires_at'] <= time.time():
+                self._cache_drop(sid)
+                return SqliteSession(new=True)
+            entry = (row['data'], row['expires_at'])
+            self._cache_put(sid, *entry)
+
+        data, expires_at = entry[0], entry[1]
+        try:
+            return SqliteSession(self.serializer.loads(data), sid=sid, expires_at=expires_at)
+        except ValueError:
+            return SqliteSession(new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and session.sid:
+                self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        # 內容沒變且離過期還很久: 不寫資料庫也不重設 cookie
+        if not session.modified and session.sid and session.expires_at - now > self.ttl / 2:
+            return
+
+        sid = session.sid or secrets.token_urlsafe(32)
+        data = self.serializer.dumps(dict(session))
+        expires_at = now + self.ttl
+        conn = get_db_conn()
+        try:
+            if session.modified or session.new:
+                conn.execute(
+                    "INSERT INTO sessions (sid, data, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+                    (sid, data, expires_at)
+                )
+            else:
+                # 只延長期限 (不寫回內容，避免覆蓋其他 worker 的修改或復活已登出的 session)
+                conn.execute("UPDATE sessions SET expires_at = ? WHERE sid = ?", (expires_at, sid))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"session 寫入失敗: {e}")
+            return
+        finally:
+            conn.close()
+        if session.modified or session.new:
+            self._cache_put(sid, data, expires_at)
+        else:
+            self._cache_drop(sid)
+        self._maybe_sweep(now)
+
+        if session.sid != sid or session.modified:
+            response.set_cookie(
+                name, self._signer(app).sign(sid).decode("ascii"),
+                expires=self.get_expiration_time(app, session), domain=domain, path=path,
+                secure=self.get_cookie_secure(app), httponly=self.get_cookie_httponly(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def _delete(self, sid):
+        self._cache_drop(sid)
+        conn = get_db_conn()
+        try:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"session 刪除失敗: {e}")
+        finally:
+            conn.close()
+
+    def _maybe_sweep(self, now):
+        with self._lock:
+            if now - self._last_sweep < SESSION_SWEEP_SECONDS:
+                return
+            self._last_sweep = now
+        sweep_expired_sessions()
+
+
+def sweep_expired_sessions():
+    """刪除已過期的 session，回傳刪除筆數"""
+    conn = get_db_conn()
+    try:
+        cursor = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"session 清理失敗: {e}")
+        return 0
+    finally:
+        conn.close()
+
+
+# --- SECRET_KEY ---
+SECRET_KEY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".secret_key")
+
+
+def load_secret_key():
+    """
+    優先使用環境變數 SECRET_KEY；沒有設定時使用 (第一次啟動時產生的) .secret_key 檔，
+    同一台機器上的所有 worker 與重新啟動後都使用同一把金鑰。
+    """
+    key = os.getenv("SECRET_KEY")
+    if key:
+        return key
+    if not os.path.exists(SECRET_KEY_FILE):
+        # 先寫入暫存檔再以 link 原子性地建立: 同時啟動的 worker 只有一個會成功，其他的讀到同一把金鑰
+        tmp_path = f"{SECRET_KEY_FILE}.{os.getpid()}"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(tmp_path, SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(SECRET_KEY_FILE) as f:
+        return f.read().strip()
+
+
+def init_app(app):
+    app.config["SECRET_KEY"] = load_secret_key()
+    app.session_interface = SqliteSessionInterface()
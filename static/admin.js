@@ -220,36 +220,61 @@ document.addEventListener('DOMContentLoaded', () => {
             } catch (e) { showStatus(`載入使用者資料失敗: ${e.message}`, true); }
         };
         
-        // (*** (新) 獨立載入交易紀錄函式 (Req 5A) ***)
-        const loadUserTransactions = async (userId, month) => {
-            let apiUrl = `/api/admin/user/${userId}/transactions`;
-            if (month) {
-                apiUrl += `?month=${month}`;
-            }
+        // (*** (新) 獨立載入交易紀錄函式 (Req 5A)，keyset 分頁 + 無限捲動 ***)
+        const transactionsScrollContainer = transactionsList.closest('div');
+        let txCursor = null; // 下一頁游標 (null 表示沒有更多資料)
+        let txLoading = false;
+        let txRequestId = 0;
+
+        const loadUserTransactions = async (userId, month, reset = true) => {
+            if (!reset && (txLoading || !txCursor)) return;
+            const requestId = reset ? ++txRequestId : txRequestId;
+            txLoading = true;
+
+            const params = new URLSearchParams();
+            if (month) params.set('month', month);
+            if (!reset) params.set('cursor', txCursor);
             try {
-                const res = await fetch(apiUrl);
-                const transactions = await res.json();
-                transactionsList.innerHTML = '';
-                if (transactions.length > 0) {
-                    transactions.forEach(tx => {
-                        transactionsList.innerHTML += `
-                            <tr>
-                                <td>${tx.date}</td>
-                                <td>${tx.type}</td>
-                                <td>${tx.currency}</td>
-                                <td class="${tx.amount > 0 ? 'text-success' : 'text-danger'}">${tx.amount.toFixed(2)}</td>
-                                <td>${tx.note || ''}</td>
-                            </tr>
-                        `;
-                    });
-                } else {
+                const res = await fetch(`/api/admin/user/${userId}/transactions?${params}`);
+                const result = await res.json();
+                if (requestId !== txRequestId) return;
+                if (!result.success) throw new Error(result.error);
+
+                if (reset) transactionsList.innerHTML = '';
+                if (reset && result.transactions.length === 0) {
                     transactionsList.innerHTML = '<tr><td colspan="5" class="text-center">沒有交易紀錄</td></tr>';
                 }
+                result.transactions.forEach(tx => {
+                    transactionsList.insertAdjacentHTML('beforeend', `
+                        <tr>
+                            <td>${tx.date}</td>
+                            <td>${tx.type}</td>
+                            <td>${tx.currency}</td>
+                            <td class="${tx.amount > 0 ? 'text-success' : 'text-danger'}">${tx.amount.toFixed(2)}</td>
+                            <td>${tx.note || ''}</td>
+                        </tr>
+                    `);
+                });
+                txCursor = result.next_cursor;
             } catch (e) {
-                transactionsList.innerHTML = `<tr><td colspan="5" class="text-danger">載入失敗: ${e.message}</td></tr>`;
+                if (requestId === txRequestId) {
+                    transactionsList.innerHTML = `<tr><td colspan="5" class="text-danger">載入失敗: ${e.message}</td></tr>`;
+                }
+            } finally {
+                if (requestId === txRequestId) txLoading = false;
+            }
+            // 第一頁不足以產生捲軸時，繼續載入
+            if (requestId === txRequestId && txCursor && transactionsScrollContainer.clientHeight > 0
+                && transactionsScrollContainer.scrollHeight <= transactionsScrollContainer.clientHeight) {
+                await loadUserTransactions(userId, month, false);
             }
         };
 
+        transactionsScrollContainer.addEventListener('scroll', () => {
+            const nearBottom = transactionsScrollContainer.scrollTop + transactionsScrollContainer.clientHeight >= transactionsScrollContainer.scrollHeight - 100;
+            if (nearBottom) loadUserTransactions(USER_ID, monthFilterInput.value, false);
+        });
+
         
         // 儲存變更
         document.getElementById('btn-update-user').addEventListener('click', async () => {
@@ -4,6 +4,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     // --- 0. 全域變數 ---
     let currentUser = null;
     let myCurrencies = ['TWD']; // 預設
+    let lockedQuote = null; // 最近一次的換匯報價 { from, to, amount, quote_id, expires_at } (只能成交一次)
     
     // 圖表物件
     let cashFlowTotalChart = null;
@@ -245,36 +246,62 @@ document.addEventListener('DOMContentLoaded', async () => {
         } catch (error) { showStatus(`無法載入客戶列表: ${error.message}`, true); }
     }
 
-    async function refreshHistory() {
-        // (*** 不變 ***)
+    // (*** (新) 交易紀錄改為 keyset 分頁 + 無限捲動 ***)
+    const historyScrollContainer = historyTableBody.closest('div');
+    let historyCursor = null; // 下一頁游標 (null 表示沒有更多資料)
+    let historyLoading = false;
+    let historyRequestId = 0; // 篩選條件改變時，捨棄舊請求的結果
+
+    function renderHistoryRow(tx) {
+        const row = document.createElement('tr');
+        const amountClass = tx.amount > 0 ? 'text-success' : 'text-danger';
+        row.innerHTML = `
+            <td>${tx.date}</td>
+            <td>${tx.type}</td>
+            <td>${tx.currency}</td>
+            <td class="${amountClass}">${parseFloat(tx.amount).toFixed(2)}</td>
+            <td>${parseFloat(tx.balance_after).toFixed(2)}</td>
+            <td>${tx.note || ''}</td>
+            <td>${tx.exchange_rate ? parseFloat(tx.exchange_rate).toFixed(4) : 'N/A'}</td>
+        `;
+        return row;
+    }
+
+    async function loadHistoryPage(reset) {
+        if (!reset && (historyLoading || !historyCursor)) return;
+        const requestId = reset ? ++historyRequestId : historyRequestId;
+        historyLoading = true;
         try {
+            const params = new URLSearchParams();
             const month = historyMonthInput.value;
-            let apiUrl = '/api/my-transactions';
-            if (month) apiUrl += `?month=${month}`;
+            if (month) params.set('month', month);
+            if (!reset) params.set('cursor', historyCursor);
 
-            const response = await fetch(apiUrl);
-            const transactions = await response.json();
-            historyTableBody.innerHTML = '';
-            
-            if (transactions.length === 0) {
+            const response = await fetch(`/api/my-transactions?${params}`);
+            const result = await response.json();
+            if (requestId !== historyRequestId) return;
+            if (!result.success) { showStatus(`無法載入交易紀錄: ${result.error}`, true); return; }
+
+            if (reset) historyTableBody.innerHTML = '';
+            if (reset && result.transactions.length === 0) {
                 historyTableBody.innerHTML = '<tr><td colspan="7" class="text-center">沒有交易紀錄</td></tr>';
-            } else {
-                transactions.forEach(tx => {
-                    const row = document.createElement('tr');
-                    const amountClass = tx.amount > 0 ? 'text-success' : 'text-danger';
-                    row.innerHTML = `
-                        <td>${tx.date}</td>
-                        <td>${tx.type}</td>
-                        <td>${tx.currency}</td>
-                        <td class="${amountClass}">${parseFloat(tx.amount).toFixed(2)}</td>
-                        <td>${parseFloat(tx.balance_after).toFixed(2)}</td>
-                        <td>${tx.note || ''}</td>
-                        <td>${tx.exchange_rate ? parseFloat(tx.exchange_rate).toFixed(4) : 'N/A'}</td>
-                    `;
-                    historyTableBody.appendChild(row);
-                });
             }
+            result.transactions.forEach(tx => historyTableBody.appendChild(renderHistoryRow(tx)));
+            historyCursor = result.next_cursor;
         } catch (error) { showStatus(`無法載入交易紀錄: ${error.message}`, true); }
+        finally {
+            if (requestId === historyRequestId) historyLoading = false;
+        }
+        // 第一頁不足以產生捲軸時，繼續載入
+        if (requestId === historyRequestId && historyCursor && historyScrollContainer.clientHeight > 0
+            && historyScrollContainer.scrollHeight <= historyScrollContainer.clientHeight) {
+            await loadHistoryPage(false);
+        }
+    }
+
+    async function refreshHistory() {
+        historyCursor = null;
+        await loadHistoryPage(true);
     }
 
     async function refreshExchangeRates() {
@@ -373,6 +400,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     
     async function handleGetQuote(fromCurrency, toCurrency, fromAmount, quoteElement) {
         // (*** 不變 ***)
+        lockedQuote = null;
         if (!fromCurrency || !toCurrency || !fromAmount || fromAmount <= 0) {
             quoteElement.style.display = 'none'; return;
         }
@@ -387,6 +415,12 @@ document.addEventListener('DOMContentLoaded', async () => {
             if (result.success) {
                 const rateText = result.rate ? `(匯率: ${result.rate})` : '';
                 quoteElement.innerText = `約可兌換: ${parseFloat(result.to_amount).toFixed(2)} ${toCurrency} ${rateText}`;
+                if (result.quote_id) {
+                    lockedQuote = {
+                        from: fromCurrency, to: toCurrency, amount: parseFloat(fromAmount), quote_id: result.quote_id,
+                        expires_at: Date.now() + result.expires_in * 1000
+                    };
+                }
             } else {
                 quoteElement.innerText = `報價失敗: ${result.error}`;
             }
@@ -401,6 +435,11 @@ document.addEventListener('DOMContentLoaded', async () => {
             from_currency: fromCurrency, to_currency: toCurrency,
             from_amount: fromAmount, date: date || null
         };
+        // 報價仍有效時，以顯示的匯率成交
+        if (lockedQuote && lockedQuote.from === fromCurrency && lockedQuote.to === toCurrency
+                && parseFloat(fromAmount) <= lockedQuote.amount && Date.now() < lockedQuote.expires_at) {
+            payload.quote_id = lockedQuote.quote_id;
+        }
         if (!payload.from_amount || parseFloat(payload.from_amount) <= 0) {
             showStatus("金額 (必須 > 0) 為必填", true); return;
         }
@@ -413,6 +452,7 @@ document.addEventListener('DOMContentLoaded', async () => {
             const result = await res.json();
             if (result.success) {
                 showStatus(result.message, false);
+                lockedQuote = null;
                 await refreshAccountInfo(); 
                 await refreshHistory();
                 exchangeAmountInput.value = ''; exchangeDateInput.value = '';
@@ -462,9 +502,10 @@ document.addEventListener('DOMContentLoaded', async () => {
     }
 
     async function handleExportCsv() {
-        // (*** 不變 ***)
         showStatus("正在準備 CSV 檔案...", false);
-        window.open('/api/export-transactions', '_blank');
+        // 依目前的月份篩選匯出
+        const month = historyMonthInput.value;
+        window.open('/api/export-transactions' + (month ? `?month=${month}` : ''), '_blank');
     }
 
     // (*** 收支總覽函式 ***)
@@ -827,6 +868,10 @@ document.addEventListener('DOMContentLoaded', async () => {
     btnSaveBudgets.addEventListener('click', handleSaveBudgets);
     
     historyMonthInput.addEventListener('change', refreshHistory);
+    historyScrollContainer.addEventListener('scroll', () => {
+        const nearBottom = historyScrollContainer.scrollTop + historyScrollContainer.clientHeight >= historyScrollContainer.scrollHeight - 100;
+        if (nearBottom) loadHistoryPage(false);
+    });
 
 
     // --- 6. 頁面首次載入 ---
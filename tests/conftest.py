@@ -0,0 +1,44 @@
+# 共用的 pytest fixture
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import logic
+import rate_resolver
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """套用所有遷移的暫存資料庫 (不會動到 bank.db)"""
+    database.close_pool()
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "test.db"))
+    # 清除以資料庫內容為準的程序內快取 (每個測試都是新的資料庫)
+    monkeypatch.setattr(rate_resolver, "_manual", {"version": None, "rates": {}, "checked_at": 0.0})
+    monkeypatch.setattr(logic, "_profiles", {})
+    database.upgrade_db()
+    yield database
+    database.close_pool()
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    """已登入 alice (TWD 1000) 的 Flask test client；client.customer_id 為 alice 的 id"""
+    monkeypatch.setenv("CATEGORIZE_WORKER", "0")
+    monkeypatch.setenv("OUTBOX_WORKER", "0")
+    monkeypatch.setenv("SECRET_KEY", "test")
+    import app
+    logic.register_customer("alice", "pw", 1000, "2024-01-01")
+    conn = db.get_db_conn()
+    try:
+        customer_id = conn.execute("SELECT id FROM customers WHERE name = 'alice'").fetchone()['id']
+    finally:
+        conn.close()
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_name"], sess["customer_id"], sess["user_role"] = "alice", customer_id, "customer"
+    client.customer_id = customer_id
+    return client
@@ -0,0 +1,60 @@
+# ai_services.categorize_spending 的去重與分批
+#
+# 用法 (於專案根目錄):
+#   python -m pytest -q tests
+import threading
+
+import pytest
+
+import ai_services
+
+CATEGORIES = ["餐飲美食", "交通出行", "其他"]
+
+
+class FakeApi:
+    """代替 _post_chunk: 記錄送出的區塊，並讓含有 failing 中備註的區塊失敗"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.chunks = []
+        self.lock = threading.Lock()
+
+    def __call__(self, notes, categories):
+        with self.lock:
+            self.chunks.append(list(notes))
+        if self.failing & set(notes):
+            return None
+        return [{"labels": [f"label:{note}"], "scores": [0.9]} for note in notes]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(ai_services, "AI_BATCH_SIZE", 2)
+    fake = FakeApi()
+    monkeypatch.setattr(ai_services, "_post_chunk", fake)
+    return fake
+
+
+def labels(results):
+    return [None if result is None else result["labels"][0] for result in results]
+
+
+def test_duplicates_are_sent_once_and_results_stay_aligned(api):
+    notes = ["a", "b", "a", "c", "d", "b", "e"]
+    results = ai_services.categorize_spending(notes, CATEGORIES)
+    assert labels(results) == [f"label:{note}" for note in notes]
+    sent = sorted(note for chunk in api.chunks for note in chunk)
+    assert sent == ["a", "b", "c", "d", "e"]
+    assert all(len(chunk) <= 2 for chunk in api.chunks)
+
+
+def test_failed_chunk_only_affects_its_own_notes(api):
+    api.failing = {"c"} # 區塊 ["c", "d"] 失敗
+    results = ai_services.categorize_spending(["a", "b", "c", "d", "e", "d"], CATEGORIES)
+    assert labels(results) == ["label:a", "label:b", None, None, "label:e", None]
+
+
+def test_all_chunks_failed(api):
+    api.failing = {"a", "c"}
+    assert ai_services.categorize_spending(["a", "b", "c"], CATEGORIES) is None
+    assert ai_services.categorize_spending([], CATEGORIES) is None
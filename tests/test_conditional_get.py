@@ -0,0 +1,57 @@
+# app.conditional_get: 只有成功且完整的結果才帶 ETag (可被 304 沿用)
+#
+# 用法 (於專案根目錄):
+#   python -m pytest -q tests
+import pytest
+
+import ai_services
+import logic
+
+
+class FakeRemote:
+    """備註 -> 分類；不在 labels 中的備註視為遠端模型失敗"""
+
+    def __init__(self, labels):
+        self.labels = labels
+
+    def classify(self, notes, categories):
+        return [(self.labels.get(note), 0.9) for note in notes]
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    """只用遠端模型 (替身)，並清空分類快取"""
+    monkeypatch.setattr(ai_services, "CLASSIFIER_MODE", "remote")
+    monkeypatch.setitem(ai_services.ENGINES, "remote", FakeRemote({}))
+    monkeypatch.setattr(ai_services, "_lru", ai_services.OrderedDict())
+    return ai_services.ENGINES
+
+
+@pytest.mark.parametrize("url", [
+    "/api/cash-flow-analysis?month=2024-01",
+    "/api/analyze-spending?month=2024-01",
+    "/api/spending-vs-budget?month=2024-01",
+])
+def test_failed_ai_analysis_is_not_cached(client, remote, url):
+    # 背景分類已停用: 有備註的支出維持待分類，分析時才交給 AI
+    logic.withdraw_money(client.customer_id, 100, "2024-01-05", note="午餐")
+    logic.withdraw_money(client.customer_id, 50, "2024-01-06", note="計程車")
+    remote["remote"] = FakeRemote({"計程車": "交通出行"}) # 午餐分類失敗
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json["ai_failed"] is True
+    assert "ETag" not in response.headers
+
+    # AI 恢復後，同樣的資料版本會得到新的結果與 ETag
+    remote["remote"] = FakeRemote({"計程車": "交通出行", "午餐": "餐飲美食"})
+    response = client.get(url)
+    assert response.json["ai_failed"] is False
+    etag = response.headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_success_false_is_not_cached(client):
+    response = client.get("/api/net-worth-series?interval=zzz")
+    assert response.json["success"] is False
+    assert "ETag" not in response.headers
@@ -0,0 +1,209 @@
+# email_service 的 outbox: 租約、指數退避、放棄 (failed) 與壞信件的處理
+#
+# 用法 (於專案根目錄):
+#   python -m pytest -q tests
+import smtplib
+from types import SimpleNamespace
+
+import pytest
+
+import email_service
+import logic
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSmtpSession:
+    """記錄寄出的收件人；fail 中的地址以指定例外失敗"""
+
+    def __init__(self, fail=None):
+        self.sent = []
+        self.fail = fail or {}
+        self.closed = 0
+
+    def send(self, msg):
+        error = self.fail.get(msg['To'])
+        if error is not None:
+            raise error
+        self.sent.append(msg['To'])
+
+    def close(self):
+        self.closed += 1
+
+
+@pytest.fixture
+def clock(db, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(email_service, "time", SimpleNamespace(time=clock))
+    monkeypatch.setattr(email_service, "SMTP_SERVER", "smtp.test")
+    monkeypatch.setattr(email_service, "SMTP_FROM", "bank@example.com")
+    return clock
+
+
+def insert(to_address, attempts=0):
+    """直接寫入資料表 (模擬 enqueue 驗證加入前就存在的信件)"""
+    conn = email_service.get_db_conn()
+    try:
+        cursor = conn.execute(
+            "INSERT INTO email_outbox (to_address, subject, body, next_attempt_at, created_at, attempts) "
+            "VALUES (?, 's', 'b', 0, 0, ?)",
+            (to_address, attempts)
+        )
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def row(outbox_id):
+    conn = email_service.get_db_conn()
+    try:
+        return dict(conn.execute(
+            "SELECT status, attempts, next_attempt_at, body FROM email_outbox WHERE id = ?", (outbox_id,)
+        ).fetchone())
+    finally:
+        conn.close()
+
+
+def test_sent_rows_are_not_resent(clock):
+    first, second = insert("a@example.com"), insert("b@example.com")
+    session = FakeSmtpSession()
+    assert email_service.drain_outbox(session) == 2
+    assert email_service.drain_outbox(session) == 0
+    clock.now += email_service.OUTBOX_LEASE_SECONDS + 1
+    assert email_service.drain_outbox(session) == 0
+    assert session.sent == ["a@example.com", "b@example.com"]
+    assert row(first)["status"] == row(second)["status"] == "sent"
+    assert row(first)["body"] == ""
+
+
+def test_bad_row_only_fails_itself(clock):
+    good = insert("good@example.com")
+    bad = insert("bad@example.com\nBcc: x@example.com") # EmailMessage 無法建立
+    after = insert("after@example.com")
+    session = FakeSmtpSession()
+
+    assert email_service.drain_outbox(session) == 3
+    assert session.sent == ["good@example.com", "after@example.com"]
+    assert row(good)["status"] == row(after)["status"] == "sent"
+    assert row(bad)["status"] == "pending"
+    assert row(bad)["attempts"] == 1
+    assert row(bad)["next_attempt_at"] == clock.now + email_service.OUTBOX_BACKOFF_SECONDS
+
+    # 租約到期後也不會重寄已寄出的信件
+    clock.now += email_service.OUTBOX_LEASE_SECONDS + 1
+    email_service.drain_outbox(session)
+    assert session.sent == ["good@example.com", "after@example.com"]
+
+
+def test_backoff_then_failed(clock, monkeypatch):
+    monkeypatch.setattr(email_service, "OUTBOX_MAX_ATTEMPTS", 3)
+    outbox_id = insert("nobody@example.com")
+    refused = smtplib.SMTPRecipientsRefused({"nobody@example.com": (550, b"no such user")})
+    session = FakeSmtpSession(fail={"nobody@example.com": refused})
+    backoff = email_service.OUTBOX_BACKOFF_SECONDS
+
+    email_service.drain_outbox(session)
+    assert row(outbox_id) == {"status": "pending", "attempts": 1, "next_attempt_at": clock.now + backoff, "body": "b"}
+
+    # 退避期間內不會再試
+    clock.now += backoff - 1
+    assert email_service.drain_outbox(session) == 0
+
+    clock.now += 1
+    email_service.drain_outbox(session)
+    assert row(outbox_id)["attempts"] == 2
+    assert row(outbox_id)["next_attempt_at"] == clock.now + backoff * 2
+
+    clock.now += backoff * 2
+    email_service.drain_outbox(session)
+    assert row(outbox_id)["status"] == "failed"
+    assert row(outbox_id)["attempts"] == 3
+
+    clock.now += 86400
+    assert email_service.drain_outbox(session) == 0
+
+
+def test_connection_error_defers_rest_of_batch(clock):
+    first, second = insert("down@example.com"), insert("next@example.com")
+    session = FakeSmtpSession(fail={"down@example.com": ConnectionRefusedError("refused")})
+    email_service.drain_outbox(session)
+    assert row(first)["attempts"] == 1
+    assert row(second) == {
+        "status": "pending", "attempts": 0,
+        "next_attempt_at": clock.now + email_service.OUTBOX_BACKOFF_SECONDS, "body": "b",
+    }
+    assert session.closed == 1
+
+
+def test_expired_lease_is_reclaimed(clock):
+    outbox_id = insert("late@example.com")
+    conn = email_service.get_db_conn()
+    try:
+        email_service._claim_batch(conn, 10) # 取出後程序中途結束
+    finally:
+        conn.close()
+    assert row(outbox_id)["status"] == "sending"
+
+    session = FakeSmtpSession()
+    assert email_service.drain_outbox(session) == 0 # 租約未到期
+    clock.now += email_service.OUTBOX_LEASE_SECONDS
+    assert email_service.drain_outbox(session) == 1
+    assert session.sent == ["late@example.com"]
+    assert row(outbox_id)["status"] == "sent"
+
+
+class Crash(BaseException):
+    pass
+
+
+def test_results_are_recorded_when_the_loop_is_interrupted(clock):
+    sent_id, crash_id = insert("a@example.com"), insert("crash@example.com")
+    session = FakeSmtpSession(fail={"crash@example.com": Crash()})
+    with pytest.raises(Crash):
+        email_service.drain_outbox(session)
+    assert row(sent_id)["status"] == "sent"
+    assert row(crash_id)["status"] == "sending" # 租約到期後再試
+
+
+def test_purge_removes_old_finished_rows(clock):
+    sent_id, pending_id = insert("a@example.com"), insert("b@example.com\nBcc: x@example.com")
+    email_service.drain_outbox(FakeSmtpSession())
+    clock.now += email_service.OUTBOX_RETENTION_SECONDS + 1
+    assert email_service.purge_outbox() == 1
+    conn = email_service.get_db_conn()
+    try:
+        ids = [r['id'] for r in conn.execute("SELECT id FROM email_outbox")]
+    finally:
+        conn.close()
+    assert ids == [pending_id]
+
+
+def test_enqueue_rejects_invalid_address(db):
+    conn = email_service.get_db_conn()
+    try:
+        assert email_service.enqueue_email(conn, "a@example.com\nBcc: x@example.com", "s", "b") is False
+        assert email_service.enqueue_email(conn, "a@example.com", "s", "b") is True
+        conn.commit()
+        assert conn.execute("SELECT COUNT(*) FROM email_outbox").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
+def test_update_my_email_validates_address(db):
+    logic.register_customer("alice", "pw", 0, "2024-01-01")
+    conn = email_service.get_db_conn()
+    try:
+        customer_id = conn.execute("SELECT id FROM customers WHERE name = 'alice'").fetchone()['id']
+    finally:
+        conn.close()
+    assert logic.update_my_email(customer_id, "alice@example.com\nBcc: x@example.com")["success"] is False
+    assert logic.update_my_email(customer_id, "not-an-address")["success"] is False
+    assert logic.update_my_email(customer_id, " alice@example.com ") == {"success": True, "email": "alice@example.com"}
+    assert logic.update_my_email(customer_id, "") == {"success": True, "email": None}
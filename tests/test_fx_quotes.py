@@ -0,0 +1,113 @@
+# 換匯報價 (rate_resolver.lock_quote / consume_quote): 綁定使用者、幣別與金額，只能成交一次
+#
+# 用法 (於專案根目錄):
+#   python -m pytest -q tests
+from types import SimpleNamespace
+
+import pytest
+
+import database
+import logic
+import rate_resolver
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_resolver, "time", SimpleNamespace(time=clock))
+    return clock
+
+
+@pytest.fixture
+def customers(db):
+    logic.register_customer("alice", "pw", 1000, "2024-01-01")
+    logic.register_customer("bob", "pw", 1000, "2024-01-01")
+    rate_resolver.set_manual_rates({"TWD_USD": 0.03})
+    conn = db.get_db_conn()
+    try:
+        return {row['name']: row['id'] for row in conn.execute("SELECT id, name FROM customers")}
+    finally:
+        conn.close()
+
+
+def quote(customer_id, amount=300, from_currency="TWD", to_currency="USD", rate=0.05):
+    # 報價的匯率刻意與目前的手動匯率不同，以分辨成交時用的是哪一個
+    quote_id, _ = rate_resolver.lock_quote(customer_id, from_currency, to_currency, amount * 100,
+                                           {"rate": rate, "source": "manual"})
+    return quote_id
+
+
+def exchange(customer_id, amount, quote_id, from_currency="TWD", to_currency="USD"):
+    return logic.exchange_currency(customer_id, from_currency, to_currency, amount, "2024-01-02", quote_id=quote_id)
+
+
+def quote_row(quote_id):
+    conn = database.get_db_conn()
+    try:
+        return conn.execute("SELECT used_at FROM fx_quotes WHERE quote_id = ?", (quote_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_quote_is_used_once_at_the_quoted_rate(customers, clock):
+    quote_id = quote(customers["alice"])
+    result = exchange(customers["alice"], 300, quote_id)
+    assert result["success"]
+    assert result["to_wallet_balance"] == 15.0 # 300 * 0.05，不是目前的 0.03
+    assert quote_row(quote_id)["used_at"] == clock.now
+
+    again = exchange(customers["alice"], 300, quote_id)
+    assert again == {"success": False, "error": "報價已失效，請重新報價"}
+
+
+def test_amount_is_capped_by_the_quote(customers, clock):
+    quote_id = quote(customers["alice"], amount=300)
+    assert not exchange(customers["alice"], 301, quote_id)["success"]
+    assert exchange(customers["alice"], 200, quote_id)["success"]
+
+
+@pytest.mark.parametrize("customer, pair", [
+    ("bob", ("TWD", "USD")),
+    ("alice", ("USD", "TWD")),
+    ("alice", ("TWD", "JPY")),
+])
+def test_quote_is_bound_to_customer_and_pair(customers, clock, customer, pair):
+    quote_id = quote(customers["alice"])
+    assert not exchange(customers[customer], 100, quote_id, *pair)["success"]
+    assert quote_row(quote_id)["used_at"] is None
+
+
+def test_expired_quote(customers, clock):
+    quote_id = quote(customers["alice"])
+    clock.now += rate_resolver.QUOTE_TTL_SECONDS
+    assert exchange(customers["alice"], 100, quote_id) == {"success": False, "error": "報價已失效，請重新報價"}
+
+
+def test_failed_exchange_keeps_the_quote(customers, clock):
+    quote_id = quote(customers["alice"], amount=5000)
+    assert exchange(customers["alice"], 5000, quote_id)["error"] == "TWD 餘額不足"
+    assert quote_row(quote_id)["used_at"] is None
+    assert exchange(customers["alice"], 500, quote_id)["success"]
+
+
+def test_quotes_are_shared_across_processes(customers, clock):
+    # 報價只存在資料庫: 另一個 worker (另一條連線) 也能成交
+    quote_id = quote(customers["alice"])
+    database.close_pool()
+    assert exchange(customers["alice"], 100, quote_id)["success"]
+
+
+def test_expired_quotes_are_swept(customers, clock, monkeypatch):
+    monkeypatch.setattr(rate_resolver, "_last_quote_sweep", clock.now)
+    old = quote(customers["alice"])
+    clock.now += rate_resolver.QUOTE_SWEEP_SECONDS
+    quote(customers["alice"])
+    assert quote_row(old) is None
@@ -0,0 +1,52 @@
+# 本機 n-gram 分類模型
+#
+# 用法 (於專案根目錄):
+#   python -m pytest -q tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_classifier import NgramClassifier
+
+CATEGORIES = ["餐飲美食", "交通出行", "休閒娛樂", "網路購物", "帳單繳費", "家居生活", "其他"]
+
+
+def classify_one(model, text):
+    return model.classify([text])[0]
+
+
+def test_seed_keywords():
+    model = NgramClassifier.with_seeds(CATEGORIES)
+    assert classify_one(model, "計程車")[0] == "交通出行"
+    assert classify_one(model, "電費")[0] == "帳單繳費"
+
+
+def test_repayment_is_not_transport():
+    # "錢" 也出現在 "油錢" 中，不應因此判為交通出行
+    model = NgramClassifier.with_seeds(CATEGORIES)
+    assert classify_one(model, "還錢 (轉給: alice)")[0] == "其他"
+
+
+def test_unknown_note_has_zero_confidence():
+    model = NgramClassifier.with_seeds(CATEGORIES)
+    assert classify_one(model, "xq") == ("其他", 0.0)
+
+
+def test_learn_updates_model_incrementally():
+    model = NgramClassifier.with_seeds(CATEGORIES)
+    assert classify_one(model, "牙醫") == ("其他", 0.0)
+    model.learn("牙醫", "家居生活")
+    category, confidence = classify_one(model, "牙醫")
+    assert category == "家居生活"
+    assert confidence > 0.5
+    assert model.samples == 1
+
+
+def test_prior_breaks_ties_toward_frequent_category():
+    model = NgramClassifier(["甲", "乙"])
+    model.learn("ab cd", "甲")
+    model.learn("ab", "乙")
+    model.learn("cd", "乙")
+    # "ab" 在兩個分類的次數與總數都相同，但乙的訓練筆數較多
+    assert classify_one(model, "ab")[0] == "乙"
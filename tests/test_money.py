@@ -0,0 +1,64 @@
+# money 的金額解析與範圍檢查
+#
+# 用法 (於專案根目錄):
+#   python -m pytest -q tests
+import os
+import sys
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logic
+import money
+
+
+@pytest.fixture(autouse=True)
+def scales(monkeypatch):
+    # 不讀資料庫的 currency_scales
+    monkeypatch.setattr(money, "_scales", {"TWD": 100, "JPY": 1})
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("100", Decimal("100")),
+    (" 12.34 ", Decimal("12.34")),
+    (5, Decimal("5")),
+    (None, Decimal(0)),
+    ("", Decimal(0)),
+    ("abc", Decimal(0)),
+])
+def test_parse_amount(value, expected):
+    assert money.parse_amount(value) == expected
+
+
+@pytest.mark.parametrize("value", ["inf", "-inf", "Infinity", "nan", "NaN", "sNaN", float("inf"), float("nan")])
+def test_parse_amount_rejects_non_finite(value):
+    assert money.parse_amount(value) == 0
+
+
+@pytest.mark.parametrize("value", ["1e30", "-1e30", "1e13000", str(money.MAX_AMOUNT + 1)])
+def test_parse_amount_rejects_out_of_range(value):
+    assert money.parse_amount(value) == 0
+
+
+def test_parse_amount_accepts_max():
+    assert money.parse_amount(str(money.MAX_AMOUNT)) == money.MAX_AMOUNT
+    assert money.to_minor(money.MAX_AMOUNT, "TWD") == money.MAX_MINOR_UNITS
+
+
+@pytest.mark.parametrize("value", [Decimal("1e30"), "1e30", Decimal("Infinity"), Decimal("NaN"), float("inf")])
+def test_to_minor_out_of_range(value):
+    assert money.to_minor(value, "TWD") == 0
+
+
+def test_to_minor_rounding():
+    assert money.to_minor(Decimal("12.345"), "TWD") == 1235
+    assert money.to_minor(Decimal("99.5"), "JPY") == 100
+
+
+@pytest.mark.parametrize("value", ["1e30", "inf", "nan"])
+def test_deposit_rejects_invalid_amount(value):
+    # 檢查在寫入資料庫之前就回報一般的金額錯誤 (不會拋出例外變成 500)
+    result = logic.deposit_money(1, money.parse_amount(value), "2024-01-01")
+    assert result == {"success": False, "error": "金額必須 > 0"}
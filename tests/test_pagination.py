@@ -0,0 +1,94 @@
+# 交易紀錄的 keyset 分頁: 以 (date, id) 為游標，翻頁時不重複也不遺漏
+#
+# 用法 (於專案根目錄):
+#   python -m pytest -q tests
+import random
+
+import pytest
+
+import database
+import logic
+
+
+@pytest.fixture
+def customer(db):
+    """兩個錢包，交易日期大量重複 (同一天多筆、跨錢包交錯)"""
+    conn = db.get_db_conn()
+    try:
+        conn.execute("INSERT INTO customers (name, password, role) VALUES ('alice', 'x', 'customer')")
+        customer_id = conn.execute("SELECT id FROM customers WHERE name = 'alice'").fetchone()['id']
+        for currency in ('TWD', 'USD'):
+            conn.execute("INSERT INTO wallets (customer_id, currency, balance) VALUES (?, ?, 0)", (customer_id, currency))
+        conn.commit()
+        wallet_ids = [row['id'] for row in conn.execute("SELECT id FROM wallets ORDER BY id")]
+        rng = random.Random(7)
+        rows = [
+            (rng.choice(wallet_ids), f"2024-01-{rng.randint(1, 4):02d}", '存款', 100, 100, f"tx{i}", None)
+            for i in range(57)
+        ]
+        conn.execute("BEGIN IMMEDIATE")
+        logic._post_transactions(conn, rows)
+        conn.commit()
+        return customer_id
+    finally:
+        conn.close()
+
+
+def expected_ids(customer_id, month=None):
+    conn = database.get_db_conn()
+    try:
+        sql = ("SELECT t.id FROM transactions t JOIN wallets w ON t.wallet_id = w.id WHERE w.customer_id = ? "
+               + ("AND t.date >= ? AND t.date < ? " if month else "") + "ORDER BY t.date DESC, t.id DESC")
+        params = (customer_id, *logic._month_bounds(month)) if month else (customer_id,)
+        return [row['id'] for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def walk(customer_id, limit, **filters):
+    ids, cursor, pages = [], None, 0
+    while True:
+        page = logic.get_transactions_page(customer_id, cursor=cursor, limit=limit, **filters)
+        assert page["success"]
+        assert len(page["transactions"]) <= limit
+        ids += [tx['id'] for tx in page["transactions"]]
+        pages += 1
+        assert pages <= 100, "游標沒有前進"
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+
+@pytest.mark.parametrize("limit", [1, 2, 7, 14, 57, 200])
+def test_pages_neither_repeat_nor_skip(customer, limit):
+    ids, pages = walk(customer, limit)
+    assert ids == expected_ids(customer)
+    assert pages == max(1, -(-57 // limit))
+
+
+def test_page_boundary_inside_a_day(customer):
+    # 第一頁剛好在同一天的兩筆交易之間結束: 下一頁從同一天剩下的交易開始
+    first = logic.get_transactions_page(customer, limit=3)
+    last = first["transactions"][-1]
+    second = logic.get_transactions_page(customer, cursor=first["next_cursor"], limit=3)
+    expected = expected_ids(customer)
+    assert [tx['id'] for tx in first["transactions"] + second["transactions"]] == expected[:6]
+    assert first["next_cursor"] == f"{last['date']}|{last['id']}"
+
+
+def test_month_filter_with_cursor(customer):
+    conn = database.get_db_conn()
+    try:
+        wallet_id = conn.execute("SELECT id FROM wallets ORDER BY id LIMIT 1").fetchone()['id']
+        conn.execute("BEGIN IMMEDIATE")
+        logic._post_transactions(conn, [(wallet_id, "2024-02-01", '存款', 1, 1, "feb", None)])
+        conn.commit()
+    finally:
+        conn.close()
+    ids, _ = walk(customer, 5, month="2024-01")
+    assert ids == expected_ids(customer, "2024-01")
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "2024-01-01|x", "|"])
+def test_invalid_cursor(customer, cursor):
+    assert logic.get_transactions_page(customer, cursor=cursor)["success"] is False
@@ -0,0 +1,40 @@
+# /api/quote 與 /api/quotes 的金額解析
+#
+# 用法 (於專案根目錄):
+#   python -m pytest -q tests
+import json
+
+import pytest
+
+import exchange_rate
+
+
+@pytest.fixture(autouse=True)
+def rates(monkeypatch):
+    monkeypatch.setattr(exchange_rate, "get_matrix", lambda: {"TWD": {"USD": 0.03}, "USD": {"TWD": 32.0}})
+
+
+def strict_json(response):
+    """回應必須是標準 JSON (不含 Infinity / NaN)"""
+    def reject(constant):
+        raise ValueError(f"非法的 JSON 數值 {constant}")
+    return json.loads(response.get_data(as_text=True), parse_constant=reject)
+
+
+@pytest.mark.parametrize("amount", ["inf", "-inf", "nan", "1e400", "abc"])
+def test_batch_quotes_skip_non_finite_amounts(client, amount):
+    response = client.post("/api/quotes", json={"quotes": [
+        {"from": "TWD", "to": "USD", "amount": amount},
+        {"from": "TWD", "to": "USD", "amount": 100},
+    ]})
+    body = strict_json(response)
+    bad, good = body["quotes"]
+    assert bad["success"] is False and bad["error"] == "參數不足"
+    assert good["success"] is True and good["to_amount"] == pytest.approx(3.0)
+
+
+@pytest.mark.parametrize("amount", ["inf", "nan"])
+def test_single_quote_rejects_non_finite_amount(client, amount):
+    response = client.get(f"/api/quote?from=TWD&to=USD&amount={amount}")
+    assert response.status_code == 400
+    assert strict_json(response)["success"] is False
@@ -0,0 +1,92 @@
+# 每日 / 每月收支彙總表: 寫入時累加、rebuild_rollups 與遷移 0014 的回填結果必須一致
+#
+# 用法 (於專案根目錄):
+#   python -m pytest -q tests
+import os
+import random
+
+import pytest
+
+import database
+import logic
+
+TYPES = ['存款', '開戶', '轉入', '換匯轉入', '提款', '轉出', '換匯轉出', '利息']
+NOTES = [None, '', '午餐', '管理員調整', '管理員', '給 管理員', 'TWD 轉給 bob']
+
+
+@pytest.fixture
+def wallets(db):
+    conn = db.get_db_conn()
+    try:
+        conn.execute("INSERT INTO customers (name, password, role) VALUES ('alice', 'x', 'customer')")
+        customer_id = conn.execute("SELECT id FROM customers WHERE name = 'alice'").fetchone()['id']
+        for currency in ('TWD', 'USD'):
+            conn.execute("INSERT INTO wallets (customer_id, currency, balance) VALUES (?, ?, 0)", (customer_id, currency))
+        conn.commit()
+        return [row['id'] for row in conn.execute("SELECT id FROM wallets ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def post_random_transactions(wallet_ids, count=2000, seed=1):
+    """以 logic._post_transactions 分批寫入 (與正式的寫入路徑相同，會同時累加彙總表)"""
+    rng = random.Random(seed)
+    rows = [
+        (rng.choice(wallet_ids), f"2024-{rng.randint(1, 3):02d}-{rng.randint(1, 28):02d}", rng.choice(TYPES),
+         rng.choice([-1, 0, 1]) * rng.randint(1, 100000), 0, rng.choice(NOTES), None)
+        for _ in range(count)
+    ]
+    conn = database.get_db_conn()
+    try:
+        for i in range(0, len(rows), 97):
+            conn.execute("BEGIN IMMEDIATE")
+            logic._post_transactions(conn, rows[i:i + 97])
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def snapshot():
+    conn = database.get_db_conn()
+    try:
+        return (
+            sorted(map(tuple, conn.execute("SELECT * FROM daily_flow_rollups"))),
+            sorted(map(tuple, conn.execute("SELECT * FROM monthly_flow_rollups"))),
+        )
+    finally:
+        conn.close()
+
+
+def test_write_time_rollups_match_rebuild(wallets):
+    post_random_transactions(wallets)
+    incremental = snapshot()
+    assert incremental[0] and incremental[1]
+
+    assert logic.rebuild_rollups() == {"success": True, "transactions": 2000}
+    assert snapshot() == incremental
+
+
+def test_backfill_migration_matches_rebuild(wallets):
+    post_random_transactions(wallets, seed=2)
+    assert logic.rebuild_rollups()["success"]
+    rebuilt = snapshot()
+
+    path = os.path.join(database.MIGRATIONS_DIR, "0014_backfill_flow_rollups.sql")
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+    conn = database.get_db_conn()
+    try:
+        conn.executescript(f"BEGIN;\n{sql}\nCOMMIT;")
+    finally:
+        conn.close()
+    assert snapshot() == rebuilt
+
+
+def test_monthly_rollups_sum_daily(wallets):
+    post_random_transactions(wallets, count=500, seed=3)
+    daily, monthly = snapshot()
+    totals = {}
+    for wallet_id, day, source, *values in daily:
+        key = (wallet_id, day[:7], source)
+        totals[key] = [a + b for a, b in zip(totals.get(key, [0, 0, 0, 0]), values)]
+    assert {(w, m, s): list(v) for w, m, s, *v in monthly} == totals
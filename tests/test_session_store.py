@@ -0,0 +1,121 @@
+# SQLite session (session_store.SqliteSessionInterface)
+#
+# 用法 (於專案根目錄):
+#   python -m pytest -q tests
+import pytest
+from flask import Flask, jsonify, session
+
+import database
+import session_store
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "test"
+    app.session_interface = session_store.SqliteSessionInterface()
+
+    @app.route("/login")
+    def login():
+        session["user_name"] = "alice"
+        return "ok"
+
+    @app.route("/read")
+    def read():
+        return jsonify(dict(session))
+
+    @app.route("/logout")
+    def logout():
+        session.clear()
+        return "ok"
+
+    return app
+
+
+@pytest.fixture
+def app(db, monkeypatch):
+    monkeypatch.setattr(session_store, "SESSION_CACHE_SECONDS", 0) # 每次都讀資料庫
+    return make_app()
+
+
+def session_rows():
+    conn = database.get_db_conn()
+    try:
+        return [dict(row) for row in conn.execute("SELECT sid, data, expires_at FROM sessions")]
+    finally:
+        conn.close()
+
+
+def cookie(client, app):
+    return client.get_cookie(app.config["SESSION_COOKIE_NAME"]).value
+
+
+def test_round_trip_stores_only_a_signed_id_in_the_cookie(app):
+    client = app.test_client()
+    client.get("/login")
+    assert client.get("/read").json == {"user_name": "alice"}
+    [row] = session_rows()
+    assert "alice" in row["data"]
+    value = cookie(client, app)
+    assert "alice" not in value
+    assert value.startswith(row["sid"] + ".")
+
+
+def test_session_is_shared_between_workers(app):
+    client = app.test_client()
+    client.get("/login")
+    other = make_app() # 另一個 worker: 不同的 SessionInterface (各自的快取)
+    other_client = other.test_client()
+    other_client.set_cookie(app.config["SESSION_COOKIE_NAME"], cookie(client, app))
+    assert other_client.get("/read").json == {"user_name": "alice"}
+
+
+def test_forged_cookie_is_ignored(app):
+    client = app.test_client()
+    client.get("/login")
+    sid = session_rows()[0]["sid"]
+    client.set_cookie(app.config["SESSION_COOKIE_NAME"], f"{sid}.forged-signature")
+    assert client.get("/read").json == {}
+
+
+def test_logout_deletes_the_row(app):
+    client = app.test_client()
+    client.get("/login")
+    client.get("/logout")
+    assert session_rows() == []
+    assert client.get("/read").json == {}
+
+
+def test_read_only_requests_do_not_write(app):
+    client = app.test_client()
+    client.get("/login")
+    before = session_rows()
+    client.get("/read")
+    assert session_rows() == before
+
+
+def test_expired_session(app):
+    client = app.test_client()
+    client.get("/login")
+    conn = database.get_db_conn()
+    try:
+        conn.execute("UPDATE sessions SET expires_at = 0")
+        conn.commit()
+    finally:
+        conn.close()
+    assert client.get("/read").json == {}
+    assert session_store.sweep_expired_sessions() == 1
+    assert session_rows() == []
+
+
+def test_session_is_extended_after_half_its_ttl(app):
+    client = app.test_client()
+    client.get("/login")
+    conn = database.get_db_conn()
+    try:
+        conn.execute("UPDATE sessions SET expires_at = expires_at - ?", (session_store.SESSION_TTL_SECONDS * 0.6,))
+        conn.commit()
+    finally:
+        conn.close()
+    stale = session_rows()[0]["expires_at"]
+    assert client.get("/read").json == {"user_name": "alice"}
+    assert session_rows()[0]["expires_at"] > stale + session_store.SESSION_TTL_SECONDS * 0.5